@@ -8,7 +8,7 @@ from utils.flyte import DominoTask, Input, Output
 from typing import TypeVar
 
 @workflow(failure_policy=WorkflowFailurePolicy.FAIL_AFTER_EXECUTABLE_NODES_COMPLETE)
-def Flow(sdtm_data_path: str):
+def Flow(sdtm_data_path: str) -> PDFFile:
     """
     This script mocks a sample clinical trial using Domino Flows. 
 
@@ -19,11 +19,12 @@ def Flow(sdtm_data_path: str):
     pyflyte run --copy-all --remote ADaM_TFL.py Flow --sdtm_data_path "/mnt/imported/data/snapshots/sdtm-blind/1"
 
     :param sdtm_data_path: The root directory of your SDTM dataset
-    :return: A list of PDF files containing the TFL reports
+    :return: A single PDF file containing all of the TFL reports
     """
     # Create task that generates ADSL dataset. This will run a unique Domino job and return its outputs.
     adsl = create_adam_data(
         name="ADSL", 
+        packed=True, # Only read by later tasks, so passed between them as compressed artifacts when DMV_ARTIFACTS is set
         command="prod/adam/adsl.sas",
         environment="SAS Analytics Pro", # Optional parameter. If not set, then the default for the project will be used.
         hardware_tier= "Medium - [AWS US]", # Optional parameter. If not set, then the default for the project will be used.
@@ -32,6 +33,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADAE dataset. 
     adae = create_adam_data(
         name="ADAE", 
+        packed=True,
         command="prod/adam/adae.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -41,6 +43,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADVS dataset. 
     advs = create_adam_data(
         name="ADVS", 
+        packed=True,
         command="prod/adam/advs.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -50,6 +53,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADCM dataset. 
     adcm = create_adam_data(
         name="ADCM", 
+        packed=True,
         command="prod/adam/adcm.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -59,6 +63,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADEF dataset. 
     adef = create_adam_data(
         name="ADEF", 
+        packed=True,
         command="prod/adam/adef.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -68,6 +73,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADLB dataset. 
     adlb = create_adam_data(
         name="ADLB", 
+        packed=True,
         command="prod/adam/adlb.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -77,6 +83,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates ADMH dataset. 
     admh = create_adam_data(
         name="ADMH", 
+        packed=True,
         command="prod/adam/admh.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Medium - [AWS US]",
@@ -94,6 +101,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates TFL report from T_AE_REL table.
     t_ae_rel = create_tfl_report(
         name="T_AE_REL", 
+        packed=True,
         command="prod/tfl/t_ae_rel.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -102,6 +110,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates TFL report from T_VSCAT table
     t_vscat = create_tfl_report(
         name="T_VSCAT", 
+        packed=True,
         command="prod/tfl/t_ae_rel.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -110,6 +119,7 @@ def Flow(sdtm_data_path: str):
     # Create task that generates TFL report from T_CONMED table
     t_conmed = create_tfl_report(
         name="T_CONMED", 
+        packed=True,
         command="prod/tfl/t_conmed.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -118,6 +128,7 @@ def Flow(sdtm_data_path: str):
      # Create task that generates TFL report from T_DEMOG table
     t_demog = create_tfl_report(
         name="T_DEMOG", 
+        packed=True,
         command="prod/tfl/t_demog.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -126,6 +137,7 @@ def Flow(sdtm_data_path: str):
      # Create task that generates TFL report from T_EFF table
     t_eff = create_tfl_report(
         name="T_EFF", 
+        packed=True,
         command="prod/tfl/t_eff.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -134,6 +146,7 @@ def Flow(sdtm_data_path: str):
      # Create task that generates TFL report from T_SAF table
     t_saf = create_tfl_report(
         name="T_SAF", 
+        packed=True,
         command="prod/tfl/t_saf.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -142,6 +155,7 @@ def Flow(sdtm_data_path: str):
       # Create task that generates TFL report from T_VITALS table
     t_vitals = create_tfl_report(
         name="T_VITALS", 
+        packed=True,
         command="prod/tfl/t_vitals.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -150,6 +164,7 @@ def Flow(sdtm_data_path: str):
      # Create task that generates TFL report from L_MEDHIST list
     l_medhist = create_tfl_report(
         name="L_MEDHIST", 
+        packed=True,
         command="prod/tfl/l_medhist.sas", 
         environment="SAS Analytics Pro",
         hardware_tier= "Small - [AWS US]",
@@ -191,6 +206,9 @@ def Flow(sdtm_data_path: str):
             Input(name="t_vitals", type=PDFFile, value=t_vitals),
             Input(name="t_vscat", type=PDFFile, value=t_vscat),
             Input(name="l_medhist", type=PDFFile, value=l_medhist)
+        ],
+        outputs=[
+            Output(name="report", type=PDFFile)
         ]
     )
-    return merge_pdf
\ No newline at end of file
+    return merge_pdf["report"]
\ No newline at end of file
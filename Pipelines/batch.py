@@ -0,0 +1,161 @@
+"""
+Run the multijob pipelines of several reporting efforts from a single driver job.
+
+Each section of the batch config is one study. The section name is the project name, and
+the keys are:
+
+    project_id:   ID of the study's Domino project (required)
+    cfg:          multijob config for the study, e.g. /mnt/imported/code/CDISC02_RE/Pipelines/jobs.cfg (required)
+    weight:       share of the global job limit the study gets when several studies have work ready (default 1)
+    queue_limit:  maximum queued jobs in the study's project, as in multijob (default 10)
+
+For example:
+
+    [CDISC01_RE_FLOW]
+    project_id: 65ef5dc8d1d0fb7a7ba75200
+    cfg: Pipelines/jobs.cfg
+
+    [CDISC02_RE]
+    project_id: 65ef5dc8d1d0fb7a7ba75300
+    cfg: /mnt/imported/code/CDISC02_RE/Pipelines/jobs_prod.cfg
+    weight: 2
+
+On every tick, each study whose project is not locked and below its queue limit may submit
+one ready task, as multijob does. The number of jobs the driver has queued or running across
+all studies is capped by --max-active. When the cap leaves room for only some of the studies,
+the ones with the fewest active jobs for their weight go first.
+
+Tier and environment lookups are cached in multijob and shared by all studies. A failed study
+is reported and the others carry on; the driver exits with an error if any study failed.
+Dataset cleanup (DMV_PREP), controlled-execution snapshots (DMV_ISCX) and worker pools (DMV_WORKERS)
+act on the driver's own project, so they are not used in batch mode.
+
+Usage: python Pipelines/batch.py <batch cfg> [--max-active N] [--tick-freq SECONDS]
+"""
+import argparse
+import configparser
+import os
+import sys
+import time
+
+from multijob import DATASET_ROOT, DOMINO_PROJECT_NAME, PipelineRunner, build_dag, check_environment
+
+FINAL_STATES = ('Unsubmitted', 'Succeeded', 'Skipped', 'Error', 'Failed', 'Stopped')
+
+# Each study's live state is written here, one file per study
+BATCH_STATUS_DIR = os.environ.get('MULTIJOB_BATCH_STATUS_DIR', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/multijob/batch')
+
+
+class Study:
+    """A reporting effort's pipeline, and its share of the batch"""
+    def __init__(self, name, runner, weight=1):
+        self.name = name
+        self.runner = runner
+        self.weight = weight
+        self.status = 'Running'
+        self.active = 0
+
+    def count_active_jobs(self):
+        """Count the study's queued and running jobs, once per round"""
+        self.active = sum(1 for task in self.runner.dag.tasks.values() if task.status() not in FINAL_STATES)
+        return self.active
+
+    def share(self):
+        return self.active / self.weight
+
+
+def load_studies(batch_cfg_path, tick_freq):
+    c = configparser.ConfigParser(allow_no_value=False)
+    c.read(batch_cfg_path)
+    if len(c.sections()) == 0:
+        raise Exception("Empty batch config provided")
+
+    studies = []
+    for name in c.sections():
+        cfg_path = c.get(name, 'cfg')
+        if not os.path.exists(cfg_path):
+            sys.exit(f"Empty or missing config file for {name}: {cfg_path}")
+        dag = build_dag(cfg_path)
+        print(f'{name}:\n{dag}')
+        dag.validate_dag()
+        runner = PipelineRunner(
+            dag,
+            tick_freq=tick_freq,
+            queue_limit=c.getint(name, 'queue_limit', fallback=10),
+            project_id=c.get(name, 'project_id'),
+            project_name=name,
+            status_path=f'{BATCH_STATUS_DIR}/{name}.json',
+            durations_path=f'{BATCH_STATUS_DIR}/{name}.durations.json',
+            # Worker pool queues live on each study's own dataset, which the driver cannot serve
+            workers=0,
+        )
+        studies.append(Study(name, runner, weight=c.getfloat(name, 'weight', fallback=1)))
+
+    return studies
+
+
+def can_submit(study):
+    """Whether the study's project is accepting jobs, as checked by multijob before each submission"""
+    runner = study.runner
+    if runner.are_jobs_locked():
+        return False
+    runner.queued_job_count = runner.check_queue_limit()
+    if runner.queued_job_count >= runner.queue_limit:
+        print(f'{study.name}: at limit for queued jobs, waiting for queue space.')
+        return False
+    return True
+
+
+def run_batch(studies, max_active=20, tick_freq=5):
+    running = list(studies)
+    while running:
+        for study in list(running):
+            # Check the tasks whose status check is due, as multijob does. This also drops the
+            # entries of the poller's queue that later checks superseded, so it does not grow.
+            for task_id in study.runner.poller.pop_due(study.runner.dag.tasks, time.time()):
+                study.runner.dag.tasks[task_id].status()
+            study.status = study.runner.dag.pipeline_status()
+            study.runner.write_status(study.status)
+            if study.status in ('Succeeded', 'Failed'):
+                print(f'## {study.name}: pipeline {study.status} ##')
+                study.runner.poller.history.save()
+                running.remove(study)
+
+        # Studies with work ready, least served first
+        candidates = []
+        for study in running:
+            ready_tasks = study.runner.dag.get_ready_tasks()
+            if ready_tasks:
+                candidates.append((study, ready_tasks[0]))
+        headroom = max_active - sum(study.count_active_jobs() for study in running)
+        candidates.sort(key=lambda candidate: candidate[0].share())
+
+        for study, task in candidates:
+            if headroom <= 0:
+                print('At the batch limit for active jobs, waiting for jobs to finish.')
+                break
+            if not can_submit(study):
+                continue
+            study.runner.submit_task(task)
+            headroom -= 1
+
+        time.sleep(tick_freq)
+
+    return studies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the multijob pipelines of several studies from one driver.')
+    parser.add_argument('batch_cfg', help='Batch config listing the studies to run')
+    parser.add_argument('--max-active', type=int, default=20, help='Maximum jobs queued or running across all studies')
+    parser.add_argument('--tick-freq', type=int, default=5, help='Seconds between scheduling rounds')
+    args = parser.parse_args()
+    check_environment()
+
+    if not os.path.exists(args.batch_cfg):
+        sys.exit("Empty or missing batch config file")
+    studies = run_batch(load_studies(args.batch_cfg, args.tick_freq), args.max_active, args.tick_freq)
+    for study in studies:
+        print(f'{study.name}: {study.status}')
+    if any(study.status == 'Failed' for study in studies):
+        sys.exit("One or more study pipelines failed")
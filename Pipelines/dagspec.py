@@ -0,0 +1,292 @@
+"""
+Compile multijob configs into a validated DAG spec.
+
+On top of the plain configparser format that multijob has always read, a config may use:
+
+    [DEFAULT]       Keys set here apply to every task, e.g. the environment or project_repo_git_ref.
+                    A task can clear a default by setting the key to an empty value.
+    include         In [DEFAULT], a comma separated list of configs to read first, relative to this one.
+                    Tasks and keys in the including config override those of the included ones.
+    foreach         Generate one task per item. Every {item} in the section name and its values is
+                    replaced by the item, e.g.
+                        [qc_{item}]
+                        foreach: ADAE,ADCM,ADLB
+                        command: qc/adam/qc_{item}.sas
+                        depends: {item},qc_ADSL
+    depends         Entries may be wildcards matched against the task names, e.g. depends: qc_AD*.
+                    A task never depends on itself, so a pattern may match its own name.
+    qc_prefix       Pair each task named <qc_prefix><name> with the prod task <name>, e.g. qc_ADAE with
+                    ADAE. The QC task no longer waits for its prod counterpart, so independent double
+                    programming runs in parallel with prod.
+    compare_command Command of the compare task generated for each pair, named compare_<name>, which
+                    runs as soon as both sides of the pair have succeeded. {dataset} is replaced by the
+                    lower case name, e.g. python qc/adam/compare_adam.py --datasets {dataset}.
+                    compare_environment and compare_tier set its environment and tier, otherwise it
+                    uses those of the QC task.
+    shards          Run the task as this many shards in parallel, each on the subjects whose USUBJID
+                    hash falls in the shard, followed by a merge step, e.g.
+                        [ADLB]
+                        command: prod/adam/ADLB.sas
+                        shards: 4
+                        shard_data: adam.adlb
+                        shard_by: usubjid paramcd adt
+                    gives ADLB_shard1 to ADLB_shard4, which run the program with MULTIJOB_SHARD and
+                    MULTIJOB_SHARDS set, and ADLB, which depends on them and combines adam.adlb_s1 to
+                    adam.adlb_s4 into adam.adlb sorted by shard_by (default usubjid). Tasks that depend on
+                    ADLB wait for the merge. The program selects its subjects with %shard_filter and
+                    names its output with %shard_name, from share/macros.
+
+The compiled spec lists every task with its command, dependencies and run options, in config
+order. It is checked for missing commands, unknown dependencies and cycles, and cached as JSON
+together with the hashes of the configs it was built from, so it is only rebuilt when one of
+them changes.
+
+Usage: python Pipelines/dagspec.py <cfg> to compile a config and print the resulting DAG.
+"""
+import configparser
+import fnmatch
+import hashlib
+import json
+import os
+import shlex
+import sys
+
+SPEC_VERSION = 3
+
+# Keys passed through to DominoRun
+RUN_OPTIONS = ('max_retries', 'tier', 'environment', 'project_repo_git_ref', 'imported_repo_git_refs')
+DIRECTIVES = ('include', 'foreach')
+COMPARE_PREFIX = 'compare_'
+SHARD_SUFFIX = '_shard'
+MERGE_PROGRAM = 'utilities/merge_shards.sas'
+
+# How a program given as the whole command is run, once the command has to be prefixed
+RUNNERS = {
+    '.sas': 'sas -sysin',
+    '.r': 'Rscript',
+    '.py': 'python',
+}
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def config_files(cfg_path, seen=None):
+    """Return the config and everything it includes, included files first"""
+    seen = [] if seen is None else seen
+    cfg_path = os.path.abspath(cfg_path)
+    if cfg_path in seen:
+        raise Exception(f"Config {cfg_path} includes itself")
+    if not os.path.exists(cfg_path):
+        raise Exception(f"Included config {cfg_path} does not exist")
+    seen.append(cfg_path)
+
+    c = configparser.ConfigParser(allow_no_value=False)
+    c.read(cfg_path)
+    files = []
+    for include in split_list(c.defaults().get('include', '')):
+        include_path = os.path.join(os.path.dirname(cfg_path), include)
+        files += [path for path in config_files(include_path, seen) if path not in files]
+    seen.remove(cfg_path)
+    return files + [cfg_path]
+
+
+def expand_sections(c):
+    """Return (task_id, options) for every task, with foreach sections expanded in place"""
+    if 'foreach' in c.defaults():
+        raise Exception("foreach cannot be set in [DEFAULT]")
+    sections = []
+    for section in c.sections():
+        options = {key: value for key, value in c.items(section) if key not in DIRECTIVES}
+        if c.has_option(section, 'foreach'):
+            for item in split_list(c.get(section, 'foreach')):
+                sections.append((
+                    section.replace('{item}', item),
+                    {key: value.replace('{item}', item) for key, value in options.items()},
+                ))
+        else:
+            sections.append((section, options))
+    return sections
+
+
+def resolve_depends(task_id, depends, task_ids):
+    """Expand wildcard dependencies against the task names, keeping config order"""
+    resolved = []
+    for pattern in split_list(depends):
+        if any(char in pattern for char in '*?['):
+            matches = [name for name in task_ids if fnmatch.fnmatchcase(name, pattern) and name != task_id]
+            if not matches:
+                raise Exception(f"{task_id} depends on {pattern}, which matches no task")
+        else:
+            matches = [pattern]
+        resolved += [name for name in matches if name != task_id and name not in resolved]
+    return resolved
+
+
+def qc_pairs(sections):
+    """Return {QC task ID: (prod task ID, compare command)} for the tasks that have a prod counterpart"""
+    task_ids = {task_id for task_id, _ in sections}
+    pairs = {}
+    for task_id, options in sections:
+        prefix = options.get('qc_prefix')
+        if prefix and task_id.startswith(prefix) and task_id[len(prefix):] in task_ids:
+            pairs[task_id] = (task_id[len(prefix):], options.get('compare_command'))
+    return pairs
+
+
+def shard_command(command, shard, shards):
+    """Command of one shard of a sharded task, with the shard passed in the environment"""
+    args = shlex.split(command)
+    extension = os.path.splitext(args[0])[1].lower() if len(args) == 1 else None
+    if extension in RUNNERS:
+        command = f'{RUNNERS[extension]} {command}'
+    return f'env MULTIJOB_SHARD={shard} MULTIJOB_SHARDS={shards} {command}'
+
+
+def shard_tasks(task, options):
+    """Split a task with shards > 1 into its shards and a merge step that keeps the task's name"""
+    shards = int(options.get('shards') or 1)
+    if shards <= 1:
+        return [task]
+    if not options.get('shard_data'):
+        raise Exception(f"{task['task_id']} is sharded, but has no shard_data naming the dataset to merge")
+    shard_ids = [f"{task['task_id']}{SHARD_SUFFIX}{shard}" for shard in range(1, shards + 1)]
+    tasks = [
+        {**task, 'task_id': shard_id, 'command': shard_command(task['command'], shard, shards)}
+        for shard, shard_id in enumerate(shard_ids, start=1)
+    ]
+    merge_command = (
+        f"env MULTIJOB_SHARDS={shards} MULTIJOB_MERGE_DATA={options['shard_data']} "
+        f"MULTIJOB_MERGE_BY={shlex.quote(options.get('shard_by') or 'usubjid')} {RUNNERS['.sas']} {MERGE_PROGRAM}"
+    )
+    tasks.append({**task, 'command': merge_command, 'depends': shard_ids})
+    return tasks
+
+
+def check_acyclic(tasks):
+    """Raise if the dependencies contain a cycle, naming the tasks on it"""
+    dependants = {task['task_id']: [] for task in tasks}
+    waiting = {}
+    for task in tasks:
+        waiting[task['task_id']] = len(task['depends'])
+        for dependency in task['depends']:
+            dependants[dependency].append(task['task_id'])
+
+    ready = [task_id for task_id, count in waiting.items() if count == 0]
+    while ready:
+        for dependant in dependants[ready.pop()]:
+            waiting[dependant] -= 1
+            if waiting[dependant] == 0:
+                ready.append(dependant)
+
+    blocked = [task_id for task_id, count in waiting.items() if count > 0]
+    if blocked:
+        raise Exception(f"Circular dependency detected between {', '.join(blocked)}. Please review your config and resolve any circular references.")
+
+
+def compile_spec(cfg_path):
+    files = config_files(cfg_path)
+    c = configparser.ConfigParser(allow_no_value=False)
+    c.read(files)
+
+    sections = expand_sections(c)
+    if len(sections) == 0:
+        raise Exception("Empty config provided")
+    pairs = qc_pairs(sections)
+    task_ids = []
+    for task_id, _ in sections:
+        task_ids.append(task_id)
+        if task_id in pairs and pairs[task_id][1]:
+            task_ids.append(COMPARE_PREFIX + pairs[task_id][0])
+    duplicates = sorted(set(task_id for task_id in task_ids if task_ids.count(task_id) > 1))
+    if duplicates:
+        raise Exception(f"Tasks defined more than once: {', '.join(duplicates)}")
+
+    tasks = []
+    for task_id, options in sections:
+        if not options.get('command'):
+            raise Exception(f"{task_id} has no command")
+        depends = resolve_depends(task_id, options.get('depends', ''), task_ids)
+        unknown = [dependency for dependency in depends if dependency not in task_ids]
+        if unknown:
+            raise Exception(f"{task_id} depends on {', '.join(unknown)}, which is not defined in the config")
+        run_options = {key: options[key] for key in RUN_OPTIONS if options.get(key)}
+        if task_id in pairs:
+            prod_id, compare_command = pairs[task_id]
+            depends = [dependency for dependency in depends if dependency != prod_id]
+        tasks += shard_tasks({
+            'task_id': task_id,
+            'command': options['command'],
+            'depends': depends,
+            'options': run_options,
+        }, options)
+        if task_id in pairs and compare_command:
+            compare_options = dict(run_options)
+            for key in ('environment', 'tier'):
+                if options.get(f'compare_{key}'):
+                    compare_options[key] = options[f'compare_{key}']
+            tasks.append({
+                'task_id': COMPARE_PREFIX + prod_id,
+                'command': compare_command.replace('{dataset}', prod_id.lower()),
+                'depends': [prod_id, task_id],
+                'options': compare_options,
+            })
+    generated = [task['task_id'] for task in tasks]
+    duplicates = sorted(set(task_id for task_id in generated if generated.count(task_id) > 1))
+    if duplicates:
+        raise Exception(f"Shard tasks clash with tasks defined in the config: {', '.join(duplicates)}")
+    check_acyclic(tasks)
+
+    return {
+        'version': SPEC_VERSION,
+        'sources': {path: file_hash(path) for path in files},
+        'tasks': tasks,
+    }
+
+
+def is_current(spec):
+    if spec.get('version') != SPEC_VERSION:
+        return False
+    try:
+        return all(file_hash(path) == sha256 for path, sha256 in spec['sources'].items())
+    except OSError:
+        return False
+
+
+def load_spec(cfg_path, cache_dir=None):
+    """Return the compiled spec for a config, from the cache when none of its sources has changed"""
+    if cache_dir is None:
+        return compile_spec(cfg_path)
+
+    name = hashlib.sha256(os.path.abspath(cfg_path).encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f'{os.path.basename(cfg_path)}.{name}.json')
+    try:
+        with open(cache_path) as f:
+            spec = json.load(f)
+        if is_current(spec):
+            return spec
+    except (OSError, ValueError):
+        pass
+
+    spec = compile_spec(cfg_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f'{cache_path}.tmp', 'w') as f:
+            json.dump(spec, f)
+        os.replace(f'{cache_path}.tmp', cache_path)
+    except OSError as err:
+        print(f'WARNING: Could not cache the compiled DAG in {cache_path}: {err}')
+    return spec
+
+
+if __name__ == '__main__':
+    spec = compile_spec(sys.argv[1])
+    for task in spec['tasks']:
+        print(f"{task['task_id']}: {task['command']} <- {','.join(task['depends']) or '-'}")
+    print(f"{len(spec['tasks'])} tasks, compiled from {', '.join(spec['sources'])}")
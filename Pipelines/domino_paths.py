@@ -0,0 +1,10 @@
+"""
+Where the project datasets are mounted, shared by the pipeline scripts, the utilities and the
+report app: /mnt/data in git-based projects, /domino/datasets/local in DFS projects.
+"""
+import os
+
+if os.environ.get('DOMINO_IS_GIT_BASED', 'true').lower() == 'true':
+    DATASET_ROOT = '/mnt/data'
+else:
+    DATASET_ROOT = '/domino/datasets/local'
@@ -0,0 +1,124 @@
+"""
+Executors that multijob can run tasks with instead of the Domino jobs API.
+
+An executor has three methods:
+
+    submit(task)        Start running the DominoRun task's command, and return an ID for the run.
+    status(task_id)     Status of the task's latest run, in the same terms as the Domino jobs API:
+                        Queued, Running, Succeeded, Failed or Error.
+    log_tail(task_id, lines)
+                        The last lines of the log of the task's latest run, used to classify failures.
+    shutdown()          Release the executor's resources once the pipeline has finished.
+
+PipelineRunner sets task.executor to the executor a task was submitted to, and DominoRun.status()
+then asks the executor rather than the API. The DAG, the retries and the status file work the same
+whichever executor runs the tasks. The worker pool queues in workerpool.py answer status() in the
+same way.
+
+LocalExecutor runs the tasks on the machine multijob runs on, in a bounded process pool:
+
+    .sas    sas -sysin <program> -log <log dir>/<task>.sas.log
+    .R      Rscript -e "logrx::axecute('<program>', log_path = '<log dir>', log_name = '<task>.logrx.log')"
+    .py     python <program>
+    Other   The command as given.
+
+The output of each command goes to <log dir>/<task>.log. SAS and logrx write the program's own log
+to a file of its own, named after the task rather than the program, so it never is the file the
+output goes to. The tail used to classify a failure is the end of the program log followed by the
+end of the output. Hardware tiers, environments and git ref overrides do not apply, as every task
+runs in the current environment on the checked out code.
+"""
+import concurrent.futures
+import os
+import shlex
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def program_log_name(task_id, command):
+    """Name of the log SAS or logrx writes for a task's program, or None if the program writes none"""
+    args = shlex.split(command)
+    extension = os.path.splitext(args[0])[1].lower() if len(args) == 1 else None
+    if extension == '.sas':
+        return f'{task_id}.sas.log'
+    if extension == '.r':
+        return f'{task_id}.logrx.log'
+    return None
+
+
+def local_command(command, log_dir, task_id):
+    """Return the argument list that runs a task's command on this machine"""
+    args = shlex.split(command)
+    if len(args) == 1:
+        program = args[0]
+        extension = os.path.splitext(program)[1].lower()
+        log_name = program_log_name(task_id, command)
+        if extension == '.sas':
+            return ['sas', '-sysin', program, '-log', os.path.join(log_dir, log_name)]
+        if extension == '.r':
+            return ['Rscript', '-e', f"logrx::axecute('{program}', log_path = '{log_dir}', log_name = '{log_name}')"]
+        if extension == '.py':
+            return [sys.executable, program]
+    return args
+
+
+def run_command(args, log_path, cwd=REPO_ROOT):
+    # Runs in a pool process, so it must stay a module level function
+    with open(log_path, 'w') as log:
+        returncode = subprocess.call(args, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+        # Recorded in the log, where the retry logic looks for the cause of a failure
+        if returncode < 0:
+            log.write(f'\nKilled by signal {-returncode}\n')
+        elif returncode > 0:
+            log.write(f'\nExit code {returncode}\n')
+    return returncode
+
+
+def read_tail(path, lines):
+    try:
+        with open(path, errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+    except OSError:
+        return ''
+
+
+class LocalExecutor:
+    """Runs tasks as processes on this machine, at most max_workers at a time"""
+    def __init__(self, log_dir, max_workers=None):
+        self.log_dir = log_dir
+        self.max_workers = max_workers or os.cpu_count()
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+        self.futures = {}
+        self.program_logs = {}
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def submit(self, task):
+        if task.tier or task.environment or task.project_repo_git_ref or task.imported_repo_git_refs:
+            print(f'WARNING: {task.task_id} runs locally, so its tier, environment and git ref overrides are ignored.')
+        args = local_command(task.command, self.log_dir, task.task_id)
+        log_path = os.path.join(self.log_dir, f'{task.task_id}.log')
+        self.program_logs[task.task_id] = program_log_name(task.task_id, task.command)
+        print(f"## Running task locally ##\ntask_id: {task.task_id}\ncommand: {shlex.join(args)}\nlog: {log_path}")
+        self.futures[task.task_id] = self.pool.submit(run_command, args, log_path)
+        return f'local:{task.task_id}'
+
+    def status(self, task_id):
+        future = self.futures[task_id]
+        if not future.done():
+            return 'Running' if future.running() else 'Queued'
+        if future.exception() is not None:
+            print(f'ERROR: {task_id} could not be run: {future.exception()}')
+            return 'Error'
+        return 'Succeeded' if future.result() == 0 else 'Failed'
+
+    def log_tail(self, task_id, lines):
+        """End of the program's own log, where SAS and R report their errors, then of the command's output"""
+        tail = ''
+        if self.program_logs.get(task_id):
+            tail = read_tail(os.path.join(self.log_dir, self.program_logs[task_id]), lines)
+        return tail + read_tail(os.path.join(self.log_dir, f'{task_id}.log'), lines)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
@@ -1,11 +1,18 @@
-import configparser
+import argparse
 import os
+import re
+import shlex
 import sys
 import time
 import pprint
 import logging
 import requests
 from requests.exceptions import HTTPError
+from dagspec import load_spec
+from executors import LocalExecutor
+from polling import MAX_INTERVAL, DurationHistory, Poller
+from retries import LOG_TAIL_LINES, classify_failure, retry_plan
+from workerpool import TaskQueue
 
 """
 on each tick:
@@ -22,12 +29,16 @@ import json
 from time import sleep
 from datetime import datetime
 
-DOMINO_RUN_ID = os.environ['DOMINO_RUN_ID']
-DOMINO_STARTING_USERNAME = os.environ['DOMINO_STARTING_USERNAME']
-DOMINO_API_HOST = os.environ['DOMINO_API_PROXY']
-DOMINO_PROJECT_ID = os.environ['DOMINO_PROJECT_ID']
-DOMINO_PROJECT_NAME = os.environ['DOMINO_PROJECT_NAME']
-DOMINO_IS_GIT_BASED = os.environ['DOMINO_IS_GIT_BASED']
+# Set in every Domino run. Read with defaults so the module can be imported, e.g. by benchmarks,
+# outside of one; check_environment() stops a pipeline run that is missing them.
+REQUIRED_ENV = ('DOMINO_RUN_ID', 'DOMINO_STARTING_USERNAME', 'DOMINO_API_PROXY', 'DOMINO_PROJECT_ID', 'DOMINO_PROJECT_NAME', 'DOMINO_IS_GIT_BASED')
+
+DOMINO_RUN_ID = os.environ.get('DOMINO_RUN_ID', '')
+DOMINO_STARTING_USERNAME = os.environ.get('DOMINO_STARTING_USERNAME', '')
+DOMINO_API_HOST = os.environ.get('DOMINO_API_PROXY', '')
+DOMINO_PROJECT_ID = os.environ.get('DOMINO_PROJECT_ID', '')
+DOMINO_PROJECT_NAME = os.environ.get('DOMINO_PROJECT_NAME', '')
+DOMINO_IS_GIT_BASED = os.environ.get('DOMINO_IS_GIT_BASED', 'true')
 
 # These variables may not be set in the project, which we should interpret as a 'false' value
 try:
@@ -40,6 +51,44 @@ try:
 except KeyError:
     PRERUN_CLEANUP = 'false'
 
+try:
+    PROFILE = os.environ['DMV_PROFILE'].lower()
+except KeyError:
+    PROFILE = 'false'
+
+# Snapshot every file of the datasets in controlled execution runs, rather than only the files the run wrote
+try:
+    CX_FULL = os.environ['DMV_CX_FULL'].lower()
+except KeyError:
+    CX_FULL = 'false'
+
+# Number of warm worker jobs per environment and tier. 0 runs every task as its own job.
+try:
+    WORKERS = int(os.environ['DMV_WORKERS'])
+except (KeyError, ValueError):
+    WORKERS = 0
+
+from domino_paths import DATASET_ROOT
+
+# Live pipeline state, read by the status pages of the report app in share/app
+STATUS_PATH = os.environ.get('MULTIJOB_STATUS_PATH', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/multijob/status.json')
+# Compiled DAG specs, reused until the config they were built from changes
+DAG_CACHE_DIR = os.environ.get('MULTIJOB_DAG_CACHE_DIR', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/multijob/dags')
+# Run times of past tasks, which set how often their status is checked
+DURATIONS_PATH = os.environ.get('MULTIJOB_DURATIONS_PATH', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/multijob/durations.json')
+# Task logs of the local executor
+LOCAL_LOG_DIR = os.environ.get('MULTIJOB_LOCAL_LOG_DIR', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/logs')
+# Latest controlled execution snapshot of each dataset, which the next run's snapshots refer back to
+CX_STATE_PATH = os.environ.get('MULTIJOB_CX_STATE_PATH', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/multijob/cx_snapshots.json')
+# Files modified up to this many seconds before the run started count as written by it, allowing
+# for clock differences between the jobs and the dataset file server
+CX_MTIME_SLACK = 60
+
+def check_environment():
+    missing = [name for name in REQUIRED_ENV if name not in os.environ]
+    if missing:
+        sys.exit(f"Missing Domino environment variables: {', '.join(missing)}")
+
 class DominoRun:
     """
     self.task_id        # name of task
@@ -48,35 +97,117 @@ class DominoRun:
     self.max_retries    # maximum retries
 
     self.job_id        # ID of latest run attempt
+    self.executor       # executor or worker pool queue the task was sent to, if it does not run as a Domino job
     self.retries        # number of retries so far
+    self.failure        # cause of the latest failed run attempt, see retries.py
+    self.retry_at       # time the task may be retried, or None if it should not be retried
+    self.submitted_at   # time the latest run attempt was submitted
+    self.started_at     # time the latest run attempt was first seen running
+    self.finished_at    # time the latest run attempt was first seen in a final state
+    self.poller         # polling.Poller that schedules the status checks, if any
+    self.next_poll_at   # time the status is next checked, or None to check on every call
     self.status()       # check API for status - stop checking once Succeeded or (Error/Failed and self.retries < self.max_retries)
     self._status        # last .status()
     
-    once submitted, it polls status, and retries (submits re-runs) up to max_retries
+    once submitted, it polls status, and retries (submits re-runs) up to max_retries, depending on the cause of the failure
     """
     def __init__(self, task_id, command, max_retries=0, tier=None, environment=None, project_repo_git_ref=None, imported_repo_git_refs=None):
         self.task_id = task_id
         self.command = command
-        self.max_retries = max_retries
+        # Options from the config are strings
+        self.max_retries = int(max_retries)
         self.tier = tier
         self.environment = environment
         self.project_repo_git_ref = project_repo_git_ref
         self.imported_repo_git_refs = imported_repo_git_refs
         self.job_id = None
+        self.executor = None
         self.retries = 0
+        self.failure = None
+        self.retry_at = None
         self._status = "Unsubmitted"
+        self.submitted_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.poller = None
+        self.next_poll_at = None
+
+    def poll_due(self):
+        return self.next_poll_at is None or time.time() >= self.next_poll_at
 
     def status(self):
-        if self._status not in ("Succeeded", "Unsubmitted", "Error", "Failed", "Stopped"):
-            job_status = get_job_status(self.job_id)
+        if self._status not in ("Succeeded", "Skipped", "Unsubmitted", "Error", "Failed", "Stopped") and self.poll_due():
+            if self.executor is not None:
+                job_status = self.executor.status(self.task_id)
+            else:
+                job_status = get_job_status(self.job_id)
             self.set_status(job_status)
+            if job_status in ("Error", "Failed"):
+                self.plan_retry()
         return self._status
 
+    def log_tail(self):
+        if self.executor is not None:
+            return self.executor.log_tail(self.task_id, LOG_TAIL_LINES)
+        return get_job_log_tail(self.job_id, LOG_TAIL_LINES)
+
+    def plan_retry(self):
+        self.failure = classify_failure(self._status, self.log_tail())
+        plan = retry_plan(self.failure, self.tier, self.retries)
+        if plan is None or self.retries >= self.max_retries:
+            self.retry_at = None
+            print(f"## {self.task_id} {self._status} ({self.failure}), not retrying ##")
+            return
+        delay, tier = plan
+        self.retry_at = time.time() + delay
+        if tier != self.tier:
+            print(f"## {self.task_id} ran out of memory on {self.tier or 'the default tier'}, retrying on {tier} ##")
+            self.tier = tier
+        else:
+            print(f"## {self.task_id} {self._status} ({self.failure}), retrying in {delay} seconds ##")
+
+    def can_retry(self):
+        return self._status in ("Error", "Failed") and self.retry_at is not None
+
+    def is_retry_due(self):
+        return self.can_retry() and time.time() >= self.retry_at
+
     def set_status(self, status):
+        now = time.time()
+        if status == 'Submitted':
+            self.submitted_at, self.started_at, self.finished_at = now, None, None
+        elif status == 'Running' and self.started_at is None:
+            self.started_at = now
+        elif status in ('Succeeded', 'Error', 'Failed', 'Stopped') and self.finished_at is None:
+            self.finished_at = now
         self._status = status
+        if self.poller is not None:
+            self.poller.update(self)
+
+    def duration(self):
+        """Seconds the latest run attempt has been running for, or ran for if it has finished"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {
+            'task_id': self.task_id,
+            'command': self.command,
+            'status': self._status,
+            'job_id': self.job_id,
+            'retries': self.retries,
+            'failure': self.failure,
+            'tier': self.tier,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration': self.duration(),
+        }
 
     def is_complete(self):
-        return self.status() == "Succeeded"
+        # Skipped tasks count as complete, their outputs from an earlier run being used
+        return self.status() in ("Succeeded", "Skipped")
 
 
 class Dag:
@@ -99,7 +230,7 @@ class Dag:
     def are_task_dependencies_complete(self, task_id):
         dependency_statuses = self.get_dependency_statuses(task_id)
         if dependency_statuses:
-            all_deps_succeeded = all(status == 'Succeeded' for status in dependency_statuses)
+            all_deps_succeeded = all(status in ('Succeeded', 'Skipped') for status in dependency_statuses)
         else:
             all_deps_succeeded = True
         return all_deps_succeeded
@@ -108,7 +239,7 @@ class Dag:
         ready_tasks = []
         for task_id, task in self.tasks.items():
             deps_complete = self.are_task_dependencies_complete(task_id)
-            task_status_ready = (task.status() in ("Error", "Failed") and task.retries < task.max_retries) or task.status() == 'Unsubmitted'
+            task_status_ready = task.status() == 'Unsubmitted' or task.is_retry_due()
             if deps_complete and task_status_ready:
                 ready_tasks.append(task)
         return ready_tasks
@@ -116,7 +247,7 @@ class Dag:
     def get_failed_tasks(self):
         failed_tasks = []
         for task_id, task in self.tasks.items():
-            if task.status() in ('Error', 'Failed') and task.retries >= task.max_retries:
+            if task.status() in ('Error', 'Failed') and not task.can_retry():
                 failed_tasks.append(task)
         return failed_tasks
 
@@ -128,6 +259,15 @@ class Dag:
             status = 'Succeeded'
         return status
 
+    def run_only(self, task_ids):
+        """Skip every task not in task_ids, e.g. the tasks utilities/sdtm_diff.py found affected by new SDTM data"""
+        unknown = sorted(set(task_ids) - set(self.tasks))
+        if unknown:
+            raise Exception(f"Tasks to run are not in the config: {', '.join(unknown)}")
+        for task_id, task in self.tasks.items():
+            if task_id not in task_ids:
+                task.set_status('Skipped')
+
     def validate_dag(self):
         def recurse(task, original_task):
             dag_valid = True
@@ -190,6 +330,17 @@ def get_job_status(job_id):
 
     return job_status
 
+def get_job_log_tail(job_id, lines):
+    # The log only explains a failure, so unlike submit_api_call a failed request is not fatal
+    try:
+        response = requests.get(f'{DOMINO_API_HOST}/v4/jobs/{job_id}/logs', headers={'accept': 'application/json'})
+        response.raise_for_status()
+        log = ''.join(entry.get('log', '') for entry in response.json().get('logContent', []))
+    except (requests.RequestException, ValueError) as err:
+        print(f'WARNING: Could not read the log of job {job_id}: {err}')
+        return ''
+    return '\n'.join(log.splitlines()[-lines:])
+
 def get_project_datasets():
     endpoint = f'api/datasetrw/v2/datasets?projectIdsToInclude={DOMINO_PROJECT_ID}'
     method = 'GET'
@@ -198,10 +349,10 @@ def get_project_datasets():
     return project_datasets
 
 
-def take_dataset_snapshot(dataset_id):
+def take_dataset_snapshot(dataset_id, relative_file_paths=None):
     endpoint = f'api/datasetrw/v1/datasets/{dataset_id}/snapshots'
     method = 'POST'
-    data = { "relativeFilePaths":["."] }
+    data = { "relativeFilePaths": relative_file_paths or ["."] }
     snapshot_response = submit_api_call(method, endpoint, data=json.dumps(data))
 
     snapshot_id = snapshot_response['snapshot']['id']
@@ -231,7 +382,7 @@ def tag_dataset_snapshot(dataset_id, snapshot_id, formatted_timestamp):
         tag_response = submit_api_call(method, endpoint, data=json.dumps(data))
 
 
-def format_snapshot_comment(snapshot_response, formatted_timestamp):
+def format_snapshot_comment(snapshot_response, formatted_timestamp, changed_files=None, previous=None):
     snapshot_json = snapshot_response
     dataset_id = snapshot_json['snapshot']['datasetId']
 
@@ -246,10 +397,24 @@ def format_snapshot_comment(snapshot_response, formatted_timestamp):
             Dataset name: {dataset_name}\\\n \
             Author MUD ID: {DOMINO_STARTING_USERNAME}\\\n \
             Creation time: {formatted_timestamp}"
+    snapshot_comment += format_snapshot_lineage(changed_files, previous)
 
     return snapshot_comment
 
 
+def format_snapshot_lineage(changed_files, previous):
+    """Comment lines saying what a snapshot holds, and which earlier snapshots hold the rest of the dataset"""
+    if changed_files is None:
+        lineage = '\\\n Contents: all files'
+    else:
+        lineage = f'\\\n Contents: {len(changed_files)} file(s) written by this run'
+    if previous:
+        lineage += f"\\\n Previous snapshot: {previous['snapshot_id']} ({previous['timestamp']}, job {previous['run_id']})"
+        if changed_files is not None:
+            lineage += f"\\\n Last full snapshot: {previous['full_snapshot_id']} ({previous['full_timestamp']})"
+    return lineage
+
+
 def format_env_vars_comment():
     variables_comment = 'Project environment variables:\\\n'
     for env_var in os.environ:
@@ -266,6 +431,67 @@ def leave_comment_on_job(comment_text):
     comment_response = submit_api_call(method, endpoint, data=json.dumps(data))
 
 
+def write_pipeline_status(dag, status, queued_job_count=None, queue_limit=None, status_path=STATUS_PATH, project_name=DOMINO_PROJECT_NAME):
+    """
+    Write the state of every task to the shared status file, so the report app can serve pipeline
+    progress without calling the Domino API. The file is replaced atomically, so readers never see
+    a partial write.
+    """
+    state = {
+        'run_id': DOMINO_RUN_ID,
+        'project': project_name,
+        'status': status,
+        'updated_at': time.time(),
+        'queue_depth': queued_job_count,
+        'queue_limit': queue_limit,
+        'tasks': [
+            {**task.to_dict(), 'depends': dag.dependency_graph[task_id]}
+            for task_id, task in dag.tasks.items()
+        ],
+    }
+    try:
+        os.makedirs(os.path.dirname(status_path), exist_ok=True)
+        with open(f'{status_path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{status_path}.tmp', status_path)
+    except OSError as err:
+        print(f'WARNING: Could not write pipeline status to {status_path}: {err}')
+
+
+# Tier and environment lookups are the same for every task, and for every study in a batch run,
+# so they are only requested from the API once per driver
+HARDWARE_TIER_IDS = {}
+ENVIRONMENT_IDS = {}
+
+def get_hardware_tier_id(hardware_tier_name, project_id=DOMINO_PROJECT_ID):
+    if (project_id, hardware_tier_name) not in HARDWARE_TIER_IDS:
+        endpoint = f'v4/projects/{project_id}/hardwareTiers'
+        method = 'GET'
+        available_hardware_tiers = submit_api_call(method, endpoint)
+        for hardware_tier in available_hardware_tiers:
+            HARDWARE_TIER_IDS[(project_id, hardware_tier['hardwareTier']['name'])] = hardware_tier['hardwareTier']['id']
+    if (project_id, hardware_tier_name) not in HARDWARE_TIER_IDS:
+        sys.exit(f'Hardware tier {hardware_tier_name} is not available in project {project_id}')
+
+    return HARDWARE_TIER_IDS[(project_id, hardware_tier_name)]
+
+
+def resolve_environment(environment):
+    # Environments can be given by ID, or by name
+    if re.fullmatch('[0-9a-f]{24}', environment):
+        return environment
+    if environment not in ENVIRONMENT_IDS:
+        endpoint = 'v1/environments'
+        method = 'GET'
+        available_environments = submit_api_call(method, endpoint)
+        for env in available_environments['data']:
+            ENVIRONMENT_IDS[env['name']] = env['id']
+    if environment not in ENVIRONMENT_IDS:
+        sys.exit(f'Environment {environment} does not exist')
+
+    return ENVIRONMENT_IDS[environment]
+
+
 def cleanup_datasets():
     project_datasets = get_project_datasets()
     if DOMINO_IS_GIT_BASED == 'true':
@@ -281,56 +507,94 @@ def cleanup_datasets():
                     os.remove(os.path.join(root, name))
 
 
-def full_cx():
+def files_written_since(dataset_path, since):
+    """Paths, relative to the dataset, of the files modified since a time"""
+    written = []
+    for (root, dirs, files) in os.walk(dataset_path):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) >= since - CX_MTIME_SLACK:
+                    written.append(os.path.relpath(path, dataset_path))
+            except OSError:
+                pass
+    return sorted(written)
+
+
+def load_cx_state(state_path=CX_STATE_PATH):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cx_state(state, state_path=CX_STATE_PATH):
+    try:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(f'{state_path}.tmp', 'w') as f:
+            json.dump(state, f, indent=4)
+        os.replace(f'{state_path}.tmp', state_path)
+    except OSError as err:
+        print(f'WARNING: Could not record the snapshots in {state_path}: {err}')
+
+
+def full_cx(run_started_at=None):
+    """
+    Snapshot the project datasets and record the snapshots on the job.
+
+    :param run_started_at: Time the pipeline started. When given, only the files written since then are
+        snapshotted, and the comment links to the dataset's previous and last full snapshots, which hold the
+        rest of its state. Without it, or with DMV_CX_FULL true, or for a dataset that has no full snapshot
+        yet, every file is snapshotted.
+    """
+    if DOMINO_IS_GIT_BASED == 'true':
+        dataset_root = '/mnt/data'
+    else:
+        dataset_root = '/domino/datasets/local'
+    state = load_cx_state()
     project_datasets = get_project_datasets()
     for dataset in project_datasets['datasets']:
         dataset_id = dataset['dataset']['id']
-        snapshot_id, formatted_timestamp, snapshot_response = take_dataset_snapshot(dataset_id)
+        previous = state.get(dataset_id)
+        changed_files = None
+        if run_started_at is not None and CX_FULL != 'true' and previous:
+            changed_files = files_written_since(f"{dataset_root}/{dataset['dataset']['name']}", run_started_at)
+            if not changed_files:
+                leave_comment_on_job(
+                    f"Controlled execution: dataset {dataset['dataset']['name']} ({dataset_id}) was not changed by this run.\\\n \
+                    Latest snapshot: {previous['snapshot_id']} ({previous['timestamp']}, job {previous['run_id']})\\\n \
+                    Last full snapshot: {previous['full_snapshot_id']} ({previous['full_timestamp']})"
+                )
+                continue
+        snapshot_id, formatted_timestamp, snapshot_response = take_dataset_snapshot(dataset_id, changed_files)
         tag_dataset_snapshot(dataset_id, snapshot_id, formatted_timestamp)
-        snapshot_comment = format_snapshot_comment(snapshot_response, formatted_timestamp)
+        snapshot_comment = format_snapshot_comment(snapshot_response, formatted_timestamp, changed_files, previous)
         leave_comment_on_job(snapshot_comment)
+        state[dataset_id] = {
+            'snapshot_id': snapshot_id,
+            'timestamp': formatted_timestamp,
+            'run_id': DOMINO_RUN_ID,
+            'files': changed_files,
+            'previous_snapshot_id': previous['snapshot_id'] if previous else None,
+            'full_snapshot_id': snapshot_id if changed_files is None else previous['full_snapshot_id'],
+            'full_timestamp': formatted_timestamp if changed_files is None else previous['full_timestamp'],
+        }
+    save_cx_state(state)
 
     variables_comment = format_env_vars_comment()
     leave_comment_on_job(variables_comment)
 
 
 
-def build_dag(cfg_file_path):
-    c = configparser.ConfigParser(allow_no_value=False)
-    c.read(cfg_file_path)
+def build_dag(cfg_file_path, cache_dir=DAG_CACHE_DIR):
+    spec = load_spec(cfg_file_path, cache_dir)
     tasks = {}
     dependency_graph = {}
-    task_ids = c.sections()
-    if len(task_ids) == 0:
-        raise Exception("Empty config provided")
-    for task_id in task_ids:
-        if c.has_option(task_id, "depends"):
-            dependencies_str = c.get(task_id, "depends")
-            dependencies = dependencies_str.split(',')
-        else:
-            dependencies = []
-        dependency_graph[task_id] = dependencies
-        command_str = c.get(task_id, "command")
-        command = str(command_str)
-        domino_run_kwargs = {}
-        if c.has_option(task_id, "max_retries"):
-            max_retries = c.get(task_id, "max_retries")
-            domino_run_kwargs["max_retries"] = max_retries
-        if c.has_option(task_id, "tier"):
-            tier = c.get(task_id, "tier")
-            domino_run_kwargs["tier"] = tier
-        # Set the desired compute environment
-        if c.has_option(task_id, "environment"):
-            environment = c.get(task_id, "environment")
-            domino_run_kwargs["environment"] = environment
-        if c.has_option(task_id, 'project_repo_git_ref'):
-            project_repo_git_ref = c.get(task_id, 'project_repo_git_ref')
-            domino_run_kwargs['project_repo_git_ref'] = project_repo_git_ref
-        if c.has_option(task_id, 'imported_repo_git_refs'):
-            imported_repo_git_refs = c.get(task_id, 'imported_repo_git_refs')
-            domino_run_kwargs['imported_repo_git_refs'] = imported_repo_git_refs
-        tasks[task_id] = DominoRun(task_id, command, **domino_run_kwargs)
-    
+    for task in spec['tasks']:
+        dependency_graph[task['task_id']] = task['depends']
+        tasks[task['task_id']] = DominoRun(task['task_id'], task['command'], **task['options'])
+
     return Dag(tasks, dependency_graph)
 
 
@@ -340,56 +604,140 @@ class PipelineRunner:
     should this be stateless or stateful?
     - needs to be stateful to track run IDs and states (for retry logic) of various tasks
     - use Dag object to store state
+
+    executor: runs the tasks instead of the Domino jobs API, e.g. executors.LocalExecutor
     '''
 
-    def __init__(self, dag, tick_freq=5):
+    def __init__(self, dag, tick_freq=5, queue_limit=10, project_id=DOMINO_PROJECT_ID, project_name=DOMINO_PROJECT_NAME, status_path=STATUS_PATH, workers=WORKERS, executor=None, durations_path=DURATIONS_PATH):
         self.dag = dag
+        self.poller = Poller(DurationHistory(durations_path))
+        for task in self.dag.tasks.values():
+            task.poller = self.poller
+        self.executor = executor
+        self.workers = workers
+        self.pools = {}
         self.tick_freq = tick_freq
+        self.queue_limit = queue_limit
+        self.project_id = project_id
+        self.project_name = project_name
+        self.status_path = status_path
+        self.queued_job_count = None
+
+    def write_status(self, status='Running'):
+        write_pipeline_status(self.dag, status, self.queued_job_count, self.queue_limit, self.status_path, self.project_name)
 
     def run(self):
         while True:
-            if self.dag.pipeline_status() == 'Succeeded':
+            # Check the tasks whose status check is due. A task that has finished frees its dependants
+            # to be submitted in this same round.
+            for task_id in self.poller.pop_due(self.dag.tasks, time.time()):
+                self.dag.tasks[task_id].status()
+            pipeline_status = self.dag.pipeline_status()
+            self.write_status(pipeline_status)
+            if pipeline_status == 'Succeeded':
+                self.shutdown()
                 break
-            elif self.dag.pipeline_status() == 'Failed':
+            elif pipeline_status == 'Failed':
+                self.shutdown()
                 raise Exception("Pipeline Execution Failed")
-            # Suspend job submission until the "multijob_locked" project tag is removed
-            while True:
-                jobs_locked = self.are_jobs_locked()
-                if jobs_locked == False:
-                    break
-                time.sleep(self.tick_freq)
-            # Suspend job submission until the number of jobs is below the queue limit
-            while True:
-                queue_limit = 10
-                queued_job_count = self.check_queue_limit()
-                if queued_job_count < queue_limit:
-                    break
-                print('At limit for queued jobs, waiting for queue space.')
-                time.sleep(self.tick_freq)
-
-            ready_tasks = dag.get_ready_tasks()
+            ready_tasks = self.dag.get_ready_tasks()
+            # An executor bounds its own concurrency, so it is given every ready task without the project checks
+            if self.executor is not None:
+                for task in ready_tasks:
+                    self.submit_task(task)
+                self.wait(busy=False)
+                continue
+
+            submitted = 0
             if ready_tasks:
                 print("Ready tasks: {0}".format(", ".join([task.task_id for task in ready_tasks])))
-            # Pull one task out of the ready queue, submit it, wait 1 tick, and repeat tag check
-            for task in ready_tasks:
-                self.submit_task(task)
-                break
-            time.sleep(self.tick_freq)
+                # Hold job submission while the "multijob_locked" project tag is set, or the project
+                # is at the queue limit. Status checks carry on meanwhile.
+                if self.are_jobs_locked():
+                    print('Jobs are locked, waiting for the multijob_locked tag to be removed.')
+                else:
+                    self.queued_job_count = self.check_queue_limit()
+                    if self.queued_job_count >= self.queue_limit:
+                        print('At limit for queued jobs, waiting for queue space.')
+                    else:
+                        # Pull one task out of the ready queue, submit it, wait 1 tick, and repeat tag check.
+                        # Tasks for a worker pool do not start a job, so all of them are queued at once.
+                        for task in ready_tasks:
+                            self.submit_task(task)
+                            submitted += 1
+                            if task.executor is None:
+                                break
+            self.ensure_workers()
+            self.wait(busy=submitted < len(ready_tasks))
+
+    def wait(self, busy):
+        """
+        Sleep until the next status check or retry is due. While ready tasks are waiting to be
+        submitted, wake after at most one tick to submit the next one.
+        """
+        now = time.time()
+        wake_at = [now + (self.tick_freq if busy else MAX_INTERVAL)]
+        if self.poller.next_poll_at() is not None:
+            wake_at.append(self.poller.next_poll_at())
+        wake_at += [task.retry_at for task in self.dag.tasks.values() if task.can_retry()]
+        time.sleep(max(0, min(wake_at) - now))
+
+    def uses_pool(self, task):
+        # Workers run at the project's default git refs, so tasks that override them get their own job.
+        # R programs keep their own job so they run under logrx, and profiled tasks so the profiler
+        # measures the task's own process.
+        if self.workers <= 0 or task.project_repo_git_ref or task.imported_repo_git_refs:
+            return False
+        return not task.command.lower().endswith('.r') and PROFILE != 'true'
+
+    def get_pool(self, environment, tier):
+        name = re.sub(r'[^\w.-]+', '_', f"{environment or 'default'}-{tier or 'default'}")
+        if name not in self.pools:
+            queue = TaskQueue(name)
+            queue.start()
+            self.pools[name] = {'queue': queue, 'environment': environment, 'tier': tier, 'jobs': []}
+        return self.pools[name]
+
+    def submit_to_pool(self, task):
+        pool = self.get_pool(task.environment, task.tier)
+        pool['queue'].enqueue(task.task_id, task.command)
+        print(f"## Queued task: {task.task_id} in worker pool {pool['queue'].pool} ##")
+        task.executor = pool['queue']
+        task.job_id = f"pool:{pool['queue'].pool}"
+        task.set_status('Submitted')
+
+    def ensure_workers(self):
+        """Start worker jobs for pools with waiting tasks, up to the number of workers per pool"""
+        for name, pool in self.pools.items():
+            pool['jobs'] = [job_id for job_id in pool['jobs'] if get_job_status(job_id) not in ('Succeeded', 'Error', 'Failed', 'Stopped')]
+            missing = min(self.workers - len(pool['jobs']), pool['queue'].pending_count())
+            for _ in range(missing):
+                request_body = {
+                    'projectId': self.project_id,
+                    'runCommand': f'python Pipelines/workerpool.py --pool {name}',
+                }
+                if pool['tier']:
+                    request_body['hardwareTier'] = self.get_hardware_tier_id(pool['tier'])
+                if pool['environment']:
+                    request_body['environmentId'] = resolve_environment(pool['environment'])
+                job_info = submit_api_call('POST', 'api/jobs/v1/jobs', data=json.dumps(request_body))
+                pool['jobs'].append(job_info['job']['id'])
+                print(f"## Started worker {job_info['job']['id']} for pool {name} ##")
+
+    def shutdown(self):
+        self.poller.history.save()
+        for pool in self.pools.values():
+            pool['queue'].stop()
+        if self.executor is not None:
+            self.executor.shutdown()
 
 
     def get_hardware_tier_id(self, hardware_tier_name):
-        endpoint = f'v4/projects/{DOMINO_PROJECT_ID}/hardwareTiers'
-        method = 'GET'
-        available_hardware_tiers = submit_api_call(method, endpoint)
-        for hardware_tier in available_hardware_tiers:
-            if hardware_tier['hardwareTier']['name'] == hardware_tier_name:
-                hardware_tier_id = hardware_tier['hardwareTier']['id']
-
-        return hardware_tier_id
+        return get_hardware_tier_id(hardware_tier_name, self.project_id)
 
 
     def set_project_tag(self):
-        endpoint = f'v4/projects/{DOMINO_PROJECT_ID}/tags'
+        endpoint = f'v4/projects/{self.project_id}/tags'
         method = 'POST'
         data = {
             'tagNames': [
@@ -403,14 +751,14 @@ class PipelineRunner:
 
 
     def delete_project_tag(self, tag_id):
-        endpoint = f'v4/projects/{DOMINO_PROJECT_ID}/tags/{tag_id}'
+        endpoint = f'v4/projects/{self.project_id}/tags/{tag_id}'
         method = 'DELETE'
         delete_tag_response = submit_api_call(method, endpoint)
 
 
     def are_jobs_locked(self):
         jobs_locked = False
-        endpoint = f'v4/projects/{DOMINO_PROJECT_ID}'
+        endpoint = f'v4/projects/{self.project_id}'
         method = 'GET'
         project_summary = submit_api_call(method, endpoint)
 
@@ -424,7 +772,7 @@ class PipelineRunner:
 
 
     def check_queue_limit(self):
-        endpoint = f'api/jobs/beta/jobs?projectId={DOMINO_PROJECT_ID}&statusFilter=queued'
+        endpoint = f'api/jobs/beta/jobs?projectId={self.project_id}&statusFilter=queued'
         method = 'GET'
         queued_jobs = submit_api_call(method, endpoint)
 
@@ -434,7 +782,7 @@ class PipelineRunner:
 
 
     def get_imported_repos(self):
-        endpoint = f'api/projects/v1/projects/{DOMINO_PROJECT_ID}/repositories'
+        endpoint = f'api/projects/v1/projects/{self.project_id}/repositories'
         method = 'GET'
         imported_repos = submit_api_call(method, endpoint)
         
@@ -503,7 +851,7 @@ class PipelineRunner:
                 ref_type = repo_config[i]['ref_type']
             if 'ref_value' in repo_config[i]:
                 ref_value = repo_config[i]['ref_value']
-            endpoint = f'v4/projects/{DOMINO_PROJECT_ID}/gitRepositories/{repo_id}/ref'
+            endpoint = f'v4/projects/{self.project_id}/gitRepositories/{repo_id}/ref'
             method = 'PUT'
             git_ref_config = {
                 'type': ref_type,
@@ -515,23 +863,38 @@ class PipelineRunner:
 
 
     def submit_task(self, task):
+        if task.status() in ('Error', 'Failed'):
+            task.retries += 1
+            print(f"## Retrying task {task.task_id} ({task.retries} of {task.max_retries}) after {task.failure} failure ##")
+        if self.executor is not None:
+            task.job_id = self.executor.submit(task)
+            task.executor = self.executor
+            task.set_status('Submitted')
+            return
+        if self.uses_pool(task):
+            self.submit_to_pool(task)
+            return
         print(f"## Submitting task ##\ntask_id: {task.task_id}\ncommand: {task.command}\ntier override: {task.tier}\nenvironment override: {task.environment}\nmain repo override: {task.project_repo_git_ref}\nimported repo overrides: {task.imported_repo_git_refs}")
-        request_body = { 'projectId': DOMINO_PROJECT_ID }
+        request_body = { 'projectId': self.project_id }
         
         # R scripts should be wrapped in the logrx::axecute() function
         if task.command.lower().endswith('.r'):
             print('R script detected. Running via logrx::axecute().')
-            if DOMINO_IS_GIT_BASED == 'true':
-                dataset_root = '/mnt/data'
-            else:
-                dataset_root = '/domino/datasets/local'
-            if os.path.exists(f'{dataset_root}/{DOMINO_PROJECT_NAME}'):
-                logrx_log_path = f'{dataset_root}/{DOMINO_PROJECT_NAME}/logs/'
-                if not os.path.exists(logrx_log_path):
-                    os.makedirs(logrx_log_path)
-                task.command = f'R -e "logrx::axecute(\'{task.command}\', log_path = \'{logrx_log_path}\')"'
+            # The log folder is on the dataset of the project the job runs in, which in batch mode
+            # is not mounted in this job, so the job creates it
+            logrx_log_path = f'{DATASET_ROOT}/{self.project_name}/logs/'
+            task.command = (
+                f'R -e "dir.create(\'{logrx_log_path}\', recursive = TRUE, showWarnings = FALSE); '
+                f'logrx::axecute(\'{task.command}\', log_path = \'{logrx_log_path}\')"'
+            )
 
         request_body['runCommand'] = task.command
+        # Run under the profiler, which records the job's resource use for utilities/profile_task.py --report
+        if PROFILE == 'true':
+            profiler = ['python', 'utilities/profile_task.py', '--name', task.task_id]
+            if task.tier:
+                profiler += ['--tier', task.tier]
+            request_body['runCommand'] = f'{shlex.join(profiler)} -- {task.command}'
         # If the user has specified custom git refs, set the "multijob_locked" tag before doing anything else
         # Then, save the current imported repo config to revert later before setting the user config.
         if task.imported_repo_git_refs:
@@ -542,7 +905,7 @@ class PipelineRunner:
             hardware_tier_id = self.get_hardware_tier_id(task.tier)
             request_body['hardwareTier'] = hardware_tier_id
         if task.environment:
-            request_body['environmentId'] = task.environment
+            request_body['environmentId'] = resolve_environment(task.environment)
         if task.project_repo_git_ref:
             project_repo_config = task.project_repo_git_ref.split(',')
             if len(project_repo_config) == 2:
@@ -580,16 +943,30 @@ v0.1: just read the cfg file and submit commands. skip all validation, put respo
 """
 
 if __name__ == '__main__':
-    pipeline_cfg_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Run the tasks of a multijob config in dependency order.')
+    parser.add_argument('cfg', help='multijob config to run')
+    parser.add_argument('--executor', choices=['domino', 'local'], default='domino', help='Run each task as a Domino job, or as a process on this machine')
+    parser.add_argument('--max-workers', type=int, help='Maximum tasks the local executor runs at once (default: one per CPU)')
+    parser.add_argument('--tick-freq', type=int, default=5, help='Seconds between scheduling rounds')
+    parser.add_argument('--only', help='File listing the tasks to run, one per line, e.g. from utilities/sdtm_diff.py. The other tasks are skipped.')
+    args = parser.parse_args()
+    check_environment()
+    pipeline_cfg_path = args.cfg
     if os.path.exists(pipeline_cfg_path):
         if PRERUN_CLEANUP == 'true':
             cleanup_datasets()
         dag = build_dag(pipeline_cfg_path)
         print(dag)
         dag.validate_dag()
-        pipeline_runner = PipelineRunner(dag)
+        if args.only:
+            with open(args.only) as f:
+                dag.run_only([line.strip() for line in f if line.strip()])
+        executor = LocalExecutor(LOCAL_LOG_DIR, args.max_workers) if args.executor == 'local' else None
+        pipeline_runner = PipelineRunner(dag, tick_freq=args.tick_freq, executor=executor)
+        run_started_at = time.time()
         pipeline_runner.run()
         if CXRUN == 'true':
-            full_cx()
+            # After a cleanup, every file of the datasets was written by this run
+            full_cx(None if PRERUN_CLEANUP == 'true' else run_started_at)
     else:
         sys.exit("Empty or missing config file")
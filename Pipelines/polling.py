@@ -0,0 +1,113 @@
+"""
+Schedule the status checks of multijob tasks from how long they have taken before.
+
+Rather than asking the API for the status of every active task on every tick, each task gets its
+own next check time, kept in a priority queue:
+
+    Queued      Checked every few seconds at first, then less often the longer it waits, but at
+                least every QUEUED_MAX_INTERVAL seconds: the start of a task is when it is first
+                seen running, so a longer interval would shift its start time and the duration
+                recorded for it.
+    Running     With a history, checked about halfway through the time left until the task would
+                finish if it ran as fast as its quickest usual run (the 25th percentile of its past
+                durations), so checks close in on the expected completion. A 40 minute ADLB is
+                checked every couple of minutes at first, and every few seconds near the end.
+                Past that point, the interval is a quarter of the time the task has run over it,
+                so a task that finishes late is still seen finished within a quarter of its delay.
+                Without a history, the interval grows with its run time.
+
+Durations of successful runs are kept per task, the most recent HISTORY_SIZE of each, in a JSON
+file on the project dataset.
+"""
+import heapq
+import json
+import os
+import statistics
+import time
+
+MIN_INTERVAL = 2
+MAX_INTERVAL = 120
+QUEUED_MAX_INTERVAL = 15
+HISTORY_SIZE = 20
+EXPECTED_QUANTILE = 0.25
+
+FINAL_STATES = ('Succeeded', 'Skipped', 'Error', 'Failed', 'Stopped')
+
+
+def clamp(interval):
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+
+
+class DurationHistory:
+    """Past run times of each task"""
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.durations = json.load(f)
+        except (OSError, ValueError):
+            self.durations = {}
+
+    def record(self, task_id, duration):
+        self.durations[task_id] = (self.durations.get(task_id, []) + [round(duration, 1)])[-HISTORY_SIZE:]
+
+    def expected(self, task_id):
+        """The early end of the task's usual run time, or None without a history"""
+        durations = sorted(self.durations.get(task_id, []))
+        if not durations:
+            return None
+        if len(durations) == 1:
+            return durations[0]
+        return statistics.quantiles(durations, n=100, method='inclusive')[int(EXPECTED_QUANTILE * 100) - 1]
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(self.durations, f)
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError as err:
+            print(f'WARNING: Could not save task durations to {self.path}: {err}')
+
+
+class Poller:
+    """Priority queue of the next status check of each active task"""
+    def __init__(self, history):
+        self.history = history
+        self.heap = []
+
+    def interval(self, task, now):
+        if task.started_at is None:
+            waited = now - (task.submitted_at or now)
+            return min(QUEUED_MAX_INTERVAL, clamp(waited / 4))
+        elapsed = now - task.started_at
+        expected = self.history.expected(task.task_id)
+        if expected is None:
+            return clamp(elapsed / 10)
+        if elapsed >= expected:
+            return clamp((elapsed - expected) / 4)
+        return clamp((expected - elapsed) / 2)
+
+    def update(self, task):
+        """Called whenever a task's status is set: schedule its next check, or record its duration once done"""
+        now = time.time()
+        if task._status in FINAL_STATES:
+            task.next_poll_at = None
+            if task._status == 'Succeeded' and task.duration() is not None:
+                self.history.record(task.task_id, task.duration())
+            return
+        task.next_poll_at = now + self.interval(task, now)
+        heapq.heappush(self.heap, (task.next_poll_at, task.task_id))
+
+    def next_poll_at(self):
+        """Time of the earliest scheduled check, or None"""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, tasks, now):
+        """Task IDs whose check is due. Entries superseded by a later schedule of the same task are dropped."""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            poll_at, task_id = heapq.heappop(self.heap)
+            if tasks[task_id].next_poll_at == poll_at and task_id not in due:
+                due.append(task_id)
+        return due
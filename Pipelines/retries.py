@@ -0,0 +1,81 @@
+"""
+Decide whether and how a failed multijob task is retried.
+
+When a task's run fails, its cause is read from the final status and the tail of its log:
+
+    infrastructure  The run was lost rather than failed: the node was preempted or evicted, the
+                    environment could not start, or storage or the network went away. Domino reports
+                    these as Error. Retried on the same tier after an exponential backoff.
+    out_of_memory   The program ran out of memory, or was killed for using too much. Retried
+                    straight away on the next larger tier in TIER_LADDER.
+    code            The program itself failed, e.g. a SAS ERROR, an R error or a Python traceback.
+                    Running it again gives the same result, so it is never retried.
+    unknown         Anything else, including a non-zero exit code without an error from the program,
+                    such as the "Exit code N" line the local executor and worker pools append to
+                    every log. Retried on the same tier after a backoff.
+
+A task is retried at most max_retries times, whatever the cause.
+"""
+import os
+import re
+
+# Hardware tiers from smallest to largest. A task on the project's default tier is taken to be on the smallest.
+TIER_LADDER = [tier.strip() for tier in os.environ.get('MULTIJOB_TIER_LADDER', 'Small - [AWS US],Medium - [AWS US],Large - [AWS US]').split(',') if tier.strip()]
+
+# Seconds before the first retry after an infrastructure failure, doubled for each retry after that
+BACKOFF_BASE = 30
+BACKOFF_MAX = 600
+
+LOG_TAIL_LINES = 200
+
+# Checked in this order, so e.g. a SAS "ERROR: Insufficient memory" counts as out of memory, not a code error
+PATTERNS = [
+    ('out_of_memory', re.compile(
+        r'OOMKilled|out of memory|Insufficient memory|cannot allocate (vector|memory)|MemoryError'
+        r'|exit code 137|Killed by signal 9', re.IGNORECASE)),
+    ('infrastructure', re.compile(
+        r'preempt|evicted|spot instance|node (was )?(shut ?down|lost|not ready)|ImagePullBackOff|ErrImagePull'
+        r'|failed to (pull|mount|schedule)|Stale file handle|Connection (reset|refused|timed out)'
+        r'|Temporary failure in name resolution|Service Unavailable|Gateway Time-?out|Worker lost', re.IGNORECASE)),
+    ('code', re.compile(
+        r'^ERROR( \d+-\d+)?:|^Error in |^Error:|Execution halted|Traceback \(most recent call last\)', re.MULTILINE)),
+]
+
+
+def classify_failure(status, log_tail):
+    """Return the cause of a failed run, from its final status (Error or Failed) and the end of its log"""
+    for cause, pattern in PATTERNS:
+        if pattern.search(log_tail or ''):
+            return cause
+    # Domino uses Error for runs that could not be started or completed, rather than a non-zero exit
+    if status == 'Error':
+        return 'infrastructure'
+    return 'unknown'
+
+
+def next_tier(tier):
+    """The next larger tier in the ladder, or None if there is none"""
+    position = TIER_LADDER.index(tier) if tier in TIER_LADDER else (0 if tier is None else None)
+    if position is None or position + 1 >= len(TIER_LADDER):
+        return None
+    return TIER_LADDER[position + 1]
+
+
+def backoff_delay(retries):
+    return min(BACKOFF_BASE * 2 ** retries, BACKOFF_MAX)
+
+
+def retry_plan(cause, tier, retries):
+    """
+    Return (delay in seconds, tier) for the next attempt, or None if the task should not be retried.
+
+    :param cause: Cause from classify_failure
+    :param tier: Tier of the failed run, None for the project default
+    :param retries: Retries made so far
+    """
+    if cause == 'code':
+        return None
+    if cause == 'out_of_memory':
+        larger_tier = next_tier(tier)
+        return None if larger_tier is None else (0, larger_tier)
+    return backoff_delay(retries), tier
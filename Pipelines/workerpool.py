@@ -0,0 +1,339 @@
+"""
+Warm worker pools for multijob.
+
+Instead of one Domino job per task, multijob can start a few long-lived worker jobs per
+environment and tier, which take task commands from a queue on the project dataset and run
+them in a session that is already initialised:
+
+    SAS     One sas -stdio session per worker. domino.sas is included once when the session
+            starts. Each task's log is redirected to its own file with PROC PRINTTO, its
+            program is %included, and WORK is emptied and the options are reset afterwards.
+            The task fails if SYSCC is above 4.
+    Other   Python programs and any other command run as a subprocess, logging to a file.
+
+R programs are not sent to the pools: multijob runs each of them as its own job through
+logrx::axecute(), whose log is part of the GxP record. Nor is any task while DMV_PROFILE is set,
+as the profiler measures a task's own process.
+
+A task that runs for longer than MULTIJOB_POOL_TASK_TIMEOUT seconds (6 hours by default) fails,
+and its session is stopped, as a SAS program with an unbalanced quote or %macro never returns.
+
+The queue is a directory per pool on the dataset mount, rather than a database, because file
+locking cannot be relied on over the network file system the datasets are served from:
+
+    <pool>/pending/<seq>-<task>.json    Waiting tasks. A worker claims one by renaming it into
+                                        running/, which only one worker can do.
+    <pool>/running/<task>.json          Claimed tasks. The worker touches the file when it claims the
+                                        task and while it runs, so a task whose worker was lost can be
+                                        detected. The file names the claim, and a worker only records
+                                        the result of a task it still holds.
+    <pool>/done/<task>.json             The result of each task: status, exit code, log, times.
+    <pool>/logs/<task>.log              The task's log.
+    <pool>/stop                         Tells the workers to exit once their current task is done.
+
+Start a worker: python Pipelines/workerpool.py --pool <name>
+"""
+import argparse
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from domino_paths import DATASET_ROOT
+
+QUEUE_ROOT = os.environ.get('MULTIJOB_POOL_PATH', f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/multijob/pools")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A running task whose file has not been touched for HEARTBEAT_TIMEOUT seconds has lost its worker
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 180
+# Workers exit after this many seconds without a task
+IDLE_TIMEOUT = 600
+# A task still running after this many seconds is stopped, together with its session
+TASK_TIMEOUT = int(os.environ.get('MULTIJOB_POOL_TASK_TIMEOUT', 6 * 3600))
+POLL_INTERVAL = 2
+
+MARKER = '__MULTIJOB_TASK_DONE__'
+
+
+def write_json(path, data):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+class TaskQueue:
+    """The queue of one worker pool"""
+    def __init__(self, pool, root=QUEUE_ROOT):
+        self.pool = pool
+        self.path = os.path.join(root, pool)
+        for folder in ('pending', 'running', 'done', 'logs'):
+            os.makedirs(os.path.join(self.path, folder), exist_ok=True)
+
+    def folder(self, name, *parts):
+        return os.path.join(self.path, name, *parts)
+
+    def enqueue(self, task_id, command):
+        # A retried task starts from a clean slate
+        for stale in (self.folder('done', f'{task_id}.json'), self.folder('running', f'{task_id}.json')):
+            if os.path.exists(stale):
+                os.remove(stale)
+        task = {'task_id': task_id, 'command': command, 'queued_at': time.time()}
+        tmp = os.path.join(self.path, f'{task_id}.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(task, f)
+        os.rename(tmp, self.folder('pending', f'{time.time_ns()}-{task_id}.json'))
+
+    def claim(self):
+        """Take the oldest pending task, or return None if there is none"""
+        for name in sorted(os.listdir(self.folder('pending'))):
+            task_id = name.split('-', 1)[1][:-len('.json')]
+            running = self.folder('running', f'{task_id}.json')
+            try:
+                os.rename(self.folder('pending', name), running)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            # The rename keeps the time the task was queued, which would make the claim look stale
+            os.utime(running)
+            with open(running) as f:
+                task = json.load(f)
+            # Identifies this claim, so a worker that was given up on cannot complete a retry of the task
+            task['claim'] = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}'
+            write_json(running, task)
+            return task
+        return None
+
+    def heartbeat(self, task_id):
+        try:
+            os.utime(self.folder('running', f'{task_id}.json'))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task_id, result, claim=None):
+        """Record a task's result. With a claim, only if the task is still held by that claim."""
+        running = self.folder('running', f'{task_id}.json')
+        if claim is not None:
+            try:
+                with open(running) as f:
+                    current = json.load(f).get('claim')
+            except (FileNotFoundError, ValueError):
+                current = None
+            if current != claim:
+                print(f'WARNING: {task_id} was given up on or retried while it ran, discarding its result')
+                return False
+        write_json(self.folder('done', f'{task_id}.json'), result)
+        try:
+            os.remove(running)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def pending_count(self):
+        return len(os.listdir(self.folder('pending')))
+
+    def result(self, task_id):
+        try:
+            with open(self.folder('done', f'{task_id}.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def log_tail(self, task_id, lines):
+        """The end of the task's log, followed by the worker's error if the task could not be run"""
+        try:
+            with open(self.folder('logs', f'{task_id}.log'), errors='replace') as f:
+                tail = ''.join(f.readlines()[-lines:])
+        except OSError:
+            tail = ''
+        result = self.result(task_id) or {}
+        if result.get('error'):
+            tail += f"\n{result['error']}\n"
+        elif result.get('returncode'):
+            tail += f"\nExit code {result['returncode']}\n"
+        return tail
+
+    def status(self, task_id):
+        """Return the task's status, in the same terms as the Domino jobs API"""
+        result = self.result(task_id)
+        if result is not None:
+            return result['status']
+        running = self.folder('running', f'{task_id}.json')
+        try:
+            if time.time() - os.path.getmtime(running) > HEARTBEAT_TIMEOUT:
+                self.complete(task_id, {'task_id': task_id, 'status': 'Failed', 'error': 'Worker lost while running the task'})
+                return 'Failed'
+            return 'Running'
+        except FileNotFoundError:
+            pass
+        if any(name.endswith(f'-{task_id}.json') for name in os.listdir(self.folder('pending'))):
+            return 'Queued'
+        # Completed between the checks above
+        result = self.result(task_id)
+        return result['status'] if result is not None else 'Failed'
+
+    def stop(self):
+        open(os.path.join(self.path, 'stop'), 'w').close()
+
+    def start(self):
+        if os.path.exists(os.path.join(self.path, 'stop')):
+            os.remove(os.path.join(self.path, 'stop'))
+
+    def stopped(self):
+        return os.path.exists(os.path.join(self.path, 'stop'))
+
+
+class Session:
+    """A long-lived interpreter that tasks are fed to through stdin"""
+    def __init__(self, args, startup, marker_stream, session_log):
+        self.log = open(session_log, 'a')
+        pipes = {'stdout': subprocess.PIPE, 'stderr': self.log} if marker_stream == 'stdout' else {'stdout': self.log, 'stderr': subprocess.PIPE}
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, text=True, cwd=REPO_ROOT, **pipes)
+        self.stream = getattr(self.process, marker_stream)
+        self.submit(startup, 'startup')
+
+    def submit(self, code, task_id, timeout=None):
+        """
+        Send code to the session and wait for its completion marker. Returns the exit code it reports.
+        If the marker does not come within timeout seconds, e.g. because of an unbalanced quote or
+        %macro in a SAS program, the session is killed and the task fails.
+        """
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            self.process.kill()
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer is not None:
+            timer.start()
+        try:
+            self.process.stdin.write(code + '\n')
+            self.process.stdin.flush()
+            for line in self.stream:
+                if line.startswith(f'{MARKER} {task_id} '):
+                    return int(line.split()[2])
+                self.log.write(line)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timed_out.is_set():
+            raise TimeoutError(f'Task did not finish within {timeout} seconds, its session was stopped')
+        raise RuntimeError(f'Session exited with code {self.process.wait()}')
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            self.process.wait()
+        self.log.close()
+
+
+class SasSession(Session):
+    def __init__(self, session_log):
+        autoexec = os.path.join(REPO_ROOT, 'domino.sas')
+        startup = f'%include "{autoexec}";' if os.path.exists(autoexec) else ''
+        super().__init__(['sas', '-stdio', '-nonews'], startup + self.marker('startup'), 'stderr', session_log)
+
+    @staticmethod
+    def marker(task_id):
+        return f'%put {MARKER} {task_id} &syscc.;'
+
+    def run(self, task_id, program, log_path, timeout=TASK_TIMEOUT):
+        code = f'''
+options obs=max replace nosyntaxcheck;
+%let syscc = 0;
+proc printto log="{log_path}" new; run;
+%include "{program}";
+proc printto; run;
+{self.marker(task_id)}
+proc datasets library=work kill nolist nowarn; quit;
+'''
+        syscc = self.submit(code, task_id, timeout)
+        return 0 if syscc <= 4 else syscc
+
+
+SESSIONS = {'.sas': SasSession}
+
+
+def run_subprocess(command, log_path, timeout=TASK_TIMEOUT):
+    args = shlex.split(command)
+    if len(args) == 1 and args[0].lower().endswith('.py'):
+        args = [sys.executable] + args
+    with open(log_path, 'w') as log:
+        try:
+            return subprocess.call(args, stdout=log, stderr=subprocess.STDOUT, cwd=REPO_ROOT, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise TimeoutError(f'Task did not finish within {timeout} seconds, it was stopped')
+
+
+def run_task(task, queue, sessions, worker_id):
+    task_id, command = task['task_id'], task['command']
+    log_path = queue.folder('logs', f'{task_id}.log')
+    result = {'task_id': task_id, 'command': command, 'worker': worker_id, 'log': log_path, 'started_at': time.time()}
+
+    # Keep the claim fresh while the task runs, starting now
+    finished = threading.Event()
+    queue.heartbeat(task_id)
+    def heartbeat():
+        while not finished.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat(task_id)
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    try:
+        extension = os.path.splitext(command.strip())[1].lower()
+        if extension in SESSIONS and len(shlex.split(command)) == 1:
+            session = sessions.get(extension)
+            if session is None or not session.alive():
+                session = SESSIONS[extension](queue.folder('logs', f'session-{worker_id}{extension}.log'))
+                sessions[extension] = session
+            program = os.path.join(REPO_ROOT, command.strip())
+            result['returncode'] = session.run(task_id, program, log_path)
+        else:
+            result['returncode'] = run_subprocess(command, log_path)
+        result['status'] = 'Succeeded' if result['returncode'] == 0 else 'Failed'
+    except Exception as err:
+        result['status'] = 'Failed'
+        result['error'] = str(err)
+    finally:
+        finished.set()
+
+    result['finished_at'] = time.time()
+    return result
+
+
+def run_worker(pool, root=QUEUE_ROOT, idle_timeout=IDLE_TIMEOUT):
+    queue = TaskQueue(pool, root)
+    worker_id = os.environ.get('DOMINO_RUN_ID', f'{socket.gethostname()}-{os.getpid()}')
+    sessions = {}
+    idle_since = time.time()
+    print(f'Worker {worker_id} serving pool {pool}')
+    try:
+        while not queue.stopped():
+            task = queue.claim()
+            if task is None:
+                if time.time() - idle_since > idle_timeout:
+                    print(f'No tasks for {idle_timeout} seconds, exiting.')
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(f"Running {task['task_id']}: {task['command']}")
+            result = run_task(task, queue, sessions, worker_id)
+            queue.complete(task['task_id'], result, task['claim'])
+            print(f"{task['task_id']}: {result['status']} in {result['finished_at'] - result['started_at']:.1f} s")
+            idle_since = time.time()
+    finally:
+        for session in sessions.values():
+            session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run multijob tasks from a worker pool queue in warm SAS sessions.')
+    parser.add_argument('--pool', required=True, help='Name of the pool to take tasks from')
+    parser.add_argument('--idle-timeout', type=int, default=IDLE_TIMEOUT, help='Seconds without a task before the worker exits')
+    args = parser.parse_args()
+    run_worker(args.pool, idle_timeout=args.idle_timeout)
@@ -1,4 +1,14 @@
 #!/usr/bin/env bash
-export FLASK_APP=share/run.py
-export FLASK_DEBUG=1
-python -m flask run --host=0.0.0.0 --port=8888
+# APP_MODE=debug runs the Flask development server with the debugger and reloader.
+# Otherwise the app is served by gunicorn with APP_WORKERS worker processes.
+APP_MODE=${APP_MODE:-production}
+APP_WORKERS=${APP_WORKERS:-4}
+
+if [ "$APP_MODE" = "debug" ]; then
+    export FLASK_APP=share/run.py
+    export FLASK_DEBUG=1
+    python -m flask run --host=0.0.0.0 --port=8888
+else
+    # Threaded workers, so open pipeline status streams do not hold a whole worker each
+    exec gunicorn --chdir share --workers "$APP_WORKERS" --worker-class gthread --threads "${APP_THREADS:-8}" --bind 0.0.0.0:8888 --access-logfile - run:app
+fi
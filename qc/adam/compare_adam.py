@@ -0,0 +1,578 @@
+"""
+Python alternative to compare_adam.sas.
+
+Compares every production ADaM dataset against its QC counterpart with vectorised,
+ID-variable joined diffs (pandas/NumPy) and runs the dataset pairs in parallel
+across processes. Dataset pairs whose files have identical content hashes are
+reported as Clean without being read.
+
+The issue wording follows the SYSINFO decode used by %s_compare, and the
+dominostats.json summary has the same keys as the one written by compare_adam.sas,
+so the Domino jobs dashboard looks the same whichever engine produced it.
+
+Usage:
+    python qc/adam/compare_adam.py
+    python qc/adam/compare_adam.py --datasets adsl adae --abs-tol 1e-12
+    python qc/adam/compare_adam.py --incremental
+
+When only some datasets are compared, as the per-dataset compare tasks multijob generates
+for each prod/QC pair do, the stored results of the other datasets are carried over, so
+the summary and dominostats.json always cover every dataset compared so far. Compares
+running in parallel update the stored results one at a time under a lock file.
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+BASE_PATH = '/mnt/data/ADAM'
+COMP_PATH = '/mnt/data/ADAMQC'
+COMPARE_PATH = '/mnt/data/COMPARE'
+ARTIFACTS_PATH = '/mnt/artifacts'
+
+DATASET_EXTENSIONS = ('.sas7bdat', '.xpt', '.parquet')
+
+# ID variables used to join base and comp records. Only the variables present in both
+# datasets are used; if none are present the datasets are compared by observation number.
+ID_VARS = {
+    'adsl': ['STUDYID', 'USUBJID'],
+    'adae': ['STUDYID', 'USUBJID', 'AESEQ'],
+    'adcm': ['STUDYID', 'USUBJID', 'CMSEQ'],
+    'admh': ['STUDYID', 'USUBJID', 'MHSEQ'],
+    'adlb': ['STUDYID', 'USUBJID', 'PARAMCD', 'AVISITN', 'LBSEQ'],
+    'advs': ['STUDYID', 'USUBJID', 'PARAMCD', 'AVISITN', 'VSSEQ'],
+    'adef': ['STUDYID', 'USUBJID', 'PARAMCD', 'AVISITN'],
+}
+DEFAULT_ID_VARS = ['STUDYID', 'USUBJID']
+
+# Issue codes and wording as decoded by %s_compare
+ISSUES = {
+    64: 'Base data set has observation not in comparison',
+    128: 'Comparison data set has observation not in base',
+    1024: 'Base data set has variable not in comparison',
+    2048: 'Comparison data set has variable not in base',
+    4096: 'A value comparison was unequal',
+    8192: 'Conflicting variable types',
+    131072: 'Variable order differs (for variables in common)',
+    262144: 'Variable name has different case',
+    1048576: 'ID Variables are not unique to a record in Dataset(s)',
+}
+MISSING_DATASET = 'Dataset only in one library'
+
+# Number of joined records per block in the incremental fingerprints
+BLOCK_SIZE = 10000
+STATE_FILE = 'fingerprints.json'
+LOCK_FILE = '.compare.lock'
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_datasets(path, prefix=''):
+    """Map lower case dataset name (without prefix) -> file path for every dataset in a folder"""
+    datasets = {}
+    if not os.path.isdir(path):
+        return datasets
+    for filename in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() not in DATASET_EXTENSIONS:
+            continue
+        name = stem.lower()
+        if prefix and name.startswith(prefix.lower()):
+            name = name[len(prefix):]
+        datasets.setdefault(name, os.path.join(path, filename))
+    return datasets
+
+
+def read_dataset(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    if ext == '.xpt':
+        return pd.read_sas(path, format='xport', encoding='latin-1')
+    return pd.read_sas(path, format='sas7bdat', encoding='infer')
+
+
+def normalise(series):
+    """Put a column into a form where SAS equality semantics apply (blank == missing, trailing blanks ignored)"""
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        return series.fillna('').astype(str).str.rstrip()
+    return series
+
+
+def is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def unequal_mask(base, comp, abs_tol=0.0, rel_tol=0.0):
+    """Vectorised element-wise inequality of two aligned columns"""
+    if is_numeric(base) and is_numeric(comp):
+        b = base.to_numpy(dtype='float64', na_value=np.nan)
+        c = comp.to_numpy(dtype='float64', na_value=np.nan)
+        return ~np.isclose(b, c, rtol=rel_tol, atol=abs_tol, equal_nan=True)
+    if pd.api.types.is_datetime64_any_dtype(base) and pd.api.types.is_datetime64_any_dtype(comp):
+        both_missing = base.isna().to_numpy() & comp.isna().to_numpy()
+        return ~(both_missing | (base.to_numpy() == comp.to_numpy()))
+    return normalise(base).to_numpy() != normalise(comp).to_numpy()
+
+
+def column_kind(series):
+    if is_numeric(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return 'N'
+    return 'C'
+
+
+def align_frames(base_df, comp_df, id_vars=None):
+    """
+    Run the variable level checks and join the base and comp records.
+
+    Records are joined on the ID variables, with duplicate IDs matched in order. The joined frame is sorted on
+    the join columns, so two runs over the same ID values always give the same row layout.
+
+    :param base_df: Production dataset
+    :param comp_df: QC dataset
+    :param id_vars: Candidate ID variables used to join the records
+    :return: (issues, merged, join_on, columns) where columns are the variables whose values can be compared
+    """
+    issues = []
+
+    # Variables are matched case insensitively, as SAS does
+    base_cols = {col.upper(): col for col in base_df.columns}
+    comp_cols = {col.upper(): col for col in comp_df.columns}
+    only_base = [col for col in base_cols if col not in comp_cols]
+    only_comp = [col for col in comp_cols if col not in base_cols]
+    common = [col for col in base_cols if col in comp_cols]
+    if only_base:
+        issues.append((1024, ', '.join(only_base)))
+    if only_comp:
+        issues.append((2048, ', '.join(only_comp)))
+    if common != [col for col in comp_cols if col in base_cols]:
+        issues.append((131072, ''))
+    case_diffs = [col for col in common if base_cols[col] != comp_cols[col]]
+    if case_diffs:
+        issues.append((262144, ', '.join(case_diffs)))
+
+    base_df = base_df.rename(columns=str.upper)
+    comp_df = comp_df.rename(columns=str.upper)
+
+    conflicting = [col for col in common if column_kind(base_df[col]) != column_kind(comp_df[col])]
+    if conflicting:
+        issues.append((8192, ', '.join(conflicting)))
+
+    keys = [var for var in (id_vars or DEFAULT_ID_VARS) if var in common and var not in conflicting]
+    if keys:
+        base_df[keys] = base_df[keys].apply(normalise)
+        comp_df[keys] = comp_df[keys].apply(normalise)
+        if base_df.duplicated(keys).any() or comp_df.duplicated(keys).any():
+            issues.append((1048576, ', '.join(keys)))
+        base_df['__dup'] = base_df.groupby(keys, dropna=False).cumcount()
+        comp_df['__dup'] = comp_df.groupby(keys, dropna=False).cumcount()
+        join_on = keys + ['__dup']
+    else:
+        base_df['__obs'] = np.arange(len(base_df))
+        comp_df['__obs'] = np.arange(len(comp_df))
+        join_on = ['__obs']
+
+    merged = base_df.merge(comp_df, on=join_on, how='outer', sort=True, suffixes=('__base', '__comp'), indicator=True)
+    merged = merged.reset_index(drop=True)
+    base_only = int((merged['_merge'] == 'left_only').sum())
+    comp_only = int((merged['_merge'] == 'right_only').sum())
+    if base_only:
+        issues.append((64, f'{base_only} observation(s)'))
+    if comp_only:
+        issues.append((128, f'{comp_only} observation(s)'))
+
+    columns = [col for col in common if col not in conflicting and col not in join_on]
+    return issues, merged, join_on, columns
+
+
+def fingerprint(merged, join_on, columns, block_size=BLOCK_SIZE):
+    """
+    Fingerprint the joined records: one hash for the row layout, and for each side a hash per column and
+    per block of block_size rows. A value can only compare differently to the previous run if, on one side,
+    both its column hash and its block hash changed.
+    """
+    def digest(values):
+        return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+    fingerprints = {'layout': digest(pd.util.hash_pandas_object(merged[join_on + ['_merge']], index=False))}
+    for side in ('base', 'comp'):
+        side_columns = [f'{col}__{side}' for col in columns]
+        column_hashes = {
+            col: pd.util.hash_pandas_object(merged[side_col], index=False).to_numpy()
+            for col, side_col in zip(columns, side_columns)
+        }
+        row_hashes = pd.util.hash_pandas_object(merged[side_columns], index=False).to_numpy() if columns else np.zeros(len(merged), dtype='uint64')
+        fingerprints[side] = {
+            'columns': {col: digest(values) for col, values in column_hashes.items()},
+            'blocks': [digest(row_hashes[start:start + block_size]) for start in range(0, len(merged), block_size)],
+        }
+    return fingerprints
+
+
+def changed_cells(previous, current):
+    """
+    Work out which columns and row blocks need to be compared again, given the fingerprints of the previous run.
+    Returns None if the row layout or the variables changed, in which case everything is compared.
+    """
+    if previous is None or previous['layout'] != current['layout']:
+        return None
+    columns, blocks = set(), set()
+    for side in ('base', 'comp'):
+        if set(previous[side]['columns']) != set(current[side]['columns']):
+            return None
+        columns |= {col for col, value in current[side]['columns'].items() if previous[side]['columns'][col] != value}
+        blocks |= {i for i, value in enumerate(current[side]['blocks']) if previous[side]['blocks'][i] != value}
+    return columns, blocks
+
+
+def diff_values(merged, join_on, columns, rows=None, abs_tol=0.0, rel_tol=0.0, max_diffs=100, block_size=BLOCK_SIZE):
+    """
+    Compare the values of the joined records.
+
+    :param rows: Optional boolean mask restricting the compare to a subset of the records
+    :return: (unequal, diffs) where unequal maps column -> {block: count} and diffs lists unequal values
+    """
+    both = (merged['_merge'] == 'both').to_numpy()
+    if rows is not None:
+        both = both & rows
+    positions = np.flatnonzero(both)
+    subset = merged.iloc[positions]
+    id_columns = [col for col in join_on if col != '__dup']
+
+    unequal = {}
+    diffs = []
+    for col in columns:
+        mask = unequal_mask(subset[f'{col}__base'], subset[f'{col}__comp'], abs_tol, rel_tol)
+        if not mask.any():
+            continue
+        blocks, counts = np.unique(positions[mask] // block_size, return_counts=True)
+        unequal[col] = {int(block): int(count) for block, count in zip(blocks, counts)}
+        sample = subset.loc[mask, id_columns].head(max_diffs)
+        diffs.append(sample.assign(
+            ROW=positions[mask][:max_diffs],
+            VARIABLE=col,
+            BASE=subset.loc[mask, f'{col}__base'].head(max_diffs).astype(str).to_numpy(),
+            COMP=subset.loc[mask, f'{col}__comp'].head(max_diffs).astype(str).to_numpy(),
+        ))
+
+    diffs = pd.concat(diffs, ignore_index=True) if diffs else pd.DataFrame()
+    return unequal, diffs
+
+
+def unequal_issue(unequal):
+    totals = {col: sum(blocks.values()) for col, blocks in unequal.items() if sum(blocks.values())}
+    if not totals:
+        return []
+    return [(4096, ', '.join(f'{col} ({count})' for col, count in totals.items()))]
+
+
+def compare_frames(base_df, comp_df, id_vars=None, abs_tol=0.0, rel_tol=0.0, max_diffs=100):
+    """
+    Compare two datasets and return the issues found.
+
+    :param base_df: Production dataset
+    :param comp_df: QC dataset
+    :param id_vars: Candidate ID variables used to join the records
+    :param abs_tol: Absolute tolerance for numeric values
+    :param rel_tol: Relative tolerance for numeric values
+    :param max_diffs: Maximum number of unequal values to keep per variable for the report
+    :return: (issues, diffs) where issues is a list of (code, detail) tuples and diffs a DataFrame of unequal values
+    """
+    issues, merged, join_on, columns = align_frames(base_df, comp_df, id_vars)
+    unequal, diffs = diff_values(merged, join_on, columns, abs_tol=abs_tol, rel_tol=rel_tol, max_diffs=max_diffs)
+    return issues + unequal_issue(unequal), diffs
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def library_name(path):
+    """Label of a dataset folder in the summary, e.g. ADAM for /mnt/data/ADAM or TFLQC for /mnt/data/TFLQC"""
+    return os.path.basename(os.path.normpath(path)).upper()
+
+
+def compare_pair(name, base_path, comp_path, abs_tol=0.0, rel_tol=0.0, max_diffs=100, id_vars=None, previous=None,
+                 previous_diffs=None, base_library='ADAM', comp_library='ADAMQC'):
+    """
+    Compare one dataset pair. Runs in a worker process, so everything returned must be picklable.
+
+    :param previous: State stored for this dataset by the previous incremental run, if any
+    :param previous_diffs: Path to the unequal value listing written by the previous run, if any
+    :param base_library: Name of the production library, used to label the dataset
+    :param comp_library: Name of the QC library
+    """
+    result = {
+        'name': name,
+        'base': f'{base_library}.{name.upper()}' if base_path else '',
+        'comp': f'{comp_library}.{name.upper()}' if comp_path else '',
+        'issues': [],
+        'unequal': {},
+        'diffs': None,
+        'state': None,
+    }
+    if not base_path or not comp_path:
+        result['issues'] = [(0, MISSING_DATASET)]
+        result['state'] = {'base_file': None, 'comp_file': None}
+        return result
+
+    # The content hash is only recalculated when the file size or modification time moved
+    state = {'base_file': file_state(base_path), 'comp_file': file_state(comp_path)}
+    for side, path in (('base', base_path), ('comp', comp_path)):
+        known = previous and previous[f'{side}_file']
+        if known and all(known[key] == state[f'{side}_file'][key] for key in ('size', 'mtime')):
+            state[f'{side}_file']['sha256'] = known['sha256']
+        else:
+            state[f'{side}_file']['sha256'] = file_hash(path)
+    result['state'] = state
+
+    # Neither side changed since the previous run: reuse its result without reading the data
+    if previous and all(previous[f'{side}_file'] and previous[f'{side}_file']['sha256'] == state[f'{side}_file']['sha256'] for side in ('base', 'comp')):
+        result.update(previous['result'], reused=True)
+        state['fingerprint'] = previous.get('fingerprint')
+        return result
+
+    if state['base_file']['sha256'] == state['comp_file']['sha256']:
+        result['hash_match'] = True
+        return result
+
+    issues, merged, join_on, columns = align_frames(read_dataset(base_path), read_dataset(comp_path),
+                                                    id_vars or ID_VARS.get(name))
+    state['fingerprint'] = fingerprint(merged, join_on, columns)
+
+    # Only re-compare the columns and row blocks that changed on either side
+    cells = changed_cells(previous and previous.get('fingerprint'), state['fingerprint'])
+    if cells is None:
+        unequal, diffs = diff_values(merged, join_on, columns, abs_tol=abs_tol, rel_tol=rel_tol, max_diffs=max_diffs)
+    else:
+        changed_columns, changed_blocks = cells
+        rows = np.isin(np.arange(len(merged)) // BLOCK_SIZE, sorted(changed_blocks))
+        unequal, diffs = diff_values(merged, join_on, sorted(changed_columns), rows=rows, abs_tol=abs_tol,
+                                     rel_tol=rel_tol, max_diffs=max_diffs)
+        for col, blocks in previous['result']['unequal'].items():
+            kept = {block: count for block, count in blocks.items()
+                    if col not in changed_columns or block not in changed_blocks}
+            if kept:
+                unequal[col] = {**kept, **unequal.get(col, {})}
+        if previous_diffs and os.path.exists(previous_diffs):
+            kept = pd.read_csv(previous_diffs, dtype=str)
+            kept_block = kept['ROW'].astype(int) // BLOCK_SIZE
+            kept = kept[~(kept['VARIABLE'].isin(changed_columns) & kept_block.isin(changed_blocks))]
+            diffs = pd.concat([kept, diffs.astype(str)], ignore_index=True)
+        result['narrowed'] = {'columns': sorted(changed_columns), 'blocks': sorted(changed_blocks)}
+
+    result['issues'] = issues + unequal_issue(unequal)
+    result['unequal'] = {col: blocks for col, blocks in unequal.items() if blocks}
+    result['diffs'] = diffs
+    return result
+
+
+def summary_rows(results):
+    """Flatten the compare results into one row per issue, in the layout of the s_compare summary dataset"""
+    rows = []
+    for result in results:
+        if not result['issues']:
+            rows.append({'base': result['base'], 'comp': result['comp'], 'compstatus': 'Clean', 'issue': '', 'detail': ''})
+        for code, detail in result['issues']:
+            rows.append({
+                'base': result['base'],
+                'comp': result['comp'],
+                'compstatus': 'Issues',
+                'issue': ISSUES.get(code, detail if code == 0 else ''),
+                'detail': '' if code == 0 else detail,
+            })
+    return pd.DataFrame(rows, columns=['base', 'comp', 'compstatus', 'issue', 'detail'])
+
+
+def dominostats(summary):
+    datasets = summary['base'].where(summary['base'] != '', summary['comp'])
+    issues = summary[summary['compstatus'] == 'Issues']
+    return {
+        'Number of Datasets': int(datasets.nunique()),
+        'Clean Datasets': int(datasets[summary['compstatus'] == 'Clean'].nunique()),
+        'Datasets with Issues': int(datasets[summary['compstatus'] == 'Issues'].nunique()),
+        'Total number of Issues': int(len(issues)),
+    }
+
+
+def write_outputs(results, compare_path, artifacts_path):
+    summary = summary_rows(results)
+
+    os.makedirs(compare_path, exist_ok=True)
+    summary.to_csv(os.path.join(compare_path, 'summary.csv'), index=False)
+
+    # Listings of datasets reused from the previous incremental run are left as they are
+    diffs_path = os.path.join(artifacts_path, 'compare')
+    os.makedirs(diffs_path, exist_ok=True)
+    for result in results:
+        if result.get('reused'):
+            continue
+        listing = os.path.join(diffs_path, f"{result['name']}_diffs.csv")
+        if result['diffs'] is not None and not result['diffs'].empty:
+            result['diffs'].to_csv(listing, index=False)
+        elif os.path.exists(listing):
+            os.remove(listing)
+
+    stats = dominostats(summary)
+    with open(os.path.join(artifacts_path, 'dominostats.json'), 'w') as f:
+        json.dump(stats, f, indent=4)
+
+    return summary, stats
+
+
+@contextmanager
+def compare_lock(compare_path):
+    """Hold an exclusive lock on the COMPARE folder while the stored results and summary are updated"""
+    os.makedirs(compare_path, exist_ok=True)
+    with open(os.path.join(compare_path, LOCK_FILE), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_state(compare_path, settings):
+    """Read the fingerprints stored by the previous run. They are discarded if the compare settings changed."""
+    path = os.path.join(compare_path, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('settings') != settings:
+        print('Compare settings changed since the previous run, comparing all datasets.')
+        return {}
+    datasets = state.get('datasets', {})
+    # JSON object keys are always strings, so restore the integer block numbers
+    for previous in datasets.values():
+        unequal = previous['result']['unequal']
+        previous['result']['unequal'] = {col: {int(b): n for b, n in blocks.items()} for col, blocks in unequal.items()}
+    return datasets
+
+
+def save_state(compare_path, settings, results):
+    datasets = {}
+    for result in results:
+        if result['state'] is None:
+            continue
+        datasets[result['name']] = {
+            **result['state'],
+            'result': {key: result[key] for key in ('base', 'comp', 'issues', 'unequal')},
+        }
+    os.makedirs(compare_path, exist_ok=True)
+    path = os.path.join(compare_path, STATE_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'settings': settings, 'datasets': datasets}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def run_compare(base_path=BASE_PATH, comp_path=COMP_PATH, datasets=None, prefix='', abs_tol=0.0, rel_tol=0.0,
+                max_diffs=100, workers=None, incremental=False, compare_path=COMPARE_PATH, artifacts_path=ARTIFACTS_PATH):
+    """
+    Compare every dataset in the base folder against the comp folder.
+
+    Fingerprints of every dataset are stored in the COMPARE folder after each run. In incremental mode datasets
+    whose prod and QC files are both unchanged reuse the previous result without being read, and changed
+    datasets only re-compare the columns and row blocks that changed.
+
+    :param base_path: Folder holding the production datasets
+    :param comp_path: Folder holding the QC datasets
+    :param datasets: Optional list of dataset names to restrict the compare to
+    :param prefix: Prefix of the QC dataset names (e.g. Q_), blank if the names match
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param incremental: Reuse the fingerprints and results of the previous run
+    :return: The compare results, one per dataset, the summary and the dominostats.json contents
+    """
+    # Fingerprints taken against one pair of folders are not valid for another
+    settings = {
+        'base': os.path.abspath(base_path), 'comp': os.path.abspath(comp_path),
+        'abs_tol': abs_tol, 'rel_tol': rel_tol, 'prefix': prefix, 'id_vars': ID_VARS, 'block_size': BLOCK_SIZE,
+    }
+    previous = load_state(compare_path, settings) if incremental else {}
+
+    base = list_datasets(base_path)
+    comp = list_datasets(comp_path, prefix)
+    names = sorted(set(base) | set(comp))
+    selected = names
+    if datasets:
+        selected = [name for name in names if name in {d.lower() for d in datasets}]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                compare_pair, name, base.get(name), comp.get(name), abs_tol, rel_tol, max_diffs,
+                previous=previous.get(name),
+                previous_diffs=os.path.join(artifacts_path, 'compare', f'{name}_diffs.csv'),
+                base_library=library_name(base_path), comp_library=library_name(comp_path),
+            )
+            for name in selected
+        ]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        if result.get('reused'):
+            print(f"{result['name']}: unchanged, previous result reused")
+        elif result.get('narrowed'):
+            print(f"{result['name']}: re-compared columns {result['narrowed']['columns']} in row blocks {result['narrowed']['blocks']}")
+
+    with compare_lock(compare_path):
+        # Datasets left out of this run keep their stored result in the merged report. The results are
+        # read again here, as other per-dataset compares may have stored theirs while this one ran.
+        stored = load_state(compare_path, settings) if datasets else {}
+        for name, state in stored.items():
+            if name not in selected:
+                results.append({'name': name, **state['result'], 'diffs': None, 'reused': True,
+                                'state': {key: value for key, value in state.items() if key != 'result'}})
+        results.sort(key=lambda result: result['name'])
+
+        save_state(compare_path, settings, results)
+        summary, stats = write_outputs(results, compare_path, artifacts_path)
+    return results, summary, stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Compare production and QC ADaM datasets')
+    parser.add_argument('--base', default=BASE_PATH, help='Folder holding the production datasets')
+    parser.add_argument('--comp', default=COMP_PATH, help='Folder holding the QC datasets')
+    parser.add_argument('--compare-path', default=COMPARE_PATH, help='Folder for the summary dataset')
+    parser.add_argument('--artifacts-path', default=ARTIFACTS_PATH, help='Folder for dominostats.json and the diff listings')
+    parser.add_argument('--datasets', nargs='*', help='Only compare these datasets')
+    parser.add_argument('--prefix', default='', help='Prefix of the QC dataset names')
+    parser.add_argument('--abs-tol', type=float, default=0.0, help='Absolute tolerance for numeric values')
+    parser.add_argument('--rel-tol', type=float, default=0.0, help='Relative tolerance for numeric values')
+    parser.add_argument('--max-diffs', type=int, default=100, help='Unequal values listed per variable')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--incremental', action='store_true', help='Only re-compare datasets changed since the previous run')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results, summary, stats = run_compare(
+        base_path=args.base,
+        comp_path=args.comp,
+        datasets=args.datasets,
+        prefix=args.prefix,
+        abs_tol=args.abs_tol,
+        rel_tol=args.rel_tol,
+        max_diffs=args.max_diffs,
+        workers=args.workers,
+        incremental=args.incremental,
+        compare_path=args.compare_path,
+        artifacts_path=args.artifacts_path,
+    )
+    print(summary.to_string(index=False))
+    print(json.dumps(stats, indent=4))
@@ -1,8 +1,14 @@
 
 ## Copied from https://docs.dominodatalab.com/en/4.3/user_guide/2039f2/publish-a-flask-app/#_create_the_files
 
+import os
+import sys
 from flask import Flask
 
+# Dataset mount, as found by the pipeline scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'Pipelines'))
+from domino_paths import DATASET_ROOT
+
 class ReverseProxied(object):
   def __init__(self, app):
       self.app = app
@@ -24,5 +30,9 @@ class ReverseProxied(object):
           environ['HTTP_HOST'] = f'{remote_host}:{remote_port}'
       return self.app(environ, start_response)
 
-app = Flask(__name__, template_folder="/mnt/data/CDISC01_RE_INTERIM")
+REPORT_DIR = os.environ.get("REPORT_DIR", "/mnt/data/CDISC01_RE_INTERIM")
+
+app = Flask(__name__, template_folder=REPORT_DIR)
+# The rendered report is cached by views.py until report.html changes, so let Jinja pick up the new file when it does
+app.config["TEMPLATES_AUTO_RELOAD"] = True
 app.wsgi_app = ReverseProxied(app.wsgi_app)
@@ -0,0 +1,131 @@
+"""
+Caching helpers for serving the report.
+
+Rendered templates are kept in memory per worker and invalidated when the template file's
+modification time or size changes. Report assets are served from disk, with gzip and brotli
+variants of compressible files written once into a cache directory shared by all workers.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_DIR = os.environ.get('APP_CACHE_DIR', '/tmp/report_app_cache')
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+ENCODERS = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    ENCODERS['br'] = lambda data: brotli.compress(data, quality=11)
+
+# Preferred order when the client accepts several encodings
+ENCODING_PREFERENCE = ['br', 'gzip']
+
+
+def is_compressible(mimetype):
+    return mimetype is not None and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encodings, available):
+    """Pick the best encoding that the client accepts and that we have a variant for"""
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in available and accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_mtime
+
+
+class CachedContent:
+    """A response body with its validators and precompressed variants"""
+    def __init__(self, body, last_modified, mimetype):
+        self.body = body
+        self.last_modified = last_modified
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {}
+        if is_compressible(mimetype) and len(body) >= MIN_COMPRESS_SIZE:
+            for encoding, encode in ENCODERS.items():
+                self.variants[encoding] = encode(body)
+
+
+class RenderCache:
+    """In-memory cache of rendered templates, invalidated by the template file's mtime"""
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_path, render, mimetype='text/html'):
+        key = file_key(template_path)
+        entry = self._entries.get(template_path)
+        if entry is not None and entry[0] == key[:2]:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(template_path)
+            if entry is None or entry[0] != key[:2]:
+                content = CachedContent(render().encode('utf-8'), key[2], mimetype)
+                entry = (key[:2], content)
+                self._entries[template_path] = entry
+        return entry[1]
+
+
+def precompressed(path, encoding, cache_dir=CACHE_DIR):
+    """
+    Return the path of a compressed copy of a file, creating it if needed.
+
+    Variants are named after the source path and modification time, so a changed file
+    simply gets a new variant, and the variants of its earlier versions are removed. They
+    are written to a temporary file of their own first, so concurrent workers and threads
+    never serve a partial file.
+    """
+    mtime_ns, size, _ = file_key(path)
+    source = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    variant = os.path.join(cache_dir, f'{source}-{mtime_ns}-{size}.{encoding}')
+    if not os.path.exists(variant):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'rb') as f:
+            data = ENCODERS[encoding](f.read())
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, variant)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        remove_old_variants(variant, source, encoding, cache_dir)
+    return variant
+
+
+def remove_old_variants(variant, source, encoding, cache_dir=CACHE_DIR):
+    for entry in os.scandir(cache_dir):
+        if entry.path != variant and entry.name.startswith(f'{source}-') and entry.name.endswith(f'.{encoding}'):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def asset_variants(path):
+    """Encodings worth serving for a file on disk"""
+    mimetype = mimetypes.guess_type(path)[0]
+    if not is_compressible(mimetype) or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return []
+    return list(ENCODERS)
@@ -0,0 +1,305 @@
+"""
+Paginated browser for ADaM datasets and TFL listings.
+
+Each dataset is converted once into a Parquet copy with small row groups, keyed by the source
+file's modification time, so a changed dataset simply gets a new copy, which replaces the old one.
+A page is served by reading
+only the row groups that hold its rows. Filtering and sorting read only the filtered and sorted
+columns to work out the row order, and that order is cached so paging through a result is cheap.
+No request loads a whole dataset into memory.
+"""
+import os
+import re
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flask import abort, jsonify, request
+from app import app, DATASET_ROOT
+from app.cache import CACHE_DIR
+
+LIBRARIES = {
+    'adam': f'{DATASET_ROOT}/ADAM',
+    'adamqc': f'{DATASET_ROOT}/ADAMQC',
+    'tfl': f'{DATASET_ROOT}/TFL',
+    'tflqc': f'{DATASET_ROOT}/TFLQC',
+}
+DATASET_EXTENSIONS = ('.sas7bdat', '.xpt', '.parquet')
+
+ROW_GROUP_SIZE = 10000
+MAX_PAGE_SIZE = 500
+OPEN_FILES = 16
+CACHED_ORDERS = 32
+
+_convert_lock = threading.Lock()
+
+
+def find_dataset(library, name):
+    folder = LIBRARIES.get(library.lower())
+    if folder is None or not os.path.isdir(folder):
+        return None
+    for filename in os.listdir(folder):
+        stem, ext = os.path.splitext(filename)
+        if stem.lower() == name.lower() and ext.lower() in DATASET_EXTENSIONS:
+            return os.path.join(folder, filename)
+    return None
+
+
+def sas_schema(frame):
+    """
+    Arrow schema of a SAS dataset from the first chunk read of it. Character columns are declared as
+    strings, as one that is all missing in the chunk would otherwise get the null type, which the
+    values in later chunks cannot be cast to.
+    """
+    return pa.schema([
+        (column, pa.string() if dtype == object or pd.api.types.is_string_dtype(dtype) else pa.from_numpy_dtype(dtype))
+        for column, dtype in frame.dtypes.items()
+    ])
+
+
+def empty_sas_table(reader):
+    """Table without rows with the columns of the dataset a SAS reader is open on, character ones as strings"""
+    if hasattr(reader, 'fields'):
+        columns = zip(reader.columns, [field['ntype'] == 'char' for field in reader.fields])
+    else:
+        columns = zip(reader.column_names, [column_type == b's' for column_type in reader.column_types()])
+    return pa.schema([(name, pa.string() if character else pa.float64()) for name, character in columns]).empty_table()
+
+
+def sas_chunks(path):
+    fmt = 'xport' if path.lower().endswith('.xpt') else 'sas7bdat'
+    encoding = 'latin-1' if fmt == 'xport' else 'infer'
+    schema = None
+    reader = pd.read_sas(path, format=fmt, encoding=encoding, chunksize=ROW_GROUP_SIZE)
+    for chunk in reader:
+        schema = schema or sas_schema(chunk)
+        yield pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+    # A dataset without rows gives no chunks, but its copy still needs its columns
+    if schema is None:
+        yield empty_sas_table(reader)
+
+
+def parquet_chunks(path):
+    source = pq.ParquetFile(path)
+    empty = True
+    for batch in source.iter_batches(batch_size=ROW_GROUP_SIZE):
+        empty = False
+        yield pa.Table.from_batches([batch])
+    if empty:
+        yield source.schema_arrow.empty_table()
+
+
+def remove_old_copies(target):
+    """Remove the copies of earlier versions of a dataset"""
+    folder, filename = os.path.split(target)
+    stem = filename.rsplit('-', 2)[0]
+    pattern = re.compile(rf'{re.escape(stem)}-\d+-\d+\.parquet')
+    for entry in os.scandir(folder):
+        if entry.name != filename and pattern.fullmatch(entry.name):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def columnar_copy(path):
+    """Return the path of the Parquet copy of a dataset, converting it in chunks if there is none yet"""
+    stat = os.stat(path)
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    library = os.path.basename(os.path.dirname(path)).lower()
+    target = os.path.join(CACHE_DIR, 'listings', library, f'{stem}-{stat.st_mtime_ns}-{stat.st_size}.parquet')
+    if os.path.exists(target):
+        return target
+
+    with _convert_lock:
+        if os.path.exists(target):
+            return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        if path.lower().endswith('.parquet'):
+            chunks = parquet_chunks(path)
+        else:
+            chunks = sas_chunks(path)
+        writer = None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, chunk.schema)
+                writer.write_table(chunk.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+            writer.close()
+            writer = None
+            os.replace(tmp, target)
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        remove_old_copies(target)
+    return target
+
+
+@lru_cache(maxsize=OPEN_FILES)
+def open_dataset(columnar_path):
+    """Opened Parquet files, least recently used are closed first. Only the footer is read on open."""
+    return pq.ParquetFile(columnar_path)
+
+
+class OrderCache:
+    """Bounded LRU cache of the row order of a filtered and sorted dataset"""
+    def __init__(self, maxsize=CACHED_ORDERS):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+
+order_cache = OrderCache()
+
+
+def filter_mask(table, filters):
+    """Case-insensitive substring match for character columns, equality for everything else"""
+    mask = None
+    for column, value in filters.items():
+        data = table[column]
+        if pa.types.is_string(data.type) or pa.types.is_large_string(data.type):
+            condition = pc.match_substring(data, value, ignore_case=True)
+        else:
+            try:
+                condition = pc.equal(data, pa.scalar(value).cast(data.type))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                condition = pc.equal(pc.cast(data, pa.string()), value)
+        condition = pc.fill_null(condition, False)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+
+def row_order(parquet, filters, sort):
+    """Indices of the rows matching the filters, in sort order. Only the filter and sort columns are read."""
+    columns = sorted(set(filters) | {column for column, _ in sort})
+    table = parquet.read(columns=columns)
+    indices = pa.array(range(table.num_rows), type=pa.int64())
+    if filters:
+        mask = filter_mask(table, filters)
+        table = table.filter(mask)
+        indices = indices.filter(mask)
+    if sort:
+        order = pc.sort_indices(table, sort_keys=sort)
+        indices = indices.take(order)
+    return indices.to_numpy()
+
+
+def read_rows(parquet, rows):
+    """Read the given row numbers, opening only the row groups that contain them"""
+    metadata = parquet.metadata
+    starts = []
+    offset = 0
+    for i in range(metadata.num_row_groups):
+        starts.append(offset)
+        offset += metadata.row_group(i).num_rows
+
+    row_groups = [bisect_right(starts, row) - 1 for row in rows]
+    groups = sorted(set(row_groups))
+    if not groups:
+        return parquet.schema_arrow.empty_table()
+    table = parquet.read_row_groups(groups)
+
+    # Map the row numbers onto positions in the table made from the row groups that were read
+    offsets = {}
+    position = 0
+    for group in groups:
+        offsets[group] = position
+        position += metadata.row_group(group).num_rows
+    local = [offsets[group] + row - starts[group] for row, group in zip(rows, row_groups)]
+    return table.take(pa.array(local, type=pa.int64()))
+
+
+def parse_query(parquet):
+    columns = parquet.schema_arrow.names
+    lookup = {column.upper(): column for column in columns}
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        abort(400, 'page and page_size must be integers')
+
+    sort = []
+    for key in filter(None, request.args.get('sort', '').split(',')):
+        direction = 'descending' if key.startswith('-') else 'ascending'
+        column = lookup.get(key.lstrip('-').upper())
+        if column is None:
+            abort(400, f'Unknown sort column {key}')
+        sort.append((column, direction))
+
+    filters = {}
+    for key, value in request.args.items():
+        if key.startswith('f_') and value != '':
+            column = lookup.get(key[2:].upper())
+            if column is None:
+                abort(400, f'Unknown filter column {key[2:]}')
+            filters[column] = value
+    return page, page_size, sort, filters
+
+
+@app.route('/api/datasets')
+def list_datasets():
+    libraries = {}
+    for library, folder in LIBRARIES.items():
+        if os.path.isdir(folder):
+            libraries[library] = sorted(
+                os.path.splitext(filename)[0].lower()
+                for filename in os.listdir(folder)
+                if os.path.splitext(filename)[1].lower() in DATASET_EXTENSIONS
+            )
+    return jsonify(libraries)
+
+
+@app.route('/api/datasets/<library>/<name>')
+def dataset_page(library, name):
+    path = find_dataset(library, name)
+    if path is None:
+        abort(404)
+    columnar_path = columnar_copy(path)
+    parquet = open_dataset(columnar_path)
+    page, page_size, sort, filters = parse_query(parquet)
+
+    if filters or sort:
+        key = (columnar_path, tuple(sorted(filters.items())), tuple(sort))
+        order = order_cache.get(key, lambda: row_order(parquet, filters, sort))
+        total = len(order)
+        rows = order[(page - 1) * page_size:page * page_size]
+    else:
+        total = parquet.metadata.num_rows
+        rows = range((page - 1) * page_size, min(page * page_size, total))
+
+    table = read_rows(parquet, [int(row) for row in rows])
+    return jsonify({
+        'library': library.upper(),
+        'dataset': name.upper(),
+        'columns': parquet.schema_arrow.names,
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'rows': table.to_pandas().astype(object).where(lambda df: df.notna(), None).values.tolist(),
+    })
+
+
+@app.route('/browse')
+@app.route('/browse/<library>/<name>')
+def browse_page(library=None, name=None):
+    return app.send_static_file('browse.html')
@@ -0,0 +1,104 @@
+"""
+Live pipeline progress, served from the status file that Pipelines/multijob.py writes on every tick.
+
+Reading the shared file instead of the Domino API means any number of reviewers can follow a run
+without adding API load. /api/pipeline/stream pushes a new state to the browser as server-sent
+events whenever the file changes. Each open stream holds one of the app's threads, so a stream
+ends once the pipeline has finished, with an end event that tells the page to stop listening,
+and otherwise after STREAM_SECONDS, after which the browser reconnects by itself.
+"""
+import json
+import os
+import time
+from flask import Response, jsonify, request, stream_with_context
+from app import app, DATASET_ROOT
+
+STATUS_PATH = os.environ.get(
+    'MULTIJOB_STATUS_PATH',
+    f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/multijob/status.json"
+)
+
+# How often the stream checks the status file, and how often it sends a keep-alive comment
+POLL_SECONDS = 1
+HEARTBEAT_SECONDS = 15
+# How long a stream is kept open, and how long the browser waits before reconnecting
+STREAM_SECONDS = 300
+RECONNECT_MILLISECONDS = 3000
+
+FINAL_STATES = ('Succeeded', 'Failed')
+
+
+def status_mtime():
+    try:
+        return os.stat(STATUS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_status():
+    """Return the pipeline state with per-task durations and state counts, or None if no run has written one"""
+    try:
+        with open(STATUS_PATH) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    counts = {}
+    for task in state['tasks']:
+        counts[task['status']] = counts.get(task['status'], 0) + 1
+    state['counts'] = counts
+    state['age'] = time.time() - state['updated_at']
+    return state
+
+
+@app.route('/pipeline')
+def pipeline_page():
+    return app.send_static_file('pipeline.html')
+
+
+@app.route('/api/pipeline')
+def pipeline_status():
+    state = read_status()
+    if state is None:
+        return jsonify({'error': 'No pipeline status has been written yet'}), 404
+    response = jsonify(state)
+    response.set_etag(str(status_mtime()))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/pipeline/tasks/<task_id>')
+def pipeline_task(task_id):
+    state = read_status() or {'tasks': []}
+    for task in state['tasks']:
+        if task['task_id'] == task_id:
+            return jsonify(task)
+    return jsonify({'error': f'Unknown task {task_id}'}), 404
+
+
+@app.route('/api/pipeline/stream')
+def pipeline_stream():
+    def events():
+        started = time.time()
+        last_mtime = None
+        last_sent = started
+        yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+        while time.time() - started < STREAM_SECONDS:
+            mtime = status_mtime()
+            if mtime is not None and mtime != last_mtime:
+                last_mtime = mtime
+                state = read_status()
+                if state is not None:
+                    last_sent = time.time()
+                    yield f'data: {json.dumps(state)}\n\n'
+                    if state.get('status') in FINAL_STATES:
+                        yield 'event: end\ndata: {}\n\n'
+                        return
+            elif time.time() - last_sent > HEARTBEAT_SECONDS:
+                last_sent = time.time()
+                yield ': keep-alive\n\n'
+            time.sleep(POLL_SECONDS)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
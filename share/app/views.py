@@ -1,6 +1,74 @@
-from flask import render_template, jsonify
-from app import app
+import os
+import mimetypes
+from flask import render_template, jsonify, request, abort, send_file, Response
+from werkzeug.security import safe_join
+from app import app, REPORT_DIR
+from app.cache import RenderCache, choose_encoding, precompressed, asset_variants
+
+render_cache = RenderCache()
+
+# Only files of these types are served from the report folder, which also holds the report
+# template and may hold data, logs and programs
+ASSET_EXTENSIONS = {
+    '.css', '.js', '.map',
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp',
+    '.woff', '.woff2', '.ttf', '.eot',
+    '.pdf',
+}
+
+
+def cached_response(content):
+    """Build a response for cached content, choosing a precompressed variant and answering conditional requests"""
+    encoding = choose_encoding(request.accept_encodings, content.variants)
+    body = content.variants[encoding] if encoding else content.body
+    response = Response(body, mimetype=content.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(f'{content.etag}-{encoding}' if encoding else content.etag)
+    response.last_modified = content.last_modified
+    # Always revalidate, so reviewers see a refreshed report as soon as it is rewritten
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 
 @app.route('/')
 def index():
-    return render_template("report.html")
+    content = render_cache.get(os.path.join(REPORT_DIR, 'report.html'), lambda: render_template("report.html"))
+    return cached_response(content)
+
+
+@app.route('/<path:filename>')
+def report_asset(filename):
+    """Files referenced by the report (images, stylesheets, scripts, fonts and PDF outputs)"""
+    if os.path.splitext(filename)[1].lower() not in ASSET_EXTENSIONS:
+        abort(404)
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
+    path = safe_join(REPORT_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = choose_encoding(request.accept_encodings, asset_variants(path))
+    stat = os.stat(path)
+
+    def send(served, encoding):
+        return send_file(
+            served,
+            mimetype=mimetype,
+            conditional=True,
+            etag=f'{stat.st_mtime_ns:x}-{stat.st_size:x}' + (f'-{encoding}' if encoding else ''),
+            last_modified=stat.st_mtime,
+            max_age=0,
+        )
+
+    try:
+        response = send(precompressed(path, encoding), encoding) if encoding else send(path, None)
+    except FileNotFoundError:
+        # The file changed while it was served, and its variant was replaced by a newer one
+        encoding = None
+        response = send(path, None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -1,5 +1,7 @@
 from app import app
 from app import views
+from app import pipeline
+from app import listings
 
 if __name__ == '__main__':
     app.run()
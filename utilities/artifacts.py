@@ -0,0 +1,369 @@
+"""
+Compressed, checksummed transport of the datasets and reports passed between Flow tasks.
+
+A task's outputs are uploaded by Flyte and downloaded into every task that depends on them. With
+the artifact layer enabled (the DMV_ARTIFACTS project variable set to zstd or gzip, see
+DominoTask), each task is run as:
+
+    python utilities/artifacts.py run [--format zstd] [--pack adam ...] -- <command>
+
+which, before the command runs, unpacks every input in /workflow/inputs that is an artifact, and
+once it has succeeded, packs the outputs named by --pack in /workflow/outputs into artifacts, in
+place, so they keep the output names Flyte expects. An artifact is a single file:
+
+    MAGIC | payload | manifest (JSON) | manifest length (8 bytes) | MAGIC
+
+The payload is the file compressed with zstd (gzip if the zstandard package is not installed),
+or, for the parquet format, a SAS dataset converted to Parquet with zstd column compression.
+Parquet artifacts unpack to <name>.parquet beside the input rather than to a SAS dataset, so
+use them, with create_adam_data(artifact_format="parquet"), only for datasets that are read by R
+or Python programs. The manifest records the
+format, the size and SHA-256 of the unpacked file and of the payload.
+
+Unpacked files are kept in a node local cache, ARTIFACT_CACHE_ROOT/<SHA-256>, and an input whose
+checksum is already in the cache, e.g. because it was produced or unpacked by an earlier task on
+the node, is hardlinked from it rather than decompressed again. Payloads and unpacked files are
+checked against the manifest, and a mismatch fails the task. A cached file's modification time is
+refreshed whenever it is used, and files not used for ARTIFACT_CACHE_DAYS (default 7) days are
+removed when another file is cached. Removing a cached file does not affect a task that has
+already linked it, as the task's hardlink keeps the data.
+
+The artifacts a task packed and unpacked, with their sizes, checksums and whether the cache was
+used, are written to MANIFEST_PATH in the job's artifacts. From the command line:
+
+    python utilities/artifacts.py pack FILE [--format zstd]
+    python utilities/artifacts.py unpack FILE [--output PATH]
+    python utilities/artifacts.py manifest FILE
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INPUTS_PATH = '/workflow/inputs'
+OUTPUTS_PATH = '/workflow/outputs'
+ARTIFACT_CACHE_ROOT = os.environ.get('ARTIFACT_CACHE_ROOT', '/tmp/artifact_cache')
+MANIFEST_PATH = os.environ.get('ARTIFACT_MANIFEST_PATH', '/mnt/artifacts/artifact_manifest.json')
+# Cached files not used for this many days are removed when another file is cached
+PRUNE_DAYS = int(os.environ.get('ARTIFACT_CACHE_DAYS', 7))
+
+MAGIC = b'DMVARTF1'
+LENGTH = struct.Struct('<Q')
+FORMATS = ('zstd', 'gzip', 'parquet')
+ZSTD_LEVEL = 9
+CHUNK_SIZE = 1 << 20
+# First bytes of every SAS7BDAT file; only SAS datasets are converted to Parquet
+SAS7BDAT_MAGIC = bytes.fromhex('000000000000000000000000c2ea8160b31411cfbd92080009c7318c181f1011')
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class HashingReader:
+    """File reader that hashes what is read, reading at most limit bytes"""
+    def __init__(self, f, limit=None):
+        self.f = f
+        self.remaining = limit
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+
+class HashingWriter:
+    """File writer that hashes what is written"""
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_artifact(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def is_sas7bdat(path):
+    with open(path, 'rb') as f:
+        return f.read(len(SAS7BDAT_MAGIC)) == SAS7BDAT_MAGIC
+
+
+def compress(reader, writer, fmt):
+    if fmt == 'zstd':
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).copy_stream(reader, writer)
+    else:
+        with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6, mtime=0) as out:
+            shutil.copyfileobj(reader, out, CHUNK_SIZE)
+
+
+def decompress(reader, writer, fmt):
+    if fmt == 'zstd':
+        if zstandard is None:
+            raise ArtifactError('The zstandard package is needed to unpack zstd artifacts')
+        zstandard.ZstdDecompressor().copy_stream(reader, writer)
+    elif fmt == 'gzip':
+        with gzip.GzipFile(fileobj=reader, mode='rb') as f:
+            shutil.copyfileobj(f, writer, CHUNK_SIZE)
+    else:
+        shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+
+
+def to_parquet(path, parquet_path):
+    import pandas as pd
+    df = pd.read_sas(path, format='sas7bdat', encoding='infer')
+    df.to_parquet(parquet_path, compression='zstd', index=False)
+
+
+def read_manifest(path):
+    """Return the manifest of an artifact, with the offset and length of its payload"""
+    with open(path, 'rb') as f:
+        f.seek(-(LENGTH.size + len(MAGIC)), os.SEEK_END)
+        length, = LENGTH.unpack(f.read(LENGTH.size))
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ArtifactError(f'{path} is not a complete artifact')
+        end = f.seek(-(LENGTH.size + len(MAGIC) + length), os.SEEK_END)
+        manifest = json.loads(f.read(length))
+    manifest['payload_offset'] = len(MAGIC)
+    manifest['payload_length'] = end - len(MAGIC)
+    return manifest
+
+
+def cache_path(sha256, cache_root=ARTIFACT_CACHE_ROOT):
+    return os.path.join(cache_root, sha256)
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        # Owned by another user, it is then pruned by age rather than by last use
+        pass
+
+
+def prune(cache_root=ARTIFACT_CACHE_ROOT, days=PRUNE_DAYS):
+    cutoff = time.time() - days * 86400
+    for entry in os.scandir(cache_root):
+        try:
+            # Also removes the temporary files of tasks that died while caching
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def add_to_cache(path, sha256, cache_root=ARTIFACT_CACHE_ROOT):
+    """Hardlink an unpacked file into the cache, so later tasks on the node need not unpack it again"""
+    target = cache_path(sha256, cache_root)
+    if os.path.exists(target):
+        touch(target)
+        return
+    try:
+        os.makedirs(cache_root, exist_ok=True)
+        prune(cache_root)
+        tmp = f'{target}.tmp-{os.getpid()}'
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copy2(path, tmp)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, target)
+        # A copy keeps the time of the original, which may be old enough to be pruned
+        touch(target)
+    except OSError as err:
+        print(f'WARNING: Could not cache {path} in {cache_root}: {err}', file=sys.stderr)
+
+
+def link_or_copy(source, destination):
+    tmp = f'{destination}.tmp-{os.getpid()}'
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, destination)
+
+
+def pack(path, fmt='zstd', cache_root=ARTIFACT_CACHE_ROOT):
+    """Replace a file with its artifact. Returns the manifest."""
+    if fmt not in FORMATS:
+        raise ArtifactError(f'Unknown artifact format {fmt}')
+    if fmt == 'zstd' and zstandard is None:
+        fmt = 'gzip'
+    if fmt == 'parquet' and not is_sas7bdat(path):
+        fmt = 'zstd' if zstandard is not None else 'gzip'
+    start = time.time()
+    manifest = {'name': os.path.basename(path), 'format': fmt}
+    source = path
+    if fmt == 'parquet':
+        manifest['source_size'] = os.path.getsize(path)
+        manifest['source_sha256'] = file_hash(path)
+        source = f'{path}.parquet-{os.getpid()}'
+        to_parquet(path, source)
+
+    tmp = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(source, 'rb') as f, open(tmp, 'wb') as out:
+            out.write(MAGIC)
+            reader = HashingReader(f)
+            writer = HashingWriter(out)
+            if fmt == 'parquet':
+                # Already compressed, column by column
+                shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+            else:
+                compress(reader, writer, fmt)
+            manifest.update({
+                'size': reader.size,
+                'sha256': reader.digest.hexdigest(),
+                'payload_size': writer.size,
+                'payload_sha256': writer.digest.hexdigest(),
+            })
+            encoded = json.dumps(manifest).encode()
+            out.write(encoded + LENGTH.pack(len(encoded)) + MAGIC)
+        # The unpacked file is what consumers on this node would get, so cache it before it is replaced
+        add_to_cache(source, manifest['sha256'], cache_root)
+        os.replace(tmp, path)
+    finally:
+        for leftover in (tmp, source if source != path else None):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+    manifest['seconds'] = round(time.time() - start, 3)
+    return manifest
+
+
+def unpacked_path(path, manifest):
+    if manifest['format'] == 'parquet':
+        return f'{os.path.splitext(path)[0]}.parquet'
+    return path
+
+
+def unpack(path, output=None, cache_root=ARTIFACT_CACHE_ROOT):
+    """
+    Replace an artifact with the file it holds, or write that to output. Returns the manifest, with
+    the path written to and whether it came from the cache.
+    """
+    start = time.time()
+    manifest = read_manifest(path)
+    output = output or unpacked_path(path, manifest)
+    cached = cache_path(manifest['sha256'], cache_root)
+    manifest['cached'] = os.path.exists(cached) and os.path.getsize(cached) == manifest['size']
+    if not manifest['cached']:
+        tmp = f'{output}.tmp-{os.getpid()}'
+        with open(path, 'rb') as f, open(tmp, 'wb') as out:
+            f.seek(manifest['payload_offset'])
+            reader = HashingReader(f, manifest['payload_length'])
+            writer = HashingWriter(out)
+            decompress(reader, writer, manifest['format'])
+        if reader.digest.hexdigest() != manifest['payload_sha256'] or writer.digest.hexdigest() != manifest['sha256']:
+            os.remove(tmp)
+            raise ArtifactError(f'{path} does not match the checksums in its manifest')
+        os.replace(tmp, output)
+        add_to_cache(output, manifest['sha256'], cache_root)
+    else:
+        touch(cached)
+        link_or_copy(cached, output)
+    if output != path and os.path.dirname(os.path.abspath(output)) == os.path.dirname(os.path.abspath(path)):
+        os.remove(path)
+    manifest['path'] = output
+    manifest['seconds'] = round(time.time() - start, 3)
+    return manifest
+
+
+def write_manifest(entries, manifest_path=MANIFEST_PATH):
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            json.dump(entries, f, indent=4)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+    except OSError as err:
+        print(f'WARNING: Could not write the artifact manifest to {manifest_path}: {err}', file=sys.stderr)
+
+
+def run(command, fmt, pack_names, inputs_path=INPUTS_PATH, outputs_path=OUTPUTS_PATH):
+    """Unpack the inputs, run the command and pack its outputs. Returns the command's exit code."""
+    entries = {'unpacked': [], 'packed': []}
+    if os.path.isdir(inputs_path):
+        for name in sorted(os.listdir(inputs_path)):
+            path = os.path.join(inputs_path, name)
+            if os.path.isfile(path) and is_artifact(path):
+                entries['unpacked'].append(unpack(path))
+    for entry in entries['unpacked']:
+        print(f"Unpacked {entry['name']} ({entry['payload_size']} to {entry['size']} bytes{', from the node cache' if entry['cached'] else ''})")
+
+    returncode = subprocess.run(command).returncode
+    if returncode == 0:
+        for name in pack_names:
+            path = os.path.join(outputs_path, name)
+            if os.path.isfile(path) and not is_artifact(path):
+                entry = pack(path, fmt)
+                entries['packed'].append(entry)
+                print(f"Packed {name} as {entry['format']} ({entry['size']} to {entry['payload_size']} bytes)")
+    write_manifest(entries)
+    return returncode
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack and unpack the compressed, checksummed artifacts passed between Flow tasks.')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    run_parser = subparsers.add_parser('run', help='Unpack the inputs, run a command and pack its outputs')
+    run_parser.add_argument('--format', choices=FORMATS, default='zstd', help='Format of the packed outputs')
+    run_parser.add_argument('--pack', action='append', default=[], help='Output to pack (repeatable)')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to run, after --')
+    pack_parser = subparsers.add_parser('pack', help='Replace a file with its artifact')
+    pack_parser.add_argument('file')
+    pack_parser.add_argument('--format', choices=FORMATS, default='zstd')
+    unpack_parser = subparsers.add_parser('unpack', help='Replace an artifact with the file it holds')
+    unpack_parser.add_argument('file')
+    unpack_parser.add_argument('--output', help='Write the file here instead')
+    manifest_parser = subparsers.add_parser('manifest', help='Print the manifest of an artifact')
+    manifest_parser.add_argument('file')
+    args = parser.parse_args()
+
+    if args.action == 'run':
+        command = args.command[1:] if args.command[:1] == ['--'] else args.command
+        if not command:
+            parser.error('No command given')
+        # The runner of a single program is picked as for multijob and the profiler
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from profile_task import build_command
+        sys.exit(run(build_command(command), args.format, args.pack))
+    elif args.action == 'pack':
+        print(json.dumps(pack(args.file, args.format), indent=4))
+    elif args.action == 'unpack':
+        print(json.dumps(unpack(args.file, args.output), indent=4))
+    else:
+        print(json.dumps(read_manifest(args.file), indent=4))
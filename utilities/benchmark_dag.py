@@ -0,0 +1,221 @@
+"""
+Benchmark multijob's DAG handling on synthetic configs of 10 to 10,000 tasks.
+
+    python utilities/benchmark_dag.py [--shape layered] [--sizes 10,100,1000,10000] [--repeat 3]
+
+A config is generated for each shape and size:
+
+    star        ADSL, and every other task depending on it alone.
+    layered     ADSL, a layer of ADaM datasets depending on it, and TFLs depending on one to three
+                of the datasets each, about four TFLs per dataset.
+    qc_pairs    ADSL and its ADaM datasets, each with a qc_ task, paired through qc_prefix so that
+                a compare_ task is generated for each pair.
+    diamonds    A chain of diamonds: each task fans out to two tasks that join again at the next.
+    chain       One long chain, each task depending on the one before it.
+
+For each config, the benchmark times build_dag (compiling the config, then again from the compiled
+DAG cache), Dag.validate_dag, and, with about a third of the tasks Succeeded, a third Running and
+the rest Unsubmitted, Dag.get_ready_tasks, Dag.get_failed_tasks and Dag.pipeline_status. The
+Domino API is not called: get_job_status is replaced by a stub that returns Running and counts
+its calls, which are reported with the times.
+
+An operation that runs for longer than --timeout is stopped and reported as a timeout, and one
+that raises, e.g. a RecursionError from validate_dag on a deep chain, is reported with its error.
+
+Each benchmark is appended to a history file on the project dataset and compared with the one
+before it, as in benchmark_startup.py.
+"""
+import argparse
+import os
+import random
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'Pipelines'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import multijob
+from benchmark_startup import REGRESSION_THRESHOLD, load_previous, save_benchmark
+from domino_paths import DATASET_ROOT
+
+HISTORY_PATH = os.environ.get('DAG_BENCHMARK_PATH', f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/benchmarks/dag.jsonl")
+
+SHAPES = ('star', 'layered', 'qc_pairs', 'diamonds', 'chain')
+SIZES = (10, 100, 1000, 10000)
+OPERATIONS = ('build_dag', 'build_dag_cached', 'validate_dag', 'get_ready_tasks', 'get_failed_tasks', 'pipeline_status')
+# Generated configs are the same on every run, so benchmarks can be compared
+SEED = 2026
+
+
+class Timeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise Timeout()
+
+
+def section(task_id, command, depends=()):
+    lines = [f'[{task_id}]', f'command: {command}']
+    if depends:
+        lines.append(f"depends: {','.join(depends)}")
+    return '\n'.join(lines) + '\n'
+
+
+def generate_config(shape, size):
+    """Text of a config of the given shape with about size sections"""
+    rng = random.Random(SEED)
+    sections = [section('ADSL', 'prod/adam/ADSL.sas')]
+    if shape == 'star':
+        sections += [section(f'AD{n:05d}', f'prod/adam/AD{n:05d}.sas', ['ADSL']) for n in range(1, size)]
+    elif shape == 'layered':
+        datasets = [f'AD{n:05d}' for n in range(1, max(2, size // 5))]
+        sections += [section(dataset, f'prod/adam/{dataset}.sas', ['ADSL']) for dataset in datasets]
+        sections += [
+            section(f't_{n:05d}', f'prod/tfl/t_{n:05d}.sas', rng.sample(datasets, min(len(datasets), rng.randint(1, 3))))
+            for n in range(1, size - len(datasets))
+        ]
+    elif shape == 'qc_pairs':
+        header = '[DEFAULT]\nqc_prefix: qc_\ncompare_command: python qc/adam/compare_adam.py --datasets {dataset}\n'
+        sections.insert(0, header)
+        for n in range(1, max(2, size // 2)):
+            sections.append(section(f'AD{n:05d}', f'prod/adam/AD{n:05d}.sas', ['ADSL']))
+            sections.append(section(f'qc_AD{n:05d}', f'qc/adam/qc_AD{n:05d}.sas', ['ADSL']))
+    elif shape == 'diamonds':
+        previous = 'ADSL'
+        for n in range(1, max(2, size // 3)):
+            left, right, join = f'L{n:05d}', f'R{n:05d}', f'J{n:05d}'
+            sections.append(section(left, f'prod/adam/{left}.sas', [previous]))
+            sections.append(section(right, f'prod/adam/{right}.sas', [previous]))
+            sections.append(section(join, f'prod/adam/{join}.sas', [left, right]))
+            previous = join
+    elif shape == 'chain':
+        sections += [section(f'T{n:05d}', f'prod/adam/T{n:05d}.sas', [f'T{n - 1:05d}' if n > 1 else 'ADSL']) for n in range(1, size)]
+    else:
+        raise Exception(f'Unknown shape {shape}')
+    return '\n'.join(sections)
+
+
+class StatusStub:
+    """Replaces multijob.get_job_status, so every submitted task is Running without calling the API"""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, job_id):
+        self.calls += 1
+        return 'Running'
+
+
+def set_progress(dag):
+    """Mark about a third of the tasks Succeeded and a third Running, in config order"""
+    task_ids = list(dag.tasks)
+    third = len(task_ids) // 3
+    for task_id in task_ids[:third]:
+        dag.tasks[task_id]._status = 'Succeeded'
+    for task_id in task_ids[third:2 * third]:
+        dag.tasks[task_id]._status = 'Running'
+        dag.tasks[task_id].job_id = f'job-{task_id}'
+
+
+def measure(operation, repeat, timeout):
+    """Median seconds of repeat calls of operation, or an error"""
+    seconds = []
+    for _ in range(repeat):
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        start = time.perf_counter()
+        try:
+            operation()
+        except Timeout:
+            return {'error': f'Timeout after {timeout}s'}
+        except (Exception, RecursionError) as err:
+            return {'error': f'{type(err).__name__}: {err}'.splitlines()[0][:200]}
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        seconds.append(time.perf_counter() - start)
+    return {'median': round(statistics.median(seconds), 6), 'min': round(min(seconds), 6)}
+
+
+def benchmark_config(cfg_path, repeat, timeout):
+    """Results of each operation on one config"""
+    stub = StatusStub()
+    multijob.get_job_status = stub
+    results = {}
+    results['build_dag'] = measure(lambda: multijob.build_dag(cfg_path, cache_dir=None), repeat, timeout)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        try:
+            multijob.build_dag(cfg_path, cache_dir=cache_dir)
+        except Exception:
+            pass
+        results['build_dag_cached'] = measure(lambda: multijob.build_dag(cfg_path, cache_dir=cache_dir), repeat, timeout)
+    try:
+        dag = multijob.build_dag(cfg_path, cache_dir=None)
+    except Exception:
+        return results, 0
+    set_progress(dag)
+    results['validate_dag'] = measure(dag.validate_dag, repeat, timeout)
+    for operation in ('get_ready_tasks', 'get_failed_tasks', 'pipeline_status'):
+        stub.calls = 0
+        results[operation] = measure(getattr(dag, operation), repeat, timeout)
+        if 'error' not in results[operation]:
+            results[operation]['status_calls'] = stub.calls // repeat
+    return results, len(dag.tasks)
+
+
+def find_regressions(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Return (case, previous median, current median) for each shape, size and operation that got slower by more than threshold"""
+    before = {(result['shape'], result['size'], result['operation']): result.get('median') for result in previous['results']}
+    regressions = []
+    for result in current['results']:
+        key = (result['shape'], result['size'], result['operation'])
+        if result.get('median') is not None and before.get(key):
+            if result['median'] > before[key] * (1 + threshold):
+                regressions.append((key, before[key], result['median']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time multijob DAG operations on synthetic configs and compare with the last benchmark.')
+    parser.add_argument('--shape', action='append', choices=SHAPES, help='Config shape to benchmark (repeatable, default: all)')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES), help='Comma separated numbers of config sections')
+    parser.add_argument('--repeat', type=int, default=3, help='Calls of each operation; the median is reported')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds after which an operation is stopped')
+    parser.add_argument('--keep', help='Write the generated configs to this folder rather than a temporary one')
+    parser.add_argument('--history', default=HISTORY_PATH, help='History of benchmarks to compare with and append to')
+    parser.add_argument('--no-record', action='store_true', help='Do not append this benchmark to the history')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error if an operation got slower')
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGALRM, on_alarm)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    benchmark = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0], 'recursion_limit': sys.getrecursionlimit(), 'results': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        config_dir = args.keep or tmp
+        os.makedirs(config_dir, exist_ok=True)
+        for shape in args.shape or SHAPES:
+            for size in sizes:
+                cfg_path = os.path.join(config_dir, f'{shape}_{size}.cfg')
+                with open(cfg_path, 'w') as f:
+                    f.write(generate_config(shape, size))
+                results, task_count = benchmark_config(cfg_path, args.repeat, args.timeout)
+                for operation in OPERATIONS:
+                    if operation not in results:
+                        continue
+                    result = {'shape': shape, 'size': size, 'tasks': task_count, 'operation': operation, **results[operation]}
+                    benchmark['results'].append(result)
+                    if 'error' in result:
+                        print(f'{shape:<9} {size:>6} {operation:<17} failed: {result["error"]}')
+                    else:
+                        calls = f"  {result['status_calls']} status calls" if 'status_calls' in result else ''
+                        print(f'{shape:<9} {size:>6} {operation:<17} {result["median"]:10.4f}s{calls}')
+
+    previous = load_previous(args.history)
+    regressions = find_regressions(previous, benchmark) if previous else []
+    for (shape, size, operation), before, after in regressions:
+        print(f'REGRESSION: {operation} on {shape} {size} took {after:.4f}s, up from {before:.4f}s on {previous["timestamp"]}')
+    if not args.no_record:
+        save_benchmark(benchmark, args.history)
+    if regressions and args.fail_on_regression:
+        sys.exit(f'{len(regressions)} operation(s) got slower than the last benchmark')
@@ -0,0 +1,158 @@
+"""
+Time the import of the Flow workflow modules and the multijob modules, and the serialisation of
+the Flow workflows, to track how long pyflyte takes to start and register a workflow.
+
+    python utilities/benchmark_startup.py [--repeat 5] [--module ADaM_TFL.py] [--fail-on-regression]
+
+Each module is imported in a fresh Python process, repeat times, and the median is reported.
+Importing a Flow module builds its workflow graph, so its time includes the Domino environment and
+hardware tier lookups made by DominoTask; the number of lookups (API calls) is reported with it.
+The workflows of a Flow module are then serialised to the entities pyflyte package and pyflyte
+register send to Flyte, as pyflyte does, and the median time of that is reported separately with
+the number of entities. The first rows are the imports every Flow module pays for (flytekit, the
+Domino plugin and the domino client) on their own, for comparison.
+
+A module that cannot be imported, e.g. because flytekit is not installed or the Domino API is not
+reachable, is reported with its error rather than timed.
+
+Each benchmark is appended to a history file on the project dataset, and compared with the one
+before it. A module whose import or serialisation median grows by more than REGRESSION_THRESHOLD
+is flagged, and with --fail-on-regression the script exits with an error.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'Pipelines'))
+from domino_paths import DATASET_ROOT
+
+HISTORY_PATH = os.environ.get('STARTUP_BENCHMARK_PATH', f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/benchmarks/startup.jsonl")
+
+# Imports shared by every Flow module
+BASELINE_IMPORTS = ['flytekit', 'flytekitplugins.domino.task', 'domino']
+FLOW_MODULES = ['ADaM_TFL.py', 'ADaM_TFL_subworkflows.py', 'Full_Study_Execution.py', 'R_test.py', 'SDTM.py', 'workflow.py']
+PIPELINE_MODULES = ['Pipelines/multijob.py', 'Pipelines/batch.py', 'Pipelines/dagspec.py']
+# Fractional growth of a median over the previous benchmark that counts as a regression
+REGRESSION_THRESHOLD = 0.2
+
+# Run in the child process: import one module and print its import time and lookup count as JSON.
+# With a second argument, also serialise the module's workflows and print the time and entity count.
+PROBE = """
+import importlib, json, os, sys, time
+target = sys.argv[1]
+if target.endswith('.py'):
+    directory, filename = os.path.split(os.path.abspath(target))
+    sys.path.insert(0, directory)
+    target = filename[:-3]
+start = time.perf_counter()
+module = importlib.import_module(target)
+seconds = time.perf_counter() - start
+lookups = None
+flyte = sys.modules.get('utils.flyte')
+if flyte is not None:
+    lookups = flyte.environment_ids.cache_info().misses + flyte.hardware_tier_id.cache_info().misses
+result = {'seconds': seconds, 'lookups': lookups}
+if len(sys.argv) > 2:
+    from collections import OrderedDict
+    from flytekit.configuration import ImageConfig, SerializationSettings
+    from flytekit.core.workflow import WorkflowBase
+    from flytekit.tools.translator import get_serializable
+    settings = SerializationSettings(image_config=ImageConfig.auto_default_image())
+    entities = OrderedDict()
+    start = time.perf_counter()
+    for value in list(vars(module).values()):
+        if isinstance(value, WorkflowBase):
+            get_serializable(entities, settings, value)
+    result['serialize_seconds'] = time.perf_counter() - start
+    result['entities'] = len(entities)
+print(json.dumps(result))
+"""
+
+
+def time_import(target, repeat, serialize=False):
+    """Median import time of a module over repeat fresh processes, and of the serialisation of its workflows if serialize"""
+    seconds = []
+    serialize_seconds = []
+    measured = {}
+    for _ in range(repeat):
+        command = [sys.executable, '-c', PROBE, target] + (['serialize'] if serialize else [])
+        result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            return {'module': target, 'error': error[-1] if error else f'Exit code {result.returncode}'}
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        seconds.append(measured['seconds'])
+        if serialize:
+            serialize_seconds.append(measured['serialize_seconds'])
+    timing = {'module': target, 'median': round(statistics.median(seconds), 3), 'min': round(min(seconds), 3), 'lookups': measured['lookups']}
+    if serialize:
+        timing.update({'serialize_median': round(statistics.median(serialize_seconds), 3), 'entities': measured['entities']})
+    return timing
+
+
+def load_previous(history_path=HISTORY_PATH):
+    try:
+        with open(history_path) as f:
+            lines = [line for line in f if line.strip()]
+        return json.loads(lines[-1]) if lines else None
+    except (OSError, ValueError):
+        return None
+
+
+def find_regressions(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Return (module, measure, previous median, current median) for each import or serialisation that got slower by more than threshold"""
+    before = {result['module']: result for result in previous['results']}
+    regressions = []
+    for result in current['results']:
+        for measure in ('median', 'serialize_median'):
+            previous_median = before.get(result['module'], {}).get(measure)
+            if result.get(measure) is not None and previous_median:
+                if result[measure] > previous_median * (1 + threshold):
+                    regressions.append((result['module'], measure, previous_median, result[measure]))
+    return regressions
+
+
+def save_benchmark(benchmark, history_path=HISTORY_PATH):
+    try:
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        with open(history_path, 'a') as f:
+            f.write(json.dumps(benchmark) + '\n')
+    except OSError as err:
+        print(f'WARNING: Could not save the benchmark to {history_path}: {err}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the import of the workflow modules and compare with the last benchmark.')
+    parser.add_argument('--module', action='append', help='Module to time, as a path from the repository root (repeatable, default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Imports of each module; the median is reported')
+    parser.add_argument('--history', default=HISTORY_PATH, help='History of benchmarks to compare with and append to')
+    parser.add_argument('--no-record', action='store_true', help='Do not append this benchmark to the history')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error if a module got slower')
+    args = parser.parse_args()
+
+    targets = args.module or BASELINE_IMPORTS + FLOW_MODULES + PIPELINE_MODULES
+    benchmark = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0], 'results': []}
+    for target in targets:
+        result = time_import(target, args.repeat, serialize=target in FLOW_MODULES)
+        benchmark['results'].append(result)
+        if 'error' in result:
+            print(f"{target:<40} failed: {result['error']}")
+        else:
+            lookups = '' if result['lookups'] is None else f"  {result['lookups']} lookups"
+            serialize = f"  serialize {result['serialize_median']:.3f}s ({result['entities']} entities)" if 'serialize_median' in result else ''
+            print(f"{target:<40} {result['median']:8.3f}s  (min {result['min']:.3f}s){lookups}{serialize}")
+
+    previous = load_previous(args.history)
+    regressions = find_regressions(previous, benchmark) if previous else []
+    for module, measure, before, after in regressions:
+        step = 'serialising' if measure == 'serialize_median' else 'importing'
+        print(f'REGRESSION: {step} {module} took {after:.3f}s, up from {before:.3f}s on {previous["timestamp"]}')
+    if not args.no_record:
+        save_benchmark(benchmark, args.history)
+    if regressions and args.fail_on_regression:
+        sys.exit(f'{len(regressions)} module(s) got slower than the last benchmark')
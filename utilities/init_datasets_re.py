@@ -1,5 +1,9 @@
 from domino import Domino
 import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DOMINO_USER_API_KEY = os.environ['DOMINO_USER_API_KEY']
 DOMINO_API_HOST = os.environ['DOMINO_API_HOST']
@@ -7,38 +11,32 @@ DOMINO_PROJECT_ID = os.environ['DOMINO_PROJECT_ID']
 DOMINO_PROJECT_OWNER = os.environ['DOMINO_PROJECT_OWNER']
 DOMINO_PROJECT_NAME = os.environ['DOMINO_PROJECT_NAME']
 
-domino = Domino(f"{DOMINO_PROJECT_OWNER}/{DOMINO_PROJECT_NAME}")
-
-# Create domino datasets
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Pipelines'))
+from domino_paths import DATASET_ROOT
 
-# Required Datasets & Descriptions
-REQUIRED = {
-    "METADATA": "Internal metadata",
-    "COMPARE": "PROC COMPARE datasets for QC",
-    "ADAM": "ADAM is created using SDTM data for production",
-    "ADAMQC": "ADAMQC is created using SDTM data for qc",
-    "TFL": "TFL is created using ADAM for production tfls",
-    "TFLQC": "TFLQC is created using ADAM for qc tfls"
-}
+# Lookups that do not change between runs (dataset ID -> name, SDTM project name -> ID) are cached here
+CACHE_PATH = os.environ.get('INIT_DATASETS_CACHE_PATH', f'{DATASET_ROOT}/{DOMINO_PROJECT_NAME}/.init_datasets_re.json')
+# Cached lookups older than this are refreshed
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
 
-# Existing Datasets
-CURRENT = set(d['datasetName'] for d in domino.datasets_list(project_id=os.environ["DOMINO_PROJECT_ID"]))
+# Number of API calls issued concurrently, and the page size for list endpoints
+MAX_WORKERS = 8
+PAGE_SIZE = 100
 
-# For any required datasets which do not exist 
-for key in set(REQUIRED.keys()).difference(CURRENT):
-    # Make them
-    domino.datasets_create(key, REQUIRED[key])
+domino = Domino(f"{DOMINO_PROJECT_OWNER}/{DOMINO_PROJECT_NAME}")
 
 # From multijob.py
 import requests
+session = requests.Session()
+session.headers.update({
+    'X-Domino-Api-Key': DOMINO_USER_API_KEY,
+    'Content-Type': 'application/json',
+    'accept': 'application/json',
+})
+
 def submit_api_call(method, endpoint, data=None):
-    headers = {
-        'X-Domino-Api-Key': DOMINO_USER_API_KEY, 
-        'Content-Type': 'application/json',
-        'accept': 'application/json',
-    }
     url = f'{DOMINO_API_HOST}/{endpoint}'
-    response = requests.request(method, url, headers=headers, json=data)
+    response = session.request(method, url, json=data)
 
     # Some API responses have JSON bodies, some are empty
     try:
@@ -49,6 +47,72 @@ def submit_api_call(method, endpoint, data=None):
         except:
             return response
 
+
+def paginate(endpoint, key):
+    """Yield the items of a paginated list endpoint, one page at a time"""
+    separator = '&' if '?' in endpoint else '?'
+    offset = 0
+    while True:
+        page = submit_api_call('GET', f'{endpoint}{separator}offset={offset}&limit={PAGE_SIZE}')
+        items = page.get(key, [])
+        yield from items
+        offset += len(items)
+        total = page.get('metadata', {}).get('totalCount')
+        if not items or len(items) < PAGE_SIZE or (total is not None and offset >= total):
+            break
+
+
+def load_cache():
+    try:
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {'dataset_names': {}, 'projects': {}}
+    if time.time() - cache.get('created_at', 0) > CACHE_MAX_AGE:
+        return {'dataset_names': {}, 'projects': {}}
+    return cache
+
+
+def save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        cache.setdefault('created_at', time.time())
+        with open(f'{CACHE_PATH}.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.replace(f'{CACHE_PATH}.tmp', CACHE_PATH)
+    except OSError as e:
+        print(f"WARNING: Could not write lookup cache {CACHE_PATH}: {e}")
+
+
+cache = load_cache()
+
+# Create domino datasets
+
+# Required Datasets & Descriptions
+REQUIRED = {
+    "METADATA": "Internal metadata",
+    "COMPARE": "PROC COMPARE datasets for QC",
+    "ADAM": "ADAM is created using SDTM data for production",
+    "ADAMQC": "ADAMQC is created using SDTM data for qc",
+    "TFL": "TFL is created using ADAM for production tfls",
+    "TFLQC": "TFLQC is created using ADAM for qc tfls"
+}
+
+# Existing Datasets
+CURRENT = set(d['datasetName'] for d in domino.datasets_list(project_id=DOMINO_PROJECT_ID))
+
+def create_dataset(name):
+    try:
+        domino.datasets_create(name, REQUIRED[name])
+        print(f"Created dataset {name}")
+    except Exception as e:
+        # Another run may have created it in the meantime
+        print(f"Could not create dataset {name}: {e}")
+
+# For any required datasets which do not exist, make them
+with ThreadPoolExecutor(MAX_WORKERS) as executor:
+    list(executor.map(create_dataset, sorted(set(REQUIRED.keys()).difference(CURRENT))))
+
 # Mount imported datasets
 
 REQUIRED_MOUNTED = {
@@ -62,41 +126,50 @@ CURRENT_MOUNTED_ID = submit_api_call(
      f"api/projects/v1/projects/{DOMINO_PROJECT_ID}/shared-datasets"
 )['dataset']['sharedDatasetIds']
 
-CURRENT_MOUNTED = set()
-for id in CURRENT_MOUNTED_ID:
-    CURRENT_MOUNTED.add(submit_api_call(
+def dataset_name(id):
+    return submit_api_call(
         "GET",
         f"api/datasetrw/v1/datasets/{id}"
-    )['dataset']['name'])
+    )['dataset']['name']
+
+# Dataset names never change for a given ID, so only look up the ones we have not seen before
+UNKNOWN_IDS = [id for id in CURRENT_MOUNTED_ID if id not in cache['dataset_names']]
+with ThreadPoolExecutor(MAX_WORKERS) as executor:
+    cache['dataset_names'].update(zip(UNKNOWN_IDS, executor.map(dataset_name, UNKNOWN_IDS)))
+
+CURRENT_MOUNTED = set(cache['dataset_names'][id] for id in CURRENT_MOUNTED_ID)
 
 # Make SDTM project name
 from re import sub
 SDTM_PROJECT = sub(r"RE_\w+","SDTM", DOMINO_PROJECT_NAME)
 
+def find_project_id(name):
+    # Ask the API for the project by name, and page through the results in case the filter is not applied
+    for project in paginate(f"api/projects/beta/projects?name={requests.utils.quote(name)}", 'projects'):
+        if project['name'] == name:
+            return project['id']
+    raise KeyError(f"Could not find project {name}")
+
 # Get SDTM project ID
-SDTM_PROJECT_IDs = {
-    x['name']: x['id'] 
-    for x in 
-    submit_api_call(
-        "GET",
-        "api/projects/beta/projects?limit=999",
-    )['projects']
-}
+if SDTM_PROJECT not in cache['projects']:
+    cache['projects'][SDTM_PROJECT] = find_project_id(SDTM_PROJECT)
+SDTM_PROJECT_ID = cache['projects'][SDTM_PROJECT]
+
+save_cache(cache)
 
-SDTM_PROJECT_ID = SDTM_PROJECT_IDs[SDTM_PROJECT]
+MISSING_MOUNTS = REQUIRED_MOUNTED.difference(CURRENT_MOUNTED)
 
 # For every unmounted datasets, mount it
 # ASSUMPTION: We are only mounting datasets from the SDTM project
-SDTM_DATASETS = {
-    x['dataset']['name']: x['dataset']['id'] 
-    for x in 
-    submit_api_call(
-        "GET",
-        f"api/datasetrw/v2/datasets?projectIdsToInclude={SDTM_PROJECT_ID}",
-    )['datasets']
-}
+SDTM_DATASETS = {}
+if MISSING_MOUNTS:
+    SDTM_DATASETS = {
+        x['dataset']['name']: x['dataset']['id']
+        for x in
+        paginate(f"api/datasetrw/v2/datasets?projectIdsToInclude={SDTM_PROJECT_ID}", 'datasets')
+    }
 
-for missing_dataset in REQUIRED_MOUNTED.difference(CURRENT_MOUNTED):
+def mount_dataset(missing_dataset):
     try:
         submit_api_call(
             "POST",
@@ -104,8 +177,11 @@ for missing_dataset in REQUIRED_MOUNTED.difference(CURRENT_MOUNTED):
             {
                 "datasetId": SDTM_DATASETS[missing_dataset]
             })
+        print(f"Mounted dataset {missing_dataset}")
     except KeyError:
         print(f"ERROR: Could not find required dataset {missing_dataset} in {SDTM_PROJECT} datasets: {SDTM_DATASETS.keys()}")
     except Exception as e:
         print(e)
-        
+
+with ThreadPoolExecutor(MAX_WORKERS) as executor:
+    list(executor.map(mount_dataset, sorted(MISSING_MOUNTS)))
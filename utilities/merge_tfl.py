@@ -1 +1,234 @@
-print("Combine TFL PDFs")
\ No newline at end of file
+"""
+Combine the TFL PDFs produced by the ADaM_TFL flow into a single report.
+
+The inputs are read from /workflow/inputs/<name> and the combined PDF is written to
+/workflow/outputs/report, which the "Merge TFL PDFs" node returns as a PDFFile.
+
+Pages are copied with qpdf (via pikepdf), which only reads each input's cross-reference
+table up front and streams page content from the source files when the output is written,
+so large listings such as l_medhist are never held in memory as a whole. Fonts and images
+that are embedded identically in several inputs are written once, and every table gets a
+top-level bookmark with the input's own bookmarks nested underneath.
+
+The combined report records a page-range index of its sections, with the content hash
+of each input, in its document information. A copy of the report is kept in the TFL
+dataset, and the next merge rebuilds from it: sections whose input is unchanged are
+copied from the previous report without opening their source again, only the changed
+inputs are read, and if nothing changed the previous report is copied byte for byte.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import pikepdf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Pipelines'))
+from domino_paths import DATASET_ROOT
+
+INPUTS_PATH = '/workflow/inputs'
+OUTPUTS_PATH = '/workflow/outputs'
+OUTPUT_NAME = 'report'
+
+# Copy of the combined report kept between runs, used to splice in only the changed sections
+PACKAGE_PATH = os.environ.get('TFL_PACKAGE_PATH', f'{DATASET_ROOT}/TFL/tfl_package.pdf')
+INDEX_KEY = '/TFLIndex'
+
+# Order of the tables in the combined report. Any other inputs are appended in name order.
+TFL_ORDER = ['t_pop', 't_demog', 't_ae_rel', 't_saf', 't_conmed', 't_eff', 't_vitals', 't_vscat', 'l_medhist']
+
+SHARED_RESOURCES = ('/Font', '/XObject')
+
+
+def list_inputs(inputs_path=INPUTS_PATH):
+    """Return (name, path) for every PDF input, in report order"""
+    names = [name for name in os.listdir(inputs_path) if name != 'sdtm_data_path']
+    ordered = [name for name in TFL_ORDER if name in names]
+    ordered += sorted(name for name in names if name not in TFL_ORDER)
+    return [(name, os.path.join(inputs_path, name)) for name in ordered]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_index(pdf):
+    """Return the section index stored in a combined report, or None if it has none"""
+    if INDEX_KEY not in pdf.docinfo:
+        return None
+    try:
+        return json.loads(str(pdf.docinfo[INDEX_KEY]))
+    except ValueError:
+        return None
+
+
+def object_digest(obj, memo, active=None):
+    """Content hash of a PDF object and everything it references"""
+    active = set() if active is None else active
+    if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+        key = obj.objgen
+        if key in memo:
+            return memo[key]
+        if key in active:
+            return 'cycle'
+        active.add(key)
+
+    digest = hashlib.sha256()
+    if isinstance(obj, pikepdf.Stream):
+        digest.update(obj.read_raw_bytes())
+    if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        for key in sorted(obj.keys()):
+            if key in ('/Parent', '/Length'):
+                continue
+            digest.update(key.encode())
+            digest.update(object_digest(obj[key], memo, active).encode())
+    elif isinstance(obj, pikepdf.Array):
+        for item in obj:
+            digest.update(object_digest(item, memo, active).encode())
+    else:
+        digest.update(repr(obj).encode())
+
+    value = digest.hexdigest()
+    if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+        active.discard(obj.objgen)
+        memo[obj.objgen] = value
+    return value
+
+
+def share_resources(page, seen, memo):
+    """Point the page's fonts and images at an identical object already in the output, where there is one"""
+    resources = page.obj.get('/Resources')
+    if resources is None:
+        return
+    for category in SHARED_RESOURCES:
+        entries = resources.get(category)
+        if entries is None:
+            continue
+        for name in list(entries.keys()):
+            obj = entries[name]
+            if not obj.is_indirect:
+                continue
+            digest = object_digest(obj, memo)
+            if digest in seen:
+                entries[name] = seen[digest]
+            else:
+                seen[digest] = obj
+
+
+def source_bookmarks(pdf):
+    """Return (title, page index) for the top-level bookmarks of an input"""
+    bookmarks = []
+    page_index = {page.obj.objgen: i for i, page in enumerate(pdf.pages)}
+    with pdf.open_outline() as outline:
+        for item in outline.root:
+            destination = item.destination
+            if destination is None and item.action is not None:
+                destination = item.action.get('/D')
+            if isinstance(destination, pikepdf.Array) and len(destination) > 0:
+                target = destination[0]
+                if isinstance(target, pikepdf.Dictionary) and target.objgen in page_index:
+                    bookmarks.append((item.title, page_index[target.objgen]))
+    return bookmarks
+
+
+def merge_pdfs(inputs, output_path, previous_path=None):
+    """
+    Merge the input PDFs into output_path.
+
+    :param inputs: List of (name, path) tuples, in report order
+    :param output_path: Where to write the combined PDF
+    :param previous_path: A combined report from a previous run. Sections whose input is unchanged are copied from it.
+    :return: The section index: one dict per input with its name, first page, page count, hash and bookmarks
+    """
+    hashes = {name: file_hash(path) for name, path in inputs}
+
+    previous, index = None, None
+    if previous_path and os.path.exists(previous_path):
+        previous = pikepdf.open(previous_path)
+        index = read_index(previous)
+        if index is None:
+            print(f'{previous_path} has no section index, rebuilding the whole report.')
+
+    # Nothing changed: the previous report can be reused as it is
+    if index is not None and [(s['name'], s['sha256']) for s in index] == [(name, hashes[name]) for name, _ in inputs]:
+        previous.close()
+        shutil.copyfile(previous_path, output_path)
+        print('No report changed since the previous merge, reusing it.')
+        return index
+
+    previous_sections = {section['name']: section for section in (index or [])}
+    combined = pikepdf.new()
+    sources = []
+    sections = []
+    seen, memo = {}, {}
+    try:
+        for name, path in inputs:
+            section = previous_sections.get(name)
+            if section is not None and section['sha256'] == hashes[name]:
+                pages = previous.pages[section['start']:section['start'] + section['pages']]
+                bookmarks = section['bookmarks']
+                print(f'Reused {name}: {len(pages)} page(s)')
+            else:
+                source = pikepdf.open(path)
+                sources.append(source)
+                pages = source.pages
+                bookmarks = source_bookmarks(source)
+                print(f'Added {name}: {len(pages)} page(s)')
+            start = len(combined.pages)
+            combined.pages.extend(pages)
+            for page in combined.pages[start:]:
+                share_resources(page, seen, memo)
+            sections.append({
+                'name': name,
+                'start': start,
+                'pages': len(combined.pages) - start,
+                'sha256': hashes[name],
+                'bookmarks': bookmarks,
+            })
+
+        with combined.open_outline() as outline:
+            for section in sections:
+                item = pikepdf.OutlineItem(section['name'].upper(), section['start'])
+                for title, page in section['bookmarks']:
+                    item.children.append(pikepdf.OutlineItem(title, section['start'] + page))
+                outline.root.append(item)
+        combined.Root.PageMode = pikepdf.Name.UseOutlines
+        combined.docinfo[INDEX_KEY] = json.dumps(sections)
+
+        # Streams are passed through as they are, so reused sections are copied without being decoded
+        combined.save(
+            output_path,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            stream_decode_level=pikepdf.StreamDecodeLevel.none,
+        )
+    finally:
+        combined.close()
+        for source in sources:
+            source.close()
+        if previous is not None:
+            previous.close()
+
+    return sections
+
+
+def keep_package(output_path, package_path=PACKAGE_PATH):
+    """Store a copy of the combined report for the next merge to rebuild from"""
+    if not os.path.isdir(os.path.dirname(package_path)):
+        print(f'{os.path.dirname(package_path)} does not exist, the next merge will rebuild the whole report.')
+        return
+    shutil.copyfile(output_path, f'{package_path}.tmp')
+    os.replace(f'{package_path}.tmp', package_path)
+
+
+if __name__ == '__main__':
+    print("Combine TFL PDFs")
+    os.makedirs(OUTPUTS_PATH, exist_ok=True)
+    output_path = os.path.join(OUTPUTS_PATH, OUTPUT_NAME)
+    sections = merge_pdfs(list_inputs(), output_path, previous_path=PACKAGE_PATH)
+    keep_package(output_path)
+    print(f'Combined {len(sections)} report(s), {sum(section["pages"] for section in sections)} page(s)')
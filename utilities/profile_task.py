@@ -0,0 +1,213 @@
+"""
+Profile a pipeline program, and recommend the cheapest hardware tier for each program.
+
+Run a command under the profiler:
+
+    python utilities/profile_task.py --name ADSL --tier "Medium - [AWS US]" -- prod/adam/adsl.sas
+
+A single SAS, R or Python program is run with sas -sysin, Rscript or python. Anything else, such
+as the R -e "logrx::axecute(...)" commands multijob builds, is run as given. The command's exit
+code is passed through.
+
+Once the command exits, the profile is written to /mnt/artifacts/profiles/<name>.json. It holds
+the wall time, the CPU time, the peak RSS of the largest process and the bytes read from and
+written to disk. The profile is also appended to a history file on the project dataset. multijob
+(PipelineRunner.submit_task) and Flow tasks (DominoTask) wrap their commands with this profiler
+when DMV_PROFILE is true.
+
+Report on the history:
+
+    python utilities/profile_task.py --report --latency 900
+
+For each program, the report picks the cheapest tier with enough memory for the largest peak RSS
+seen, plus headroom, and whose estimated wall time is within the latency target. The estimate
+assumes that a run using more cores than the tier has slows down in proportion. The tier
+catalogue below can be replaced with --tiers, a JSON file in the same form.
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Pipelines'))
+from domino_paths import DATASET_ROOT
+
+PROFILES_PATH = os.environ.get('PROFILES_PATH', '/mnt/artifacts/profiles')
+HISTORY_PATH = os.environ.get('PROFILE_HISTORY_PATH', f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/profiles/history.jsonl")
+
+# How each kind of program is run when the command is just its path
+RUNNERS = {
+    '.sas': ['sas', '-sysin'],
+    '.r': ['Rscript'],
+    '.py': [sys.executable],
+}
+
+# Hardware tiers: cores, memory (GiB) and relative cost per hour
+TIERS = {
+    'Small - [AWS US]': {'cores': 1, 'memory_gb': 4, 'cost': 1.0},
+    'Medium - [AWS US]': {'cores': 4, 'memory_gb': 16, 'cost': 4.0},
+    'Large - [AWS US]': {'cores': 8, 'memory_gb': 32, 'cost': 8.0},
+}
+# Peak RSS is multiplied by this before checking it fits in a tier's memory
+MEMORY_HEADROOM = 1.5
+# ru_inblock and ru_oublock count 512 byte blocks
+BLOCK_SIZE = 512
+
+
+def build_command(command):
+    if len(command) == 1:
+        extension = os.path.splitext(command[0])[1].lower()
+        if extension in RUNNERS:
+            return RUNNERS[extension] + command
+    return command
+
+
+def run_profiled(command, name, tier=None):
+    """Run the command and return (exit code, profile)"""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    returncode = subprocess.call(build_command(command))
+    wall_time = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    profile = {
+        'name': name,
+        'command': shlex.join(command),
+        'tier': tier,
+        'run_id': os.environ.get('DOMINO_RUN_ID'),
+        'started_at': start,
+        'returncode': returncode,
+        'wall_time': wall_time,
+        'cpu_time': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        # ru_maxrss is in KiB on Linux, and is the peak of the largest child process
+        'peak_rss_mb': after.ru_maxrss / 1024,
+        'read_bytes': (after.ru_inblock - before.ru_inblock) * BLOCK_SIZE,
+        'write_bytes': (after.ru_oublock - before.ru_oublock) * BLOCK_SIZE,
+    }
+    return returncode, profile
+
+
+def save_profile(profile, profiles_path=PROFILES_PATH, history_path=HISTORY_PATH):
+    try:
+        os.makedirs(profiles_path, exist_ok=True)
+        with open(os.path.join(profiles_path, f"{profile['name']}.json"), 'w') as f:
+            json.dump(profile, f, indent=4)
+    except OSError as err:
+        print(f'WARNING: Could not write the profile to {profiles_path}: {err}')
+    try:
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        # Single appended lines, so parallel tasks can share the history file
+        with open(history_path, 'a') as f:
+            f.write(json.dumps(profile) + '\n')
+    except OSError as err:
+        print(f'WARNING: Could not add the profile to {history_path}: {err}')
+
+
+def load_history(history_path=HISTORY_PATH):
+    profiles = []
+    with open(history_path) as f:
+        for line in f:
+            try:
+                profiles.append(json.loads(line))
+            except ValueError:
+                continue
+    return profiles
+
+
+def estimate_wall_time(profile, tier):
+    """Wall time of a run on a tier, assuming it slows down if it used more cores than the tier has"""
+    cores_used = profile['cpu_time'] / profile['wall_time'] if profile['wall_time'] > 0 else 1
+    return profile['wall_time'] * max(1, cores_used / tier['cores'])
+
+
+def recommend(profiles, tiers=TIERS, latency=None):
+    """
+    Recommend a tier per program from its successful runs.
+
+    :param profiles: Profiles from the history
+    :param tiers: Tier name -> cores, memory_gb and cost
+    :param latency: Wall time target in seconds. Without one, only memory is considered.
+    :return: One row per program
+    """
+    by_name = {}
+    for profile in profiles:
+        if profile.get('returncode') == 0:
+            by_name.setdefault(profile['name'], []).append(profile)
+
+    rows = []
+    for name, runs in sorted(by_name.items()):
+        peak_rss_mb = max(run['peak_rss_mb'] for run in runs)
+        slowest = max(runs, key=lambda run: run['wall_time'])
+        recommended, estimate = None, None
+        for tier_name, tier in sorted(tiers.items(), key=lambda item: item[1]['cost']):
+            if peak_rss_mb * MEMORY_HEADROOM > tier['memory_gb'] * 1024:
+                continue
+            tier_estimate = estimate_wall_time(slowest, tier)
+            if latency is None or tier_estimate <= latency:
+                recommended, estimate = tier_name, tier_estimate
+                break
+        current = sorted({run['tier'] for run in runs if run.get('tier')})
+        rows.append({
+            'name': name,
+            'runs': len(runs),
+            'current_tier': ', '.join(current),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'cpu_time': round(max(run['cpu_time'] for run in runs), 1),
+            'wall_time': round(slowest['wall_time'], 1),
+            'read_mb': round(max(run['read_bytes'] for run in runs) / 2**20, 1),
+            'write_mb': round(max(run['write_bytes'] for run in runs) / 2**20, 1),
+            'recommended_tier': recommended or 'None meets the target',
+            'estimated_wall_time': None if estimate is None else round(estimate, 1),
+        })
+    return rows
+
+
+def write_report(rows, report_path):
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Profile a pipeline program, or report tier recommendations from past profiles.')
+    parser.add_argument('--name', help='Program or task name the profile is stored under')
+    parser.add_argument('--tier', help='Hardware tier the command runs on')
+    parser.add_argument('--report', action='store_true', help='Report tier recommendations instead of running a command')
+    parser.add_argument('--latency', type=float, help='Wall time target in seconds for the recommendations')
+    parser.add_argument('--tiers', help='JSON file of tier name -> cores, memory_gb and cost, replacing the built in catalogue')
+    parser.add_argument('--history', default=HISTORY_PATH, help='History of profiles to report on')
+    parser.add_argument('--output', default=os.path.join(PROFILES_PATH, 'tier_report.csv'), help='Where to write the report')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to profile, after --')
+    args = parser.parse_args(argv)
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if not args.report and not (args.name and args.command):
+        parser.error('--name and a command are required unless --report is given')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.report:
+        tiers = TIERS
+        if args.tiers:
+            with open(args.tiers) as f:
+                tiers = json.load(f)
+        rows = recommend(load_history(args.history), tiers, args.latency)
+        if not rows:
+            sys.exit(f'No successful runs in {args.history}')
+        write_report(rows, args.output)
+        for row in rows:
+            print(f"{row['name']}: peak {row['peak_rss_mb']} MB, {row['wall_time']} s on {row['current_tier'] or 'unknown tier'} -> {row['recommended_tier']}")
+    else:
+        returncode, profile = run_profiled(args.command, args.name, args.tier)
+        save_profile(profile)
+        print(f"Profile of {args.name}: {profile['wall_time']:.1f} s wall, {profile['cpu_time']:.1f} s CPU, peak RSS {profile['peak_rss_mb']:.0f} MB")
+        sys.exit(returncode)
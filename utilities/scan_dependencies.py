@@ -0,0 +1,401 @@
+"""
+Find the real data dependencies between the programs of a pipeline, and check the declared ones against them.
+
+The SAS, R and Python programs under prod/, qc/ and share/macros are scanned for the datasets
+they read and write:
+
+    SAS     set/merge/update/modify lib.ds, data=lib.ds, from/join lib.ds and macro call arguments
+            are reads. data lib.ds, out=lib.ds and create table lib.ds are writes. Librefs are the
+            ones assigned in domino.sas, or by a libname statement in the program itself, and
+            lib._ALL_ reads the whole library. Macros defined in share/macros add their own reads
+            and writes to every program that calls them.
+    R/Py    String paths under /mnt/data/<LIB>/ or /workflow/inputs|outputs/ passed to a function.
+            read_*/load/readRDS calls are reads, write_*/save/to_* calls are writes.
+
+For a multijob config, each task really depends on the tasks that write a dataset it reads.
+For a Flow module such as ADaM_TFL.py, each task really depends on the producers of the
+/workflow/inputs it reads. The declared dependencies are then reported as:
+
+    missing             A dataset the task reads is written by a task it is not ordered after.
+    over-constrained    The task reads nothing the dependency writes, directly or through others.
+                        Removing the edge lets the two run in parallel.
+    unverified          The program of either task could not be found, no reads were found in the
+                        task or no writes in the dependency, so the edge is kept as declared.
+    unproduced          The task reads an ADaM, TFL or QC dataset that no task in the pipeline writes.
+
+The minimal graph (the real dependencies without the ones implied by others, plus the unverified
+edges) is printed as depends: lines that can replace the ones in the config. In a Flow every edge
+passes a dataset as an input, so none is implied by others: its minimal graph keeps all the real
+and unverified edges, and only drops the over-constrained ones.
+
+Usage: python utilities/scan_dependencies.py [Pipelines/jobs.cfg ADaM_TFL.py ...] [--json PATH]
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import re
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'Pipelines'))
+from dagspec import compile_spec
+
+MACRO_DIR = os.path.join(REPO_ROOT, 'share', 'macros')
+
+# Librefs assigned in domino.sas, and the Flow input and output directories
+LIBREFS = {
+    'adam': 'ADAM',
+    'adamqc': 'ADAMQC',
+    'tfl': 'TFL',
+    'tflqc': 'TFLQC',
+    'sdtm': 'SDTM',
+    'sdtmblnd': 'SDTMBLIND',
+    'sdtmunbd': 'SDTMUNBLIND',
+    'raw': 'RAW',
+    'blind': 'BLIND',
+    'unblind': 'UNBLIND',
+    'metadata': 'METADATA',
+    'compare': 'COMPARE',
+    'inputs': 'INPUTS',
+    'outputs': 'OUTPUTS',
+}
+WHOLE_LIBRARY = '*'
+# Libraries written by the pipeline itself. Reads from any other library (SDTM, RAW, ...) are external inputs.
+PIPELINE_LIBRARIES = ('ADAM', 'ADAMQC', 'TFL', 'TFLQC', 'COMPARE')
+
+PROGRAM_EXTENSIONS = ('.sas', '.r', '.py')
+FLOW_TASK_FUNCTIONS = ('create_adam_data', 'create_tfl_report', 'DominoTask')
+
+DATASET_REF = re.compile(r'(?<![&\w.%])([A-Za-z_]\w{0,7})\.([A-Za-z_]\w*)\b')
+DATA_PATH = re.compile(r'/(?:mnt/data|domino/datasets/local)/(?:snapshots/)?([A-Za-z]\w*)/([^/"\'\s]+)')
+WORKFLOW_PATH = re.compile(r'/workflow/(inputs|outputs)/([^/"\'\s]+)')
+LIBNAME = re.compile(r'^libname\s+(\w+)\s+["\']([^"\']+)["\']', re.IGNORECASE)
+MACRO_CALL = re.compile(r'%(\w+)\s*\(([^;]*?)\)\s*(?:;|$)', re.DOTALL)
+PATH_CALL = re.compile(r'([\w.:]+)\s*\(\s*(?:file\s*=\s*)?["\']([^"\']+)["\']')
+WRITE_FUNCTIONS = re.compile(r'(^|[.:])(write\w*|save\w*|to_\w+|export\w*)$', re.IGNORECASE)
+
+
+def dataset(library, member):
+    """Datasets are identified by library and member name, case insensitively and without extension"""
+    return (library.upper(), os.path.splitext(member)[0].upper())
+
+
+def path_dataset(path):
+    match = WORKFLOW_PATH.search(path)
+    if match:
+        return dataset(match.group(1), match.group(2))
+    match = DATA_PATH.search(path)
+    if match:
+        return dataset(match.group(1), match.group(2))
+    return None
+
+
+def strip_sas_comments(code):
+    code = re.sub(r'/\*.*?\*/', ' ', code, flags=re.DOTALL)
+    # Comment statements: * ...; and %* ...; at the start of a statement
+    return re.sub(r'(^|;)\s*%?\*[^;]*;', r'\1', code)
+
+
+def sas_refs(text, librefs):
+    refs = set()
+    text = re.sub(r'"[^"]*"|\'[^\']*\'', ' ', text)
+    for libref, member in DATASET_REF.findall(text):
+        if libref.lower() in librefs:
+            member = WHOLE_LIBRARY if member.upper() == '_ALL_' else member
+            refs.add(dataset(librefs[libref.lower()], member))
+    return refs
+
+
+def scan_sas(code, macros=None):
+    """Return the (reads, writes) of a SAS program"""
+    macros = macros or {}
+    reads, writes = set(), set()
+    librefs = dict(LIBREFS)
+    for statement in strip_sas_comments(code).split(';'):
+        statement = statement.strip()
+        keyword = statement.split(None, 1)[0].lower() if statement else ''
+
+        libname = LIBNAME.match(statement)
+        if libname:
+            path = libname.group(2).rstrip('/') + '/'
+            library = path_dataset(path + 'x')
+            if library is not None:
+                librefs[libname.group(1).lower()] = library[0]
+            continue
+
+        if keyword == 'data' and '=' not in statement.split('(', 1)[0]:
+            writes |= sas_refs(statement[4:], librefs)
+        elif keyword in ('set', 'merge', 'update', 'modify'):
+            reads |= sas_refs(statement[len(keyword):], librefs)
+
+        for match in re.finditer(r'\bdata\s*=\s*(\S+)', statement, re.IGNORECASE):
+            reads |= sas_refs(match.group(1), librefs)
+        for match in re.finditer(r'\bout\s*=\s*(\S+)', statement, re.IGNORECASE):
+            writes |= sas_refs(match.group(1), librefs)
+        for match in re.finditer(r'\b(?:from|join)\s+(\S+)', statement, re.IGNORECASE):
+            reads |= sas_refs(match.group(1), librefs)
+        for match in re.finditer(r'\b(?:create\s+table|insert\s+into)\s+(\S+)', statement, re.IGNORECASE):
+            writes |= sas_refs(match.group(1), librefs)
+
+        for match in WORKFLOW_PATH.finditer(statement):
+            (writes if match.group(1) == 'outputs' else reads).add(dataset(match.group(1), match.group(2)))
+
+    for name, arguments in MACRO_CALL.findall(strip_sas_comments(code)):
+        reads |= sas_refs(arguments, librefs)
+        if name.lower() in macros:
+            macro_reads, macro_writes = macros[name.lower()]
+            reads |= macro_reads
+            writes |= macro_writes
+
+    return reads, writes - {dataset('OUTPUTS', WHOLE_LIBRARY)}
+
+
+def scan_script(code):
+    """Return the (reads, writes) of an R or Python program"""
+    reads, writes = set(), set()
+    for function, path in PATH_CALL.findall(code):
+        ref = path_dataset(path)
+        if ref is None:
+            continue
+        if WRITE_FUNCTIONS.search(function) or ref[0] == 'OUTPUTS':
+            writes.add(ref)
+        else:
+            reads.add(ref)
+    return reads, writes
+
+
+def load_macros(macro_dir=MACRO_DIR):
+    """Return {macro name: (reads, writes)} for the macros in share/macros, from their hardcoded librefs"""
+    macros = {}
+    for path in sorted(glob.glob(os.path.join(macro_dir, '*.sas'))):
+        with open(path, errors='replace') as f:
+            code = f.read()
+        io = scan_sas(code)
+        for name in re.findall(r'%macro\s+(\w+)', strip_sas_comments(code), re.IGNORECASE):
+            macros[name.lower()] = io
+    return macros
+
+
+def find_program(command):
+    """Return the path of the program a task command runs, or None if it is not in this repository"""
+    for token in re.split(r'[\s"\'(),]+', command):
+        if not token.lower().endswith(PROGRAM_EXTENSIONS):
+            continue
+        path = token if os.path.isabs(token) else os.path.join(REPO_ROOT, token)
+        if os.path.exists(path):
+            return path
+        # Config commands do not always match the case of the file name
+        directory = os.path.dirname(path)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.lower() == os.path.basename(path).lower():
+                    return os.path.join(directory, name)
+    return None
+
+
+def scan_program(path, macros):
+    with open(path, errors='replace') as f:
+        code = f.read()
+    if path.lower().endswith('.sas'):
+        return scan_sas(code, macros)
+    return scan_script(code)
+
+
+def closure(graph):
+    """Return every task's transitive dependencies"""
+    ancestors = {}
+    def visit(task_id, active=()):
+        if task_id not in ancestors:
+            found = set()
+            for dependency in graph.get(task_id, []):
+                if dependency in active:
+                    continue
+                found.add(dependency)
+                found |= visit(dependency, active + (task_id,))
+            ancestors[task_id] = found
+        return ancestors[task_id]
+    for task_id in graph:
+        visit(task_id)
+    return ancestors
+
+
+def reduce_graph(graph):
+    """Drop the dependencies that are implied by another dependency"""
+    ancestors = closure(graph)
+    return {
+        task_id: [d for d in dependencies if not any(d in ancestors[other] for other in dependencies if other != d)]
+        for task_id, dependencies in graph.items()
+    }
+
+
+def depth(graph):
+    """Length of the longest chain of dependencies, i.e. the number of waves the pipeline runs in"""
+    levels = {}
+    def level(task_id, active=()):
+        if task_id not in levels:
+            levels[task_id] = 1 + max([level(d, active + (task_id,)) for d in graph[task_id] if d not in active] or [0])
+        return levels[task_id]
+    return max([level(task_id) for task_id in graph] or [0])
+
+
+def check_graph(declared, true, readers, writers, unproduced=None, reduce=True):
+    """
+    Compare the declared dependencies with the real ones.
+
+    :param declared: Task ID -> declared dependencies
+    :param true: Task ID -> tasks that write something it reads
+    :param readers: Task IDs whose reads were found
+    :param writers: Task IDs whose writes were found
+    :param unproduced: (task ID, dataset) for reads of pipeline datasets that no task writes
+    :param reduce: Drop the edges implied by others from the minimal graph, which is only valid where edges just order tasks
+    :return: Dict of missing, over-constrained and unverified edges, and the minimal graph
+    """
+    declared_ancestors = closure(declared)
+    true_ancestors = closure(true)
+    missing, over_constrained, unverified = [], [], []
+    for task_id, dependencies in declared.items():
+        for dependency in true.get(task_id, []):
+            if dependency not in declared_ancestors[task_id]:
+                missing.append((task_id, dependency))
+        for dependency in dependencies:
+            if task_id not in readers or dependency not in writers:
+                unverified.append((task_id, dependency))
+            elif dependency not in true_ancestors[task_id]:
+                over_constrained.append((task_id, dependency))
+
+    minimal = {task_id: sorted(set(true.get(task_id, [])) | {d for t, d in unverified if t == task_id}) for task_id in declared}
+    if reduce:
+        minimal = reduce_graph(minimal)
+    # Keep the config order of the dependencies
+    minimal = {task_id: [d for d in declared if d in minimal[task_id]] for task_id in declared}
+    return {
+        'missing': missing,
+        'over_constrained': over_constrained,
+        'unverified': unverified,
+        'unproduced': unproduced or [],
+        'minimal': minimal,
+        'declared_depth': depth(declared),
+        'minimal_depth': depth(minimal),
+    }
+
+
+def scan_config(cfg_path, macros):
+    spec = compile_spec(cfg_path)
+    declared = {task['task_id']: task['depends'] for task in spec['tasks']}
+    io = {}
+    for task in spec['tasks']:
+        path = find_program(task['command'])
+        reads, writes = scan_program(path, macros) if path else (set(), set())
+        # Flow outputs are not shared between multijob tasks
+        io[task['task_id']] = (reads, {ref for ref in writes if ref[0] != 'OUTPUTS'})
+    readers = {task_id for task_id, (reads, writes) in io.items() if reads or writes}
+    writers = {task_id for task_id, (_, writes) in io.items() if writes}
+
+    true, unproduced = {}, []
+    for task_id, (reads, _) in io.items():
+        producers = set()
+        for library, member in sorted(reads):
+            found = {
+                producer for producer, (_, writes) in io.items()
+                if producer != task_id and ((library, member) in writes or (member == WHOLE_LIBRARY and any(w[0] == library for w in writes)))
+            }
+            if not found and library in PIPELINE_LIBRARIES:
+                unproduced.append((task_id, f'{library}.{member}'))
+            producers |= found
+        true[task_id] = sorted(producers)
+    return check_graph(declared, true, readers, writers, unproduced)
+
+
+def flow_tasks(flow_path):
+    """
+    Return (task ID, command, {input name: producer variable}, variable) for every task in a Flow module,
+    in the order they are defined.
+    """
+    with open(flow_path) as f:
+        tree = ast.parse(f.read())
+    tasks = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)):
+            continue
+        function = node.value.func
+        function_name = function.id if isinstance(function, ast.Name) else getattr(function, 'attr', None)
+        if function_name not in FLOW_TASK_FUNCTIONS or not isinstance(node.targets[0], ast.Name):
+            continue
+        kwargs = {keyword.arg: keyword.value for keyword in node.value.keywords}
+        name = ast.literal_eval(kwargs['name']) if 'name' in kwargs else node.targets[0].id
+        command = ast.literal_eval(kwargs['command']) if 'command' in kwargs else ''
+        inputs = {}
+        if isinstance(kwargs.get('dependencies'), ast.List):
+            for element in kwargs['dependencies'].elts:
+                input_name = None
+                # An additional output, e.g. adsl.outputs["adsllkp"], is read as inputs.adsllkp and comes from the task that created adsl
+                if isinstance(element, ast.Subscript) and isinstance(element.slice, ast.Constant):
+                    input_name = element.slice.value
+                while isinstance(element, (ast.Attribute, ast.Subscript)):
+                    element = element.value
+                if isinstance(element, ast.Name):
+                    inputs[input_name or element.id] = element.id
+        if isinstance(kwargs.get('inputs'), ast.List):
+            for element in kwargs['inputs'].elts:
+                if not isinstance(element, ast.Call):
+                    continue
+                input_kwargs = {keyword.arg: keyword.value for keyword in element.keywords}
+                value = input_kwargs.get('value')
+                while isinstance(value, (ast.Attribute, ast.Subscript)):
+                    value = value.value
+                if isinstance(value, ast.Name) and 'name' in input_kwargs:
+                    inputs[ast.literal_eval(input_kwargs['name'])] = value.id
+        tasks.append((name, command, inputs, node.targets[0].id))
+    return tasks
+
+
+def scan_flow(flow_path, macros):
+    tasks = flow_tasks(flow_path)
+    task_ids = {variable: name for name, _, _, variable in tasks}
+    declared, true, readers = {}, {}, set()
+    for name, command, inputs, _ in tasks:
+        # Input names are the producing task's file name, e.g. adsl.sas7bdat is read as inputs.adsl
+        producers = {dataset('INPUTS', input_name)[1]: task_ids[variable] for input_name, variable in inputs.items() if variable in task_ids}
+        declared[name] = sorted(set(producers.values()))
+        path = find_program(command)
+        reads = scan_program(path, macros)[0] if path else set()
+        if reads:
+            readers.add(name)
+        true[name] = sorted({producers[member] for library, member in reads if library == 'INPUTS' and member in producers})
+    # Every task of a Flow writes its outputs, so a dependency only needs its reader to be scanned.
+    # Each edge is an input the task receives, so the ones implied by others are kept.
+    return check_graph(declared, true, readers, set(declared), reduce=False)
+
+
+def print_report(source, result):
+    print(f'## {source} ##')
+    for label in ('missing', 'over_constrained', 'unverified'):
+        for task_id, dependency in result[label]:
+            print(f"{label.replace('_', '-').upper()}: {task_id} -> {dependency}")
+    for task_id, ref in result['unproduced']:
+        print(f'UNPRODUCED: {task_id} reads {ref}, which no task writes')
+    print(f"Longest chain: {result['declared_depth']} task(s) as declared, {result['minimal_depth']} with the minimal graph")
+    print('Minimal graph:')
+    for task_id, dependencies in result['minimal'].items():
+        print(f"[{task_id}]\ndepends: {','.join(dependencies)}" if dependencies else f'[{task_id}]')
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check declared pipeline dependencies against the datasets each program reads and writes.')
+    parser.add_argument('sources', nargs='*', help='Multijob configs and Flow modules (default: Pipelines/jobs*.cfg and ADaM_TFL.py)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    sources = args.sources or sorted(glob.glob(os.path.join(REPO_ROOT, 'Pipelines', 'jobs*.cfg'))) + [os.path.join(REPO_ROOT, 'ADaM_TFL.py')]
+    macros = load_macros()
+    results = {}
+    for source in sources:
+        results[source] = scan_flow(source, macros) if source.endswith('.py') else scan_config(source, macros)
+        print_report(os.path.relpath(source, REPO_ROOT), results[source])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
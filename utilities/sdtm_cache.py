@@ -0,0 +1,177 @@
+"""
+Node local read-through cache of SDTM snapshots.
+
+Snapshots never change once taken, so the first job on a node to read a snapshot copies it from
+the imported dataset mount into SDTM_CACHE_ROOT, and every later job on the node reads the local
+copy instead of the network file system:
+
+    SDTM_CACHE_ROOT/<snapshot path with / replaced by _>/
+    SDTM_CACHE_ROOT/<snapshot path with / replaced by _>.used
+
+The cache is only used if SDTM_CACHE_ROOT is set, and is only worth it if SDTM_CACHE_ROOT is a
+volume shared by the jobs on a node: each Domino job has its own /tmp, so a cache there would be
+copied by every job and read by none.
+
+The copy is made in a temporary folder and renamed into place, so a cached snapshot is always
+complete, and jobs racing to populate the same snapshot do not interfere: the first rename wins
+and the others discard their copy. Nothing is cached if the node does not have room for the
+snapshot.
+
+Every job that reads a snapshot, in SAS, R or Python, first writes its .used file, and only then
+checks that the snapshot is cached. Snapshots whose .used file is older than PRUNE_DAYS are
+removed when a new one is cached: the folder is renamed away, the .used file checked again, and
+the folder put back if a job has used it since. A job that started reading the snapshot before it
+was renamed therefore always keeps it, and one that starts after finds it gone and reads the
+mount. PRUNE_DAYS must be longer than the longest job.
+
+SAS programs get the cache through the SDTM libname in domino.sas, R programs through
+sdtm_path() in utilities/sdtm_cache.R, and Python programs through sdtm_path() here:
+
+    from sdtm_cache import sdtm_path
+    lb = pd.read_sas(os.path.join(sdtm_path(sdtm_data_path), 'lb.sas7bdat'))
+
+From the command line, print the cached folder of a snapshot, caching it first if needed:
+
+    python utilities/sdtm_cache.py /mnt/imported/data/snapshots/sdtm-blind/1 [--link WORKSPACE_DIR]
+
+--link also hardlinks the cached files into a folder of the job's workspace. Where the workspace
+is on another file system, the files are copied from the cache instead.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+SDTM_CACHE_ROOT = os.environ.get('SDTM_CACHE_ROOT')
+PRUNE_DAYS = 7
+# Room to leave on the cache file system, as a fraction of the snapshot size
+FREE_SPACE_MARGIN = 0.1
+
+
+def cache_key(snapshot_path):
+    # domino.sas builds the same key with translate(), so keep the two in step
+    return os.path.abspath(snapshot_path).strip('/').replace('/', '_')
+
+
+def cache_dir(snapshot_path, cache_root=SDTM_CACHE_ROOT):
+    return os.path.join(cache_root, cache_key(snapshot_path))
+
+
+def used_path(cached_path):
+    return f'{cached_path}.used'
+
+
+def mark_used(snapshot_path, cache_root=SDTM_CACHE_ROOT):
+    os.makedirs(cache_root, exist_ok=True)
+    with open(used_path(cache_dir(snapshot_path, cache_root)), 'w') as f:
+        f.write(f'{os.getpid()}\n')
+
+
+def last_used(cached_path):
+    try:
+        return os.stat(used_path(cached_path)).st_mtime
+    except FileNotFoundError:
+        return os.stat(cached_path).st_mtime
+
+
+def snapshot_size(snapshot_path):
+    return sum(entry.stat().st_size for entry in os.scandir(snapshot_path) if entry.is_file())
+
+
+def prune(cache_root=SDTM_CACHE_ROOT, days=PRUNE_DAYS):
+    cutoff = time.time() - days * 86400
+    for entry in os.scandir(cache_root):
+        if not entry.is_dir() or '.tmp-' in entry.name or last_used(entry.path) >= cutoff:
+            continue
+        # Take the snapshot out of use before deleting it, then check that no job marked it used meanwhile
+        pruned = f'{entry.path}.tmp-prune-{os.getpid()}'
+        try:
+            os.rename(entry.path, pruned)
+        except OSError:
+            continue
+        if os.path.exists(used_path(entry.path)) and last_used(entry.path) >= cutoff:
+            try:
+                os.rename(pruned, entry.path)
+                continue
+            except OSError:
+                # Cached again by another job in the meantime
+                pass
+        else:
+            try:
+                os.remove(used_path(entry.path))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(pruned, ignore_errors=True)
+
+
+def populate(snapshot_path, cache_root=SDTM_CACHE_ROOT):
+    """Copy a snapshot into the cache, unless another job has already done so. Returns the cached folder."""
+    target = cache_dir(snapshot_path, cache_root)
+    os.makedirs(cache_root, exist_ok=True)
+    prune(cache_root)
+    size = snapshot_size(snapshot_path)
+    if shutil.disk_usage(cache_root).free < size * (1 + FREE_SPACE_MARGIN):
+        raise OSError(f'Not enough space in {cache_root} for {size / 2**20:.0f} MB snapshot')
+
+    tmp = f'{target}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        for entry in os.scandir(snapshot_path):
+            if entry.is_file():
+                shutil.copy2(entry.path, os.path.join(tmp, entry.name))
+                # Read only, as the files may be hardlinked into job workspaces
+                os.chmod(os.path.join(tmp, entry.name), 0o444)
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Another job finished caching the snapshot first
+        if not os.path.isdir(target):
+            raise
+    return target
+
+
+def sdtm_path(snapshot_path, cache_root=SDTM_CACHE_ROOT):
+    """
+    Return the folder to read a snapshot from: its cached copy, cached now if it was not yet, or the
+    snapshot itself if there is no cache or the snapshot cannot be cached.
+    """
+    if not cache_root:
+        return snapshot_path
+    target = cache_dir(snapshot_path, cache_root)
+    try:
+        # Mark the snapshot as used before checking that it is cached, so it is not pruned under this job
+        mark_used(snapshot_path, cache_root)
+        if not os.path.isdir(target):
+            populate(snapshot_path, cache_root)
+        return target
+    except OSError as err:
+        print(f'WARNING: Reading {snapshot_path} without the local cache: {err}', file=sys.stderr)
+        return snapshot_path
+
+
+def link_snapshot(cached_path, workspace_dir):
+    os.makedirs(workspace_dir, exist_ok=True)
+    for entry in os.scandir(cached_path):
+        destination = os.path.join(workspace_dir, entry.name)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(entry.path, destination)
+        except OSError:
+            shutil.copy2(entry.path, destination)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cache an SDTM snapshot on this node and print the folder to read it from.')
+    parser.add_argument('snapshot', help='Folder of the SDTM snapshot')
+    parser.add_argument('--link', help='Also hardlink the cached files into this folder')
+    args = parser.parse_args()
+    if not os.path.isdir(args.snapshot):
+        sys.exit(f'Snapshot {args.snapshot} does not exist')
+    path = sdtm_path(args.snapshot)
+    if args.link:
+        link_snapshot(path, args.link)
+        path = args.link
+    print(path)
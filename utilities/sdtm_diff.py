@@ -0,0 +1,242 @@
+"""
+Find the ADaM and TFL tasks affected by a new SDTM snapshot.
+
+Each domain of the new snapshot (dm, ae, lb, vs, ...) is fingerprinted and compared with the
+previous snapshot:
+
+    python utilities/sdtm_diff.py /mnt/imported/data/snapshots/sdtm-blind/2 \
+        --previous /mnt/imported/data/snapshots/sdtm-blind/1 --cfg Pipelines/jobs.cfg --output affected.txt
+
+A domain's fingerprint is a hash of its data: the column names and types and the values of every
+row. Re-exporting unchanged data therefore does not count as a change, even though the files
+differ. SUPP-- datasets count as part of their parent domain. Fingerprints are cached by file
+path, size and modification time, so a snapshot that has been seen before is not read again.
+
+Without --previous, the new snapshot is compared with the last one recorded in STATE_PATH. With
+no previous snapshot at all, every domain counts as changed. Diffing does not record anything, as
+the tasks it finds affected have not been rerun yet. Once they have been, record the snapshot as
+the one the outputs are built from, so the next snapshot is compared with it:
+
+    python utilities/sdtm_diff.py /mnt/imported/data/snapshots/sdtm-blind/2 --record
+
+If the rerun fails, the snapshot is not recorded, and the next diff still finds the same tasks
+affected.
+
+A task reads a domain if its program reads SDTM.<domain>, as found by scan_dependencies.py, or
+if the domain map (Pipelines/sdtm_domains.cfg) lists its program under the domain. The affected
+tasks are those that read a changed domain, and every task that depends on them, directly or
+not. They are printed, and written one per line to --output, which multijob reads with --only to
+run just that part of the pipeline. For a Flow module (--flow ADaM_TFL.py), the affected tasks
+are reported by their names.
+"""
+import argparse
+import configparser
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scan_dependencies import closure, find_program, flow_tasks, load_macros, scan_program
+from dagspec import compile_spec
+from domino_paths import DATASET_ROOT
+
+STATE_DIR = os.environ.get('SDTM_DIFF_STATE_DIR', f"{DATASET_ROOT}/{os.environ.get('DOMINO_PROJECT_NAME', '')}/sdtm_diff")
+CACHE_PATH = os.path.join(STATE_DIR, 'fingerprints.json')
+STATE_PATH = os.path.join(STATE_DIR, 'last_snapshot.json')
+DOMAIN_MAP_PATH = os.path.join(REPO_ROOT, 'Pipelines', 'sdtm_domains.cfg')
+
+DATASET_EXTENSIONS = ('.sas7bdat', '.xpt', '.parquet')
+
+
+def read_dataset(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    if ext == '.xpt':
+        return pd.read_sas(path, format='xport', encoding='latin-1')
+    return pd.read_sas(path, format='sas7bdat', encoding='infer')
+
+
+def domain_name(filename):
+    """Lower case domain of a dataset file, with SUPP-- datasets under their parent domain"""
+    name = os.path.splitext(filename)[0].lower()
+    return name[len('supp'):] if name.startswith('supp') and len(name) > len('supp') else name
+
+
+def data_hash(path):
+    df = read_dataset(path)
+    df = df[sorted(df.columns)]
+    digest = hashlib.sha256()
+    digest.update(json.dumps([(column, str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    """Data hashes of dataset files, keyed by path, size and modification time"""
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def get(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        if key not in self.hashes:
+            self.hashes[key] = data_hash(path)
+        return self.hashes[key]
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(self.hashes, f)
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError as err:
+            print(f'WARNING: Could not save the fingerprint cache to {self.path}: {err}')
+
+
+def fingerprint_snapshot(snapshot_path, cache):
+    """Return {domain: fingerprint} for the datasets in a snapshot folder"""
+    parts = {}
+    for filename in sorted(os.listdir(snapshot_path)):
+        if filename.lower().endswith(DATASET_EXTENSIONS):
+            parts.setdefault(domain_name(filename), []).append(cache.get(os.path.join(snapshot_path, filename)))
+    return {
+        domain: hashes[0] if len(hashes) == 1 else hashlib.sha256(''.join(hashes).encode()).hexdigest()
+        for domain, hashes in parts.items()
+    }
+
+
+def diff_fingerprints(previous, current):
+    """Return the domains that were added, removed or changed, in name order"""
+    return sorted(domain for domain in set(previous) | set(current) if previous.get(domain) != current.get(domain))
+
+
+def load_domain_map(map_path=DOMAIN_MAP_PATH):
+    """Return {domain: [program paths relative to the repository]} from the domain map"""
+    if not os.path.exists(map_path):
+        return {}
+    c = configparser.ConfigParser()
+    c.read(map_path)
+    if not c.has_section('domains'):
+        return {}
+    return {
+        domain.lower(): [program.strip().lower() for program in programs.split(',') if program.strip()]
+        for domain, programs in c.items('domains')
+    }
+
+
+def program_domains(command, macros, domain_map):
+    """The SDTM domains a task command's program reads, from the scan and the domain map"""
+    path = find_program(command)
+    if path is None:
+        return set()
+    domains = {member.lower() for library, member in scan_program(path, macros)[0] if library == 'SDTM'}
+    relative = os.path.relpath(path, REPO_ROOT).lower()
+    domains |= {domain for domain, programs in domain_map.items() if relative in programs}
+    return domains
+
+
+def affected_tasks(tasks, graph, changed):
+    """
+    Return the tasks to rerun, in task order.
+
+    :param tasks: Task ID -> SDTM domains it reads
+    :param graph: Task ID -> task IDs it depends on
+    :param changed: Changed domains
+    """
+    ancestors = closure(graph)
+    direct = {task_id for task_id, domains in tasks.items() if domains & set(changed)}
+    return [task_id for task_id in graph if task_id in direct or ancestors[task_id] & direct]
+
+
+def config_tasks(cfg_path, macros, domain_map):
+    spec = compile_spec(cfg_path)
+    graph = {task['task_id']: task['depends'] for task in spec['tasks']}
+    return {task['task_id']: program_domains(task['command'], macros, domain_map) for task in spec['tasks']}, graph
+
+
+def flow_module_tasks(flow_path, macros, domain_map):
+    tasks = flow_tasks(flow_path)
+    names = {variable: name for name, _, _, variable in tasks}
+    graph = {name: sorted({names[variable] for variable in inputs.values() if variable in names}) for name, _, inputs, _ in tasks}
+    return {name: program_domains(command, macros, domain_map) for name, command, _, _ in tasks}, graph
+
+
+def load_state(state_path=STATE_PATH):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(snapshot_path, fingerprints, state_path=STATE_PATH):
+    try:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(f'{state_path}.tmp', 'w') as f:
+            json.dump({'snapshot': os.path.abspath(snapshot_path), 'domains': fingerprints}, f, indent=4)
+        os.replace(f'{state_path}.tmp', state_path)
+    except OSError as err:
+        print(f'WARNING: Could not record the snapshot in {state_path}: {err}')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='List the pipeline tasks affected by the SDTM domains that changed between snapshots.')
+    parser.add_argument('snapshot', help='Folder of the new SDTM snapshot')
+    parser.add_argument('--previous', help='Folder of the previous snapshot (default: the last snapshot recorded)')
+    parser.add_argument('--cfg', action='append', default=[], help='multijob config to find the affected tasks of (repeatable)')
+    parser.add_argument('--flow', action='append', default=[], help='Flow module to find the affected tasks of (repeatable)')
+    parser.add_argument('--map', default=DOMAIN_MAP_PATH, help='Domain to program map')
+    parser.add_argument('--output', help='Write the affected tasks of the first --cfg here, one per line, for multijob --only')
+    parser.add_argument('--json', help='Also write the changed domains and affected tasks to this JSON file')
+    parser.add_argument('--record', action='store_true', help='Only record the snapshot as the one the outputs are built from, once the affected tasks have been rerun')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    cache = FingerprintCache()
+    current = fingerprint_snapshot(args.snapshot, cache)
+    if args.record:
+        cache.save()
+        save_state(args.snapshot, current)
+        print(f'Recorded {args.snapshot}')
+        sys.exit()
+    if args.previous:
+        previous = fingerprint_snapshot(args.previous, cache)
+    else:
+        state = load_state()
+        previous = state['domains'] if state else {}
+        print(f"Comparing with {state['snapshot'] if state else 'no previous snapshot'}")
+    cache.save()
+
+    changed = diff_fingerprints(previous, current)
+    print(f"Changed domains: {', '.join(changed) or 'none'}")
+
+    macros = load_macros()
+    domain_map = load_domain_map(args.map)
+    results = {'snapshot': args.snapshot, 'previous': args.previous, 'changed': changed, 'affected': {}}
+    for source in args.cfg + args.flow:
+        if source in args.cfg:
+            tasks, graph = config_tasks(source, macros, domain_map)
+        else:
+            tasks, graph = flow_module_tasks(source, macros, domain_map)
+        affected = affected_tasks(tasks, graph, changed)
+        results['affected'][source] = affected
+        print(f"{source}: {len(affected)} of {len(graph)} tasks affected: {', '.join(affected) or 'none'}")
+
+    if args.output and args.cfg:
+        with open(args.output, 'w') as f:
+            f.writelines(f'{task_id}\n' for task_id in results['affected'][args.cfg[0]])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,17 +1,23 @@
-import os
+import re
 from .flyte import DominoTask, Input, Output
-from typing import List, TypeVar
+from Pipelines.dagspec import MERGE_PROGRAM, shard_command
+from typing import Dict, List, TypeVar
 from flytekitplugins.domino.task import DominoJobConfig, DominoJobTask
 from flytekit import workflow, task
 from flytekit.types.file import FlyteFile
 from flytekit.types.directory import FlyteDirectory
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class ADAM:
     """Class for defining an ADAM dataset"""
     filename: str
     data: FlyteFile[TypeVar("sas7bdat")]
+    # Other datasets written by the same job, by output name, e.g. adsl.outputs["adsllkp"]
+    outputs: Dict[str, "ADAM"] = field(default_factory=dict)
+
+# Additional outputs are written by the program as outputs.<name>, so must be valid SAS member names
+OUTPUT_NAME = re.compile(r"^[a-z_][a-z0-9_]{0,31}$")
 
 def create_adam_data(
     name: str, 
@@ -19,7 +25,12 @@ def create_adam_data(
     environment: str = None, 
     hardware_tier: str = None, 
     sdtm_data_path: str = None, 
-    dependencies: List[ADAM] = None
+    dependencies: List[ADAM] = None,
+    shards: int = None,
+    shard_by: str = "usubjid",
+    additional_outputs: List[str] = None,
+    packed: bool = False,
+    artifact_format: str = None
 ) -> ADAM:
     """
     This method provides a standard interface for creating an ADAM dataset 
@@ -30,7 +41,12 @@ def create_adam_data(
     :param hardware_tier: The name of the hardware tier you want to use. If not specified, the project default will be used.
     :param sdtm_data_path: The root directory to the SDTM data
     :param adam_dataset: Any processed ADAM dataset to use in the generation.
-    :return: An ADAM dataset
+    :param shards: Split the derivation into this many jobs, each on the subjects selected by %shard_filter, and merge their outputs.
+    :param shard_by: The variables the merged dataset is sorted by.
+    :param additional_outputs: Names of other datasets the program writes in the same job, e.g. supporting or lookup datasets.
+    :param packed: Pack the outputs when DMV_ARTIFACTS is set. Only for datasets that are read by other tasks alone, not returned by the workflow.
+    :param artifact_format: Format of the outputs when DMV_ARTIFACTS is set, e.g. parquet for datasets only read by R or Python programs.
+    :return: An ADAM dataset, with the additional datasets in its outputs
     """
     # Define inputs
     inputs=[]
@@ -41,17 +57,62 @@ def create_adam_data(
 
     # Define outputs
     outputs = [Output(name="adam", type=FlyteFile[TypeVar("sas7bdat")])]
+    additional_outputs = [output.lower() for output in additional_outputs or []]
+    for output in additional_outputs:
+        if not OUTPUT_NAME.match(output) or output == "adam":
+            raise Exception(f"Invalid output name for {name}: {output}")
+        outputs.append(Output(name=output, type=FlyteFile[TypeVar("sas7bdat")]))
+    if len(set(additional_outputs)) != len(additional_outputs):
+        raise Exception(f"Output names of {name} are not unique")
 
-    results = DominoTask(
-        name=f"Create {name} dataset",
-        command=command, 
-        environment=environment,
-        hardware_tier=hardware_tier,
-        inputs=inputs,
-        outputs=outputs
-    )
+    if shards and shards > 1:
+        if additional_outputs:
+            raise Exception(f"{name} cannot be sharded, as only the adam output of a shard is merged")
+        # Each shard writes its subjects to its own adam output, which the merge step combines
+        merge_inputs = [
+            Input(name="merge_data", type=str, value=name.lower()),
+            Input(name="merge_by", type=str, value=shard_by),
+            Input(name="shards", type=int, value=shards),
+        ]
+        for shard in range(1, shards + 1):
+            shard_results = DominoTask(
+                name=f"Create {name} dataset (shard {shard} of {shards})",
+                command=shard_command(command, shard, shards),
+                environment=environment,
+                hardware_tier=hardware_tier,
+                inputs=inputs,
+                outputs=outputs,
+                packed_outputs=["adam"]
+            )
+            merge_inputs.append(Input(name=f"{name}_s{shard}.sas7bdat".lower(), type=FlyteFile[TypeVar("sas7bdat")], value=shard_results["adam"]))
 
-    return ADAM(filename=f"{name}.sas7bdat".lower(), data=results["adam"])
+        results = DominoTask(
+            name=f"Merge {name} shards",
+            command=MERGE_PROGRAM,
+            environment=environment,
+            hardware_tier=hardware_tier,
+            inputs=merge_inputs,
+            outputs=outputs,
+            packed_outputs=["adam"] if packed else None,
+            artifact_format=artifact_format
+        )
+    else:
+        results = DominoTask(
+            name=f"Create {name} dataset",
+            command=command, 
+            environment=environment,
+            hardware_tier=hardware_tier,
+            inputs=inputs,
+            outputs=outputs,
+            packed_outputs=[output.name for output in outputs] if packed else None,
+            artifact_format=artifact_format
+        )
+
+    return ADAM(
+        filename=f"{name}.sas7bdat".lower(),
+        data=results["adam"],
+        outputs={output: ADAM(filename=f"{output}.sas7bdat", data=results[output]) for output in additional_outputs}
+    )
 
 
  
\ No newline at end of file
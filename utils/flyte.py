@@ -1,10 +1,9 @@
 import os
+import shlex
+from functools import lru_cache
 from typing import List
-from flytekit.types.file import FlyteFile
-from flytekitplugins.domino.task import DominoJobConfig, DominoJobTask, GitRef, EnvironmentRevisionSpecification, EnvironmentRevisionType, DatasetSnapshot
-from flytekit.loggers import logger
+from flytekitplugins.domino.task import DominoJobConfig, DominoJobTask, GitRef
 from dataclasses import dataclass
-from domino import Domino
 
 @dataclass
 class Input:
@@ -19,6 +18,23 @@ class Output:
     name: str
     type: type
 
+@lru_cache(maxsize=None)
+def domino_client():
+    # Imported here, as the client is only needed to look up environments and tiers
+    from domino import Domino
+    project_owner = os.environ.get("DOMINO_PROJECT_OWNER")
+    project_name = os.environ.get("DOMINO_PROJECT_NAME")
+    return Domino(f"{project_owner}/{project_name}")
+
+# Every task of a workflow looks up the same few environments and tiers, so each is requested once
+@lru_cache(maxsize=None)
+def environment_ids():
+    return {env["name"]: env["id"] for env in domino_client().environments_list()["data"]}
+
+@lru_cache(maxsize=None)
+def hardware_tier_id(hardware_tier: str) -> str:
+    return domino_client().get_hardware_tier_id_from_name(hardware_tier)
+
 def DominoTask(
     name: str, 
     command: str, 
@@ -28,22 +44,32 @@ def DominoTask(
     volume_size_gb: int = 10,
     inputs: List[Input] = None,
     outputs: List[Output] = None,
+    packed_outputs: List[str] = None,
+    artifact_format: str = None,
 ) -> DominoJobTask:
 
-    api_key=os.environ.get('DOMINO_USER_API_KEY')
-    project_owner = os.environ.get("DOMINO_PROJECT_OWNER")
-    project_name = os.environ.get("DOMINO_PROJECT_NAME")
+    # Pass outputs between tasks as compressed, checksummed artifacts, see utilities/artifacts.py.
+    # Every task unpacks its inputs; only the outputs consumed by other tasks are packed.
+    default_format = os.environ.get("DMV_ARTIFACTS", "").lower()
+    if default_format in ("zstd", "gzip"):
+        artifacts = ["python", "utilities/artifacts.py", "run", "--format", artifact_format or default_format]
+        for output in packed_outputs or []:
+            artifacts += ["--pack", output]
+        command = f"{shlex.join(artifacts)} -- {command}"
 
-    domino = Domino(f"{project_owner}/{project_name}")
+    # Run under the profiler, which records the job's resource use for utilities/profile_task.py --report
+    if os.environ.get("DMV_PROFILE", "false").lower() == "true":
+        profiler = ["python", "utilities/profile_task.py", "--name", name]
+        if hardware_tier:
+            profiler += ["--tier", hardware_tier]
+        command = f"{shlex.join(profiler)} -- {command}"
 
     # Get environment ID
     environmentId = None
     if environment is None:
         print(f"Environment not specified for job: {name}. Project default will be used.")
     else:
-        for env in domino.environments_list()["data"]:
-            if env["name"] == environment:
-                environmentId = env["id"]
+        environmentId = environment_ids().get(environment)
         if environmentId is None:
             raise Exception("Environment name does not exist")
 
@@ -52,7 +78,7 @@ def DominoTask(
     if hardware_tier is None:
         print(f"Hardware tier not specified for job: {name}. Project default will be used.")
     else:
-        hardwareTierId = domino.get_hardware_tier_id_from_name(hardware_tier)
+        hardwareTierId = hardware_tier_id(hardware_tier)
 
     job_config = DominoJobConfig(
         Title=name,
@@ -12,7 +12,8 @@ def create_tfl_report(
     command: str, 
     dependencies: List[ADAM],
     environment: str = None,
-    hardware_tier: str = None
+    hardware_tier: str = None,
+    packed: bool = False
 ) -> FlyteFile[TypeVar("pdf")]:
     """
     This method provides a standard interface for creating a TFL report 
@@ -22,6 +23,7 @@ def create_tfl_report(
     :param environment: The name of the environment you want to use. If not specified, the project default will be used.
     :param hardware_tier: The name of the hardware tier you want to use. If not specified, the project default will be used.
     :param adam_dataset: The processed ADAM dataset to use for generating the report
+    :param packed: Pack the report when DMV_ARTIFACTS is set. Only for reports that are read by other tasks alone, not returned by the workflow.
     :return: A PDF files containing the final TFL report
     """
     # Define inputs
@@ -38,7 +40,8 @@ def create_tfl_report(
         environment=environment,
         hardware_tier=hardware_tier,
         inputs=inputs,
-        outputs=outputs
+        outputs=outputs,
+        packed_outputs=["report"] if packed else None
     )
 
     return results["report"]